@@ -1,41 +1,42 @@
 import os
 import hmac
 import hashlib
-import json
-import requests
 from werkzeug.exceptions import BadRequest, Forbidden
 import logging
 import re
+from github_client import github_client
 
 # Configure the logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def post_github_comment(repo_full_name, pull_number, comment, github_token):
-    url = f"https://api.github.com/repos/{repo_full_name}/issues/{pull_number}/comments"
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
-    payload = {"body": comment}
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()
+    return github_client(github_token).post_comment(repo_full_name, pull_number, comment)
 
 def verify_signature(payload_body, secret_token, signature_header):
-    """Verify that the payload was sent from GitHub by validating SHA256."""
+    """Verify that the payload was sent from GitHub by validating SHA256.
+
+    The signature is computed over the raw bytes of the request body, as sent by GitHub.
+    """
     if not signature_header:
         raise BadRequest(description="x-hub-signature-256 header is missing!")
 
-    if isinstance(payload_body, dict):
-        payload_body = json.dumps(payload_body, separators=(',', ':')).encode('utf-8')
-
     hash_object = hmac.new(secret_token.encode('utf-8'), msg=payload_body, digestmod=hashlib.sha256)
     expected_signature = "sha256=" + hash_object.hexdigest()
 
     if not hmac.compare_digest(expected_signature, signature_header):
         raise Forbidden(description="Request signatures didn't match!")
 
+def verify_api_token(authorization_header, api_token):
+    """Verify that a request to the API carries the API token as its bearer token.
+
+    Without a configured API token, all such requests are refused.
+    """
+    if not api_token:
+        raise Forbidden(description="The API token is not configured.")
+    if not hmac.compare_digest((authorization_header or '').encode('utf-8'), f"Bearer {api_token}".encode('utf-8')):
+        raise Forbidden(description="Invalid API token!")
+
 def extract_pull_request_info(data):
     """Extract necessary information from the pull request payload."""
     repo_full_name = data['repository']['full_name']
@@ -61,19 +62,22 @@ def validate_timestamp_path_component(component):
 
 def validate_user(data, github_token):
     """True if we can confirm that user is a member of org."""
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "Authorization": f"token {github_token:s}"}
     org = data["organization"]["login"]
     user = data["sender"]["login"]
-    url = f"https://api.github.com/orgs/{org:s}/members/{user:s}"
-    return bool(requests.get(url, headers=headers))
+    return github_client(github_token).is_org_member(org, user)
 
-def shall_process_event(data, github_token):
-    """True if PR shall be processed."""
+def is_review_command(data, command):
+    """True if the event is a review of a PR with `command` as its body."""
     return (data['action'] == 'submitted' and
             'review' in data and
             'body' in data['review'] and
-            data['review']['body'].strip().lower() == 'start behave test' and
-            'pull_request' in data and
-            validate_user(data, github_token))
+            data['review']['body'].strip().lower() == command and
+            'pull_request' in data)
+
+def shall_process_event(data, github_token):
+    """True if PR shall be processed."""
+    return is_review_command(data, 'start behave test') and validate_user(data, github_token)
+
+def shall_cancel_event(data, github_token):
+    """True if the jobs of the PR shall be cancelled."""
+    return is_review_command(data, 'cancel behave test') and validate_user(data, github_token)
@@ -0,0 +1,124 @@
+import os
+import time
+import tarfile
+import zipfile
+
+
+CHUNK_SIZE = 1024 * 1024
+# Files that are compressed already are stored as they are in zip archives
+STORED_EXTENSIONS = ('.png', '.webp', '.jpg', '.jpeg', '.gz', '.zip')
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+
+def time_tuple(mtime):
+    """Return a modification time as the date and time tuple of zip archives, which start in 1980."""
+    return max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+def file_chunks(path):
+    """Return a function yielding the content of a file in chunks."""
+    def chunks():
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                yield chunk
+    return chunks
+
+def redacted_chunks(path, secret):
+    """Return a function yielding the lines of a text file with a secret replaced."""
+    def chunks():
+        with open(path, 'rb') as file:
+            for line in file:
+                yield line.replace(secret.encode(), b"[REDACTED]") if secret else line
+    return chunks
+
+def run_archive_members(run_dir, prefix, log_path=None, redact=None):
+    """Return the members of the archive of a run as (name, modification time, size, chunks) tuples.
+
+    The archive contains all files of the run directory below `prefix` and,
+    if given, the log of the job with the secret `redact` replaced.
+    """
+    members = []
+    for root, dirs, files in os.walk(run_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            members.append((os.path.join(prefix, os.path.relpath(path, run_dir)), stat.st_mtime, stat.st_size,
+                            file_chunks(path)))
+    if log_path is not None and os.path.isfile(log_path):
+        chunks = redacted_chunks(log_path, redact)
+        # The size is needed before the content in a tar archive, the log is read twice
+        members.append((os.path.join(prefix, 'output.log'), os.stat(log_path).st_mtime,
+                        sum(len(chunk) for chunk in chunks()), chunks))
+    return members
+
+
+class _StreamBuffer:
+    """The file a zip archive is written to, emptied by the generator streaming the archive."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(members):
+    """Yield a zip archive of the members, only holding one chunk of a file in memory at a time.
+
+    The archive is written without seeking, the sizes and checksums of the
+    files follow their content. Files in an image or archive format are stored
+    without compression, all others are deflated.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, mtime, size, chunks in members:
+            info = zipfile.ZipInfo(name, date_time=time_tuple(mtime))
+            info.external_attr = 0o644 << 16
+            if name.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as target:
+                for chunk in chunks():
+                    target.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
+
+def stream_tar(members):
+    """Yield an uncompressed tar archive of the members, only holding one chunk of a file in memory at a time."""
+    for name, mtime, size, chunks in members:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0o644
+        yield info.tobuf(format=tarfile.PAX_FORMAT)
+        written = 0
+        for chunk in chunks():
+            written += len(chunk)
+            yield chunk
+        if written != size:
+            raise OSError(f"{name} changed while it was archived")
+        yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+    # The end of the archive is marked by two empty blocks
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+def stream_archive(members, archive_format):
+    """Yield an archive of the members in one of the `ARCHIVE_FORMATS`."""
+    if archive_format == 'zip':
+        return stream_zip(members)
+    return stream_tar(members)
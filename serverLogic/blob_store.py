@@ -0,0 +1,126 @@
+import os
+import hashlib
+import logging
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+BLOB_DIR = Config.BLOB_DIR
+HASH_CHUNK_SIZE = 1024 * 1024
+# The result directories of a run whose files are stored as blobs
+BLOB_KINDS = ('generated', 'difference', 'reference')
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Content-addressed store of the images of the runs.
+
+    Every distinct image content is stored once, as a file named after its
+    hash. The images in the run directories are hardlinks to these blobs, so
+    an image generated identically by many runs only takes up disk space
+    once. The link count of a blob is its reference count: a blob linked
+    from no run directory anymore is removed by `collect_garbage`.
+
+    The blob store must be on the same filesystem as the results. Blobs are
+    made read-only, as changing one would change the image in every run
+    referring to it.
+    """
+
+    def __init__(self, directory=BLOB_DIR):
+        self.directory = directory
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def ingest(self, path):
+        """Replace a file by a hardlink to the blob with the same content, adding the blob if it is new.
+
+        Returns the digest of the file and whether the blob already existed.
+        """
+        digest = file_digest(path)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        while True:
+            try:
+                # A new content: the file itself becomes the blob
+                os.link(path, blob)
+                os.chmod(blob, 0o444)
+                return digest, False
+            except FileExistsError:
+                pass
+            if os.path.samefile(path, blob):
+                return digest, True
+            temporary = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.link(blob, temporary)
+            except FileNotFoundError:
+                # The blob was collected in the meantime, add it again
+                continue
+            os.replace(temporary, path)
+            return digest, True
+
+    def ingest_run(self, run_dir, kinds=BLOB_KINDS):
+        """Store the images of a run as blobs, returning the number of bytes saved by sharing existing ones."""
+        saved = 0
+        for kind in kinds:
+            kind_dir = os.path.join(run_dir, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for entry in os.scandir(kind_dir):
+                if not entry.is_file(follow_symlinks=False) or not entry.name.endswith('.png'):
+                    continue
+                size = entry.stat().st_size
+                digest, existed = self.ingest(entry.path)
+                if existed:
+                    saved += size
+        return saved
+
+    def exclusive_bytes(self, run_dir, kinds=BLOB_KINDS):
+        """Return the size of the blobs only a run refers to, freed by `collect_garbage` once the run is removed.
+
+        A blob linked from a single run has two links, the image of the run
+        and the blob itself.
+        """
+        size = 0
+        for kind in kinds:
+            kind_dir = os.path.join(run_dir, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for entry in os.scandir(kind_dir):
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_nlink == 2:
+                        size += stat.st_size
+        return size
+
+    def collect_garbage(self):
+        """Remove the blobs no run directory refers to anymore, returning the number of bytes freed."""
+        if not os.path.isdir(self.directory):
+            return 0
+        freed = 0
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink > 1:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                freed += stat.st_size
+        return freed
@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import logging
+import time
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+CACHE_DIR_BASE = Config.CACHE_DIR_BASE
+
+# Host-side cache directories and where they are mounted in the job container
+PACKAGE_CACHES = {
+    'conda-pkgs': '/opt/cache/conda-pkgs',
+    'pip': '/opt/cache/pip',
+}
+# Entries used less than this many seconds ago are never pruned, they may belong to a running job
+PRUNE_GRACE_PERIOD = 3600
+
+
+def package_cache_docker_args(cache_dir_base=CACHE_DIR_BASE):
+    """Return the `docker run` arguments mounting the package caches into the container."""
+    args = []
+    for name, container_path in PACKAGE_CACHES.items():
+        host_path = os.path.join(cache_dir_base, name)
+        os.makedirs(host_path, exist_ok=True)
+        args += ['-v', f"{host_path}:{container_path}"]
+    args += ['-e', f"CONDA_PKGS_DIRS={PACKAGE_CACHES['conda-pkgs']}",
+             '-e', f"PIP_CACHE_DIR={PACKAGE_CACHES['pip']}"]
+    return args
+
+def package_cache_chown_cmd(uid, gid):
+    """Return a shell command handing the files written by the container back to the server user."""
+    paths = ' '.join(PACKAGE_CACHES.values())
+    return f"find {paths} \\( ! -user {uid} -o ! -group {gid} \\) -exec chown {uid}:{gid} {{}} +"
+
+def _entry_usage(path):
+    """Return the size and the time of last use of a file or directory tree."""
+    stat = os.lstat(path)
+    size = stat.st_size
+    if os.path.isdir(path) and not os.path.islink(path):
+        # The access time of a directory is refreshed by walking it, so only its files tell if it was used
+        last_used = stat.st_mtime
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    file_stat = os.lstat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                size += file_stat.st_size
+                last_used = max(last_used, file_stat.st_atime, file_stat.st_mtime)
+    else:
+        last_used = max(stat.st_atime, stat.st_mtime)
+    return size, last_used
+
+def _remove_entry(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
+
+def prune_cache(directory, max_bytes, max_age_days, per_file=False, now=None):
+    """Prune a cache directory by age and size.
+
+    Entries not used for more than `max_age_days` are removed first.  If the
+    cache is still larger than `max_bytes`, the least recently used entries are
+    removed until it fits.  By default the top-level entries of the directory
+    are the unit of removal, which keeps extracted conda packages intact.  With
+    `per_file` every file is handled on its own, which suits the pip cache.
+    Returns the number of bytes freed.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    now = time.time() if now is None else now
+    entries = []
+    if per_file:
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                entries.append((path, *_entry_usage(path)))
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            entries.append((path, *_entry_usage(path)))
+
+    entries.sort(key=lambda entry: entry[2])
+    total = sum(entry[1] for entry in entries)
+    freed = 0
+    for path, size, last_used in entries:
+        age = now - last_used
+        if age < PRUNE_GRACE_PERIOD:
+            # Entries are sorted by last use, all following entries are even younger
+            break
+        if age <= max_age_days * 86400 and total <= max_bytes:
+            continue
+        try:
+            _remove_entry(path)
+        except OSError as e:
+            logger.error(f"Error while pruning cache entry {path}: {e}")
+            continue
+        total -= size
+        freed += size
+
+    if per_file:
+        for root, dirs, files in os.walk(directory, topdown=False):
+            if root != directory and not os.listdir(root):
+                os.rmdir(root)
+    return freed
+
+def prune_package_caches(cache_dir_base=CACHE_DIR_BASE,
+                         max_bytes=Config.PACKAGE_CACHE_MAX_BYTES,
+                         max_age_days=Config.PACKAGE_CACHE_MAX_AGE_DAYS):
+    """Prune the package caches shared by the job containers and the runner image builds."""
+    # The quota is split evenly between the caches
+    max_bytes_per_cache = max_bytes // (len(PACKAGE_CACHES) + 1)
+    for name in PACKAGE_CACHES:
+        directory = os.path.join(cache_dir_base, name)
+        freed = prune_cache(directory, max_bytes_per_cache, max_age_days, per_file=(name == 'pip'))
+        if freed:
+            print(f"Pruned {freed} bytes from the {name} cache.")
+
+    # The package cache of the runner image builds is a BuildKit cache mount
+    try:
+        subprocess.check_call(['docker', 'builder', 'prune', '-f',
+                               '--filter', 'type=exec.cachemount',
+                               '--filter', f'until={max_age_days * 24}h',
+                               '--keep-storage', str(max_bytes_per_cache)],
+                              stdout=subprocess.DEVNULL)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error while pruning the build cache: {e}")
@@ -10,3 +10,56 @@ class Config:
     SERVER_LOGIC_PATH = os.getenv('SERVER_LOGIC_PATH', f'{PROJECT_PATH}/serverLogic')
     HOST_URL = os.getenv('HOST_URL', 'https://image-test.int-pytroll-development.s.ewcloud.host')
     BEHAVE_DIR = os.getenv('BEHAVE_DIR', f'/satpy/tests/behave')
+    RUNNER_IMAGE_NAME = os.getenv('RUNNER_IMAGE_NAME', 'pytroll-image-comparison-runner')
+    RUNNER_DOCKERFILE = os.getenv('RUNNER_DOCKERFILE', f'{SERVER_LOGIC_PATH}/runner/Dockerfile')
+    RUNNER_PACKAGES = os.getenv('RUNNER_PACKAGES', 'python=3.12 satpy hdf5plugin py-opencv behave')
+    MINIFORGE_VERSION = os.getenv('MINIFORGE_VERSION', '24.11.0-0')
+    CACHE_DIR_BASE = os.getenv('CACHE_DIR_BASE', f'{CLONE_DIR_BASE}/image-comparison-cache')
+    PACKAGE_CACHE_MAX_BYTES = int(os.getenv('PACKAGE_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+    PACKAGE_CACHE_MAX_AGE_DAYS = int(os.getenv('PACKAGE_CACHE_MAX_AGE_DAYS', 30))
+    GIT_MIRROR_BASE = os.getenv('GIT_MIRROR_BASE', f'{CLONE_DIR_BASE}/git-mirrors')
+    # The build lock of the runner image and the times its tags were last used, shared by all server processes
+    RUNNER_IMAGE_STATE_DIR = os.getenv('RUNNER_IMAGE_STATE_DIR', f'{CLONE_DIR_BASE}/runner-image-state')
+    JOB_DIR_BASE = os.getenv('JOB_DIR_BASE', f'{CLONE_DIR_BASE}/jobs')
+    JOB_DB_PATH = os.getenv('JOB_DB_PATH', f'{CLONE_DIR_BASE}/image-comparison-jobs.sqlite')
+    RUNNER_SLOTS = int(os.getenv('RUNNER_SLOTS', 2))
+    JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+    JOB_DEBOUNCE = int(os.getenv('JOB_DEBOUNCE', 20))
+    JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 300))
+    # Running jobs are stopped after this many seconds, 0 lets them run until they end
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 3600))
+    DATA_DIR = os.getenv('DATA_DIR', f'{PROJECT_PATH}/data')
+    USE_RESULT_CACHE = os.getenv('USE_RESULT_CACHE', 'True') == 'True'
+    REFERENCE_DATA_VERSION = os.getenv('REFERENCE_DATA_VERSION')
+    SCENARIO_SELECTION = os.getenv('SCENARIO_SELECTION', 'changed')
+    SCENARIO_FALLBACK = os.getenv('SCENARIO_FALLBACK', 'all')
+    SCENARIO_RULES = os.getenv('SCENARIO_RULES', f'{SERVER_LOGIC_PATH}/scenario_rules.json')
+    BEHAVE_SHARDS = int(os.getenv('BEHAVE_SHARDS', 1))
+    # A full-disk ABI image at 0.5 km has 21696 x 21696 pixels
+    MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 500_000_000))
+    THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', f'{CLONE_DIR_BASE}/image-comparison-thumbnails')
+    THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 480))
+    THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp')
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+    THUMBNAIL_CACHE_MAX_AGE_DAYS = int(os.getenv('THUMBNAIL_CACHE_MAX_AGE_DAYS', 60))
+    TILE_DIR = os.getenv('TILE_DIR', f'{CLONE_DIR_BASE}/image-comparison-tiles')
+    TILE_CACHE_MAX_BYTES = int(os.getenv('TILE_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+    TILE_CACHE_MAX_AGE_DAYS = int(os.getenv('TILE_CACHE_MAX_AGE_DAYS', 14))
+    # Must be on the same filesystem as TEST_RESULTS_BASE_PATH and JOB_DIR_BASE, the images of the runs are hardlinks into it
+    BLOB_DIR = os.getenv('BLOB_DIR', f'{CLONE_DIR_BASE}/image-comparison-blobs')
+    RESULTS_TRASH_DIR = os.getenv('RESULTS_TRASH_DIR', f'{CLONE_DIR_BASE}/image-comparison-trash')
+    RESULTS_MAX_AGE_DAYS = int(os.getenv('RESULTS_MAX_AGE_DAYS', 60))
+    RESULTS_MIN_FREE_BYTES = int(os.getenv('RESULTS_MIN_FREE_BYTES', 20 * 1024 ** 3))
+    RESULTS_KEEP_PER_PR = int(os.getenv('RESULTS_KEEP_PER_PR', 1))
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))
+    REFERENCE_DIR = os.getenv('REFERENCE_DIR', f'{DATA_DIR}/reference_images')
+    REFERENCE_IMAGE_NAME = os.getenv('REFERENCE_IMAGE_NAME', 'reference_image_{key}.png')
+    USE_X_ACCEL_REDIRECT = os.getenv('USE_X_ACCEL_REDIRECT', 'False') == 'True'
+    RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', 50))
+    DIRECTORY_PAGE_SIZE = int(os.getenv('DIRECTORY_PAGE_SIZE', 200))
+    COMMENT_COALESCE_DELAY = int(os.getenv('COMMENT_COALESCE_DELAY', 5))
+    GITHUB_TIMEOUT = int(os.getenv('GITHUB_TIMEOUT', 10))
+    GITHUB_MEMBERSHIP_TTL = int(os.getenv('GITHUB_MEMBERSHIP_TTL', 600))
+    GITHUB_MAX_RATE_LIMIT_WAIT = int(os.getenv('GITHUB_MAX_RATE_LIMIT_WAIT', 60))
+    METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+    LOG_STREAM_MAX_DURATION = int(os.getenv('LOG_STREAM_MAX_DURATION', 20))
@@ -1,9 +1,21 @@
 import os
+import json
+import functools
 import subprocess
 import shutil
+import shlex
 import logging
+import time
+from datetime import datetime, timedelta
 from api_utils import post_github_comment
 from config import Config
+from runner_image import ensure_runner_image
+from cache_utils import package_cache_docker_args, package_cache_chown_cmd, prune_package_caches
+from git_cache import update_mirror, checkout_pull_request
+from scenario_selection import behave_locations, all_scenario_locations
+from job_events import phase_marker
+from job_timings import END_PHASE, write_timings
+from process_utils import JobCancelled, check_cancelled, run_cancellable
 
 
 # configure the logger
@@ -11,9 +23,26 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 HOST_URL = Config.HOST_URL
 BEHAVE_DIR = Config.BEHAVE_DIR
-miniforge_dir = "https://github.com/conda-forge/miniforge/releases/download/24.11.0-0/"
-miniforge_exec = "Miniforge3-24.11.0-0-Linux-x86_64.sh"
-miniforge = miniforge_dir + miniforge_exec
+TEST_RESULTS_BASE_PATH = Config.TEST_RESULTS_BASE_PATH
+REFERENCE_DIR = Config.REFERENCE_DIR
+REFERENCE_IMAGE_NAME = Config.REFERENCE_IMAGE_NAME
+TIMESTAMP_FORMAT = '%Y-%m-%d-%H-%M-%S'
+# The script running the shards of a job, mounted into the job container
+SHARD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runner', 'run_shards.py')
+CONTAINER_SHARD_SCRIPT = '/opt/run_shards.py'
+
+def stop_container(container_name, timeout=5):
+    """Stop a container if it is running, killing it after `timeout` seconds."""
+    subprocess.call(['docker', 'stop', '-t', str(timeout), container_name],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def run_container(args, container_name, cancel=None, poll_interval=1):
+    """Run a `docker run` command until the container exits or the `cancel` event is set.
+
+    A cancelled container is stopped right away and JobCancelled is raised.
+    Raises CalledProcessError if the container exits with an error.
+    """
+    run_cancellable(args, cancel, on_cancel=lambda: stop_container(container_name), poll_interval=poll_interval)
 
 def remove_existing_container(container_name):
     try:
@@ -22,6 +51,11 @@ def remove_existing_container(container_name):
     except subprocess.CalledProcessError:
         print(f"No existing Container with name {container_name} found.")
 
+def container_exists(container_name):
+    """Return whether a container with the given name exists."""
+    return subprocess.run(['docker', 'container', 'inspect', container_name],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
 def clear_directory(directory):
     try:
         if os.path.exists(directory):
@@ -51,91 +85,339 @@ def mask_sensitive_data(output, sensitive_data):
     """Replaces sensitive data by wildcard."""
     return output.replace(sensitive_data, "[REDACTED]")
 
-def clone_and_test_pull_request(repo_full_name, pull_number, clone_url, branch_name, clone_dir, ext_data_dir, user, github_token):
-    """Clone a specific branch from a Git repository, uninstall satpy and reinstall the new pull_branch version, then run tests."""
+def copy_reference_images(run_dir, reference_dir=REFERENCE_DIR):
+    """Copy the reference images the generated images of a run were compared against into its `reference` directory."""
+    generated_dir = os.path.join(run_dir, 'generated')
+    if not os.path.isdir(generated_dir):
+        return
+    target_dir = os.path.join(run_dir, 'reference')
+    os.makedirs(target_dir, exist_ok=True)
+    for name in os.listdir(generated_dir):
+        if not (name.startswith('generated_') and name.endswith('.png')):
+            continue
+        reference = os.path.join(reference_dir, REFERENCE_IMAGE_NAME.format(key=name[len('generated_'):-len('.png')]))
+        if os.path.isfile(reference):
+            shutil.copy2(reference, target_dir)
+
+def publish_results(job_results_dir, results_base_path=TEST_RESULTS_BASE_PATH, blob_store=None,
+                    reference_dir=REFERENCE_DIR):
+    """Move the result directories written by a job to the results served by the website.
+
+    Every job writes into its own results directory, so two jobs started in the
+    same second cannot mix their results. Should the timestamp of a result
+    already be taken, the next free second is used instead. The reference
+    images are kept with the results, as the reference data changes over time.
+    With a blob store, the images are stored as blobs before they are
+    published, so a served file is never replaced. Returns the timestamps of
+    the published results.
+    """
+    source_dir = os.path.join(job_results_dir, 'image_comparison')
+    target_dir = os.path.join(results_base_path, 'image_comparison')
+    if not os.path.isdir(source_dir):
+        return []
+    os.makedirs(target_dir, exist_ok=True)
+
+    published = []
+    for timestamp in sorted(os.listdir(source_dir)):
+        try:
+            time = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            logger.error(f"Unexpected result directory {timestamp} in {source_dir}")
+            continue
+        while True:
+            target_timestamp = time.strftime(TIMESTAMP_FORMAT)
+            try:
+                # os.rename does not replace an existing directory unless it is empty
+                os.mkdir(os.path.join(target_dir, target_timestamp))
+            except FileExistsError:
+                time += timedelta(seconds=1)
+                continue
+            break
+        try:
+            copy_reference_images(os.path.join(source_dir, timestamp), reference_dir)
+        except OSError as e:
+            logger.error(f"Error while copying the reference images of {timestamp}: {e}")
+        if blob_store is not None:
+            try:
+                saved = blob_store.ingest_run(os.path.join(source_dir, timestamp))
+                print(f"Deduplicated the images of {timestamp}, {saved} bytes saved.")
+            except OSError as e:
+                logger.error(f"Error while deduplicating the images of {timestamp}: {e}")
+        os.rename(os.path.join(source_dir, timestamp), os.path.join(target_dir, target_timestamp))
+        published.append(target_timestamp)
+        print(f"Test results {target_timestamp} published.")
+    return published
+
+def merge_result_dirs(job_results_dir, shard_dirs):
+    """Merge the result directories written by the shards of a job into a single one of the job results.
+
+    The first directory is moved into the job results and the others are
+    merged into it in their order. The test results texts are concatenated,
+    all other files are moved over.
+    """
+    if not shard_dirs:
+        return
+    target_dir = os.path.join(job_results_dir, 'image_comparison')
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, os.path.basename(shard_dirs[0]))
+    os.rename(shard_dirs[0], target)
+    for shard_dir in shard_dirs[1:]:
+        for root, dirs, files in os.walk(shard_dir):
+            target_root = os.path.join(target, os.path.relpath(root, shard_dir))
+            os.makedirs(target_root, exist_ok=True)
+            for name in files:
+                if name == 'test_results.txt':
+                    with open(os.path.join(root, name), 'r') as shard_file, open(os.path.join(target_root, name), 'a') as target_file:
+                        target_file.write(shard_file.read())
+                else:
+                    os.replace(os.path.join(root, name), os.path.join(target_root, name))
+        shutil.rmtree(shard_dir)
+    print(f"Results of {len(shard_dirs)} shards merged into {os.path.basename(target)}.")
+
+def split_into_shards(locations, shards):
+    """Split the behave locations into at most `shards` shards, round-robin."""
+    return [locations[shard::shards] for shard in range(min(shards, len(locations)))]
+
+def behave_command(locations, shards=1, log_file=None, junit_dir=None, data_dir=None, work_dir=None, status_file=None):
+    """Return the command running the given behave locations, or all scenarios if None.
+
+    With several shards, the shards are run as parallel behave processes by
+    `runner/run_shards.py`, which appends their output to the log file with
+    the shard as line prefix, runs every shard in `work_dir` with its own copy
+    of `data_dir` and writes the results directory and exit code of every
+    shard to the status file. The command fails if a shard crashed without
+    results. If a JUnit directory is given, behave writes its reports
+    there, into one subdirectory per shard.
+    """
+    if shards <= 1 or not locations:
+        command = "behave"
+        if junit_dir is not None:
+            command += f" --junit --junit-directory {junit_dir}"
+        if locations is None:
+            return command
+        return command + " " + " ".join(shlex.quote(location) for location in locations)
+    command = (f"python {CONTAINER_SHARD_SCRIPT} --data-dir {data_dir} --work-dir {work_dir} "
+               f"--log {log_file} --status {status_file}")
+    if junit_dir is not None:
+        command += f" --junit-dir {junit_dir}"
+    for shard_locations in split_into_shards(locations, shards):
+        command += f" --shard {shlex.quote(','.join(shard_locations))}"
+    return command
+
+def read_shard_statuses(clone_dir):
+    """Return the status of every shard of a job written by `runner/run_shards.py`, or an empty list."""
+    try:
+        with open(os.path.join(clone_dir, "shards.json"), 'r') as status_file:
+            return json.load(status_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error while reading the status of the shards: {e}")
+        return []
+
+def failed_shards(statuses):
+    """Return the shards that ended without results or with an error other than failing scenarios.
+
+    Behave exits with 1 if scenarios failed and with other codes if it could not run them.
+    """
+    return [status['shard'] for status in statuses if status['results_dir'] is None or status['returncode'] not in (0, 1)]
+
+def log_phase(clone_dir, phase):
+    """Mark the start of a phase of a job in its log, for the progress shown while it runs and its timings."""
+    with open(os.path.join(clone_dir, "output.log"), 'a') as log_file:
+        log_file.write(phase_marker(phase, time.time()) + "\n")
+
+def phase_marker_cmd(phase, log_file):
+    """Return the command marking the start of a phase run in the job container."""
+    return f'echo "{phase_marker(phase)} $(date +%s.%N)" >> {log_file}'
+
+def clone_and_test_pull_request(repo_full_name, pull_number, clone_url, branch_name, clone_dir, ext_data_dir, user, github_token,
+                                container_name='clone-repo-image', base_sha=None, post_comment=None, cancel=None,
+                                blob_store=None):
+    """Check out a pull request from the local mirror, install the pull_branch version of satpy into the runner image, then run tests.
+
+    If the commit the pull request is based on is given, only the scenarios
+    affected by the changes of the pull request are run. The status messages
+    are posted with `post_comment`, by default as new comments. Once the
+    `cancel` event is set, the build of the runner image, the fetch and the
+    container of the job are stopped within seconds and JobCancelled is raised.
+    The images of the results are stored in `blob_store`, if given.
+    Returns the tested commit SHA and the timestamps of the published results.
+    """
+    if post_comment is None:
+        post_comment = functools.partial(post_github_comment, repo_full_name, pull_number, github_token=github_token)
+    container_created = False
     try:
         app_dir = '/app'
         data_dir = os.path.join(app_dir, "ext_data")
         repo_dir = os.path.join(app_dir, "repository")
         app_log_file = os.path.join(app_dir, "output.log")
+        app_junit_dir = os.path.join(app_dir, "junit")
 
         clear_directory(clone_dir)
+        remove_existing_container(container_name)
+
+        # The results of the job are mounted over the results directory of the data and published afterwards
+        job_results_dir = os.path.join(clone_dir, "test_results")
+        os.makedirs(job_results_dir)
 
-        # Add the GitHub token to the clone URL
-        auth_clone_url = clone_url.replace("https://", f"https://{github_token}@")
+        check_cancelled(cancel)
+        log_phase(clone_dir, 'runner_image')
+        # The conda environment is baked into the runner image, it is only built when the dependency spec changes
+        runner_image = ensure_runner_image(cancel)
 
-        logger.debug(f"Cloning repository {clone_url} branch {branch_name} into {repo_dir}")
+        check_cancelled(cancel)
+        logger.debug(f"Checking out repository {clone_url} branch {branch_name} into {repo_dir}")
+        log_phase(clone_dir, 'checkout')
 
+        # Only the new commits are fetched into the mirror, the checkout shares its objects
+        with open(os.path.join(clone_dir, "output.log"), 'a') as host_log_file:
+            mirror = update_mirror(repo_full_name, pull_number, github_token, log_file=host_log_file, cancel=cancel)
+            head_sha = checkout_pull_request(mirror, pull_number, branch_name, os.path.join(clone_dir, "repository"),
+                                             log_file=host_log_file, cancel=cancel)
+
+        # Only run the scenarios the changes of the pull request can affect
+        check_cancelled(cancel)
+        log_phase(clone_dir, 'selection')
+        locations = None
+        if Config.SCENARIO_SELECTION == 'changed':
+            locations = behave_locations(os.path.join(clone_dir, "repository"), os.path.join(clone_dir, "repository") + BEHAVE_DIR,
+                                         base_sha, Config.SCENARIO_RULES, Config.SCENARIO_FALLBACK)
+        if locations == []:
+            message = "The changes of this pull request do not affect any of the behave scenarios, no tests were run."
+            print(message)
+            post_comment(message)
+            return head_sha, []
+
+        # Split the scenarios into shards run in parallel
+        shards = Config.BEHAVE_SHARDS
+        if shards > 1 and locations is None:
+            locations = all_scenario_locations(os.path.join(clone_dir, "repository") + BEHAVE_DIR) or None
+        sharded = shards > 1 and bool(locations)
 
         # Run all commands in a single docker run invocation
         uid = os.getuid()
         gid = os.getgid()
 
         full_cmd = (
-            f"touch {app_log_file} && "
-            f"apt-get update >> {app_log_file} 2>&1 && "
-            f"apt-get install -y wget git >> {app_log_file} 2>&1 && "
-            f"wget -q {miniforge} >> {app_log_file} 2>&1 && "
-            f"bash {miniforge_exec} -b -p /miniforge >> {app_log_file} 2>&1 && "
-            f"/miniforge/bin/conda init >> {app_log_file} 2>&1 && "
-            f"source /root/.bashrc >> {app_log_file} 2>&1 && "
-            f"conda activate >> {app_log_file} 2>&1 && "
-            f"mamba create -y -n py312 python=3.12 satpy hdf5plugin py-opencv behave >> {app_log_file} 2>&1 && "
-            f"conda activate py312 >> {app_log_file} 2>&1 && "
-            f"git clone {auth_clone_url} --branch {branch_name} {repo_dir} >> {app_log_file} 2>&1 && "
+            f"{phase_marker_cmd('install', app_log_file)} && "
             f"pip install -e {repo_dir} >> {app_log_file} 2>&1 && "
+            f"{phase_marker_cmd('behave', app_log_file)} && "
             f"cd {repo_dir}{BEHAVE_DIR} && "
-            f"behave >> {app_log_file} 2>&1 || true && "
-            f"chown -R {uid}:{gid} /app >> {app_log_file} 2>&1"
+            f"{behave_command(locations, shards, app_log_file, app_junit_dir, data_dir, f'{app_dir}/shards', f'{app_dir}/shards.json')} "
+            f">> {app_log_file} 2>&1; tests_status=$?; "
+            f"{phase_marker_cmd('cleanup', app_log_file)} && "
+            f"chown -R {uid}:{gid} /app >> {app_log_file} 2>&1 && "
+            f"{package_cache_chown_cmd(uid, gid)} >> {app_log_file} 2>&1 && "
+            # Failing scenarios make behave exit with 1, only a shard crashed without results fails the job
+            f"exit {'$tests_status' if sharded else 0}"
         )
 
-        subprocess.check_call([
-            'docker', 'run', '--name', 'clone-repo-image',
+        check_cancelled(cancel)
+        log_phase(clone_dir, 'container')
+        container_created = True
+        run_container([
+            'docker', 'run', '--name', container_name,
             '-v', f"{clone_dir}:/app",
             '-v', f"{ext_data_dir}:{data_dir}",
-            'python:3.10-slim', 'bash', '-c', full_cmd
-        ])
+            '-v', f"{job_results_dir}:{data_dir}/test_results",
+            '-v', f"{mirror}:{mirror}:ro",
+            '-v', f"{SHARD_SCRIPT}:{CONTAINER_SHARD_SCRIPT}:ro",
+            *package_cache_docker_args(),
+            runner_image, 'bash', '-c', full_cmd
+        ], container_name, cancel)
+
+        print("Container successfully started, directory cleared, repository checked out, Satpy installed, and tests executed.")
+        log_phase(clone_dir, 'publish')
+        incomplete = []
+        if sharded:
+            statuses = read_shard_statuses(clone_dir)
+            for status in statuses:
+                print(f"Shard {status['shard']} exited with code {status['returncode']}, results in {status['results_dir']}.")
+            incomplete = failed_shards(statuses)
+            shards_dir = os.path.join(clone_dir, 'shards')
+            merge_result_dirs(job_results_dir, [os.path.join(shards_dir, status['results_dir'])
+                                                for status in statuses if status['results_dir']])
+            shutil.rmtree(shards_dir, ignore_errors=True)
+        # Published results are never replaced, so they get the timings up to their publishing
+        try:
+            results_dir = os.path.join(job_results_dir, 'image_comparison')
+            write_timings(clone_dir, [os.path.join(results_dir, timestamp) for timestamp in sorted(os.listdir(results_dir))]
+                          if os.path.isdir(results_dir) else [])
+        except Exception as timings_error:
+            logger.error(f"Error while writing the timings of the results: {timings_error}")
+        published = publish_results(job_results_dir, blob_store=blob_store)
+        results_url = f"{HOST_URL}/{published[-1]}" if published else HOST_URL
+        message = f"The testing process was executed successfully. See the test results for this pull request [here]({results_url})!"
+        if incomplete:
+            logger.error(f"The shards {incomplete} of the tests stopped with an error.")
+            message += f" The shards {', '.join(str(shard) for shard in incomplete)} of the tests stopped with an error, the results are incomplete."
+        post_comment(message)
+        return head_sha, published
 
-        print("Container successfully started, directory cleared, repository cloned, dependencies installed, Satpy installed, and tests executed.")
-        post_github_comment(repo_full_name, pull_number, f"The testing process was executed successfully. See the test results for this pull request [here]({HOST_URL})!", github_token)
+    except JobCancelled:
+        # The partial results are not published, the job is only marked as cancelled in its log and timings
+        log_phase(clone_dir, 'cancelled')
+        raise
 
     except subprocess.CalledProcessError as e:
+        if cancel is not None and cancel.is_set():
+            # The container exited while it was being stopped
+            log_phase(clone_dir, 'cancelled')
+            raise JobCancelled() from e
         error_message = mask_sensitive_data(f"Error while cloning the repository: {e}", github_token)
         print(error_message)
         logger.error(error_message)
 
-        try:
-            logs = subprocess.check_output(['docker', 'logs', 'clone-repo-image'])
-            print(f"Logs for clone-repo-image:\n{logs.decode('utf-8')}")
-            error_message += mask_sensitive_data(f"\nLogs for clone-repo-image:\n{logs.decode('utf-8')}", github_token)
-        except subprocess.CalledProcessError as log_error:
-            log_error_message = mask_sensitive_data(f"Error while retrieving the container logs: {log_error}", github_token)
-            print(log_error_message)
-            error_message += f"\n{log_error_message}"
+        # Before the job container was created, e.g. when the runner image or the mirror failed, it has no logs
+        if container_created and container_exists(container_name):
+            try:
+                logs = subprocess.check_output(['docker', 'logs', container_name])
+                print(f"Logs for {container_name}:\n{logs.decode('utf-8')}")
+                error_message += mask_sensitive_data(f"\nLogs for {container_name}:\n{logs.decode('utf-8')}", github_token)
+            except subprocess.CalledProcessError as log_error:
+                log_error_message = mask_sensitive_data(f"Error while retrieving the container logs: {log_error}", github_token)
+                print(log_error_message)
+                error_message += f"\n{log_error_message}"
 
-        try:
-            subprocess.check_call([
-                'docker', 'cp', 'clone-repo-image:/app/output.log', f"{clone_dir}/output.log"
-            ])
-            with open(f"{clone_dir}/output.log", 'r') as log_file:
-                output_log_content = log_file.read()
-                print(output_log_content)
-                error_message += f"\nOutput Log:\n{output_log_content}"
-        except Exception as copy_error:
-            copy_error_message = mask_sensitive_data(f"Error while retrieving the output log file: {copy_error}", github_token)
-            print(copy_error_message)
-            error_message += f"\n{copy_error_message}"
-
-        post_github_comment(repo_full_name, pull_number, f"An error occurred during the process.", github_token)
+            try:
+                subprocess.check_call([
+                    'docker', 'cp', f"{container_name}:/app/output.log", f"{clone_dir}/output.log"
+                ])
+                with open(f"{clone_dir}/output.log", 'r') as log_file:
+                    output_log_content = log_file.read()
+                    print(output_log_content)
+                    error_message += f"\nOutput Log:\n{output_log_content}"
+            except Exception as copy_error:
+                copy_error_message = mask_sensitive_data(f"Error while retrieving the output log file: {copy_error}", github_token)
+                print(copy_error_message)
+                error_message += f"\n{copy_error_message}"
+
+        post_comment("An error occurred during the process.")
         raise Exception(mask_sensitive_data(f"Error while cloning the repository: {e}", github_token))
 
     finally:
         try:
-            subprocess.check_call(['docker', 'stop', 'clone-repo-image'])
-            subprocess.check_call(['docker', 'rm', 'clone-repo-image'])
-            print("Container successfully stopped and removed.")
+            if container_created and container_exists(container_name):
+                subprocess.check_call(['docker', 'stop', '-t', '5', container_name])
+                subprocess.check_call(['docker', 'rm', '-f', container_name])
+                print("Container successfully stopped and removed.")
         except subprocess.CalledProcessError as cleanup_error:
             cleanup_error_message = mask_sensitive_data(f"Error while stopping or removing the container: {cleanup_error}", github_token)
             print(cleanup_error_message)
             logger.error(cleanup_error_message)
-            post_github_comment(repo_full_name, pull_number, f"An error occurred during the process.", github_token)
+            post_comment("An error occurred during the process.")
+
+        # The complete timings are kept with the log of the job
+        try:
+            log_phase(clone_dir, END_PHASE)
+            write_timings(clone_dir)
+        except Exception as timings_error:
+            logger.error(f"Error while writing the timings of the job: {timings_error}")
+
+        # Only the log of the job is kept, the checkout can be recreated from the mirror
+        shutil.rmtree(os.path.join(clone_dir, "repository"), ignore_errors=True)
+
+        # The caches are kept across jobs, only entries that were not used for a long time are removed
+        try:
+            prune_package_caches()
+        except Exception as prune_error:
+            logger.error(f"Error while pruning the package caches: {prune_error}")
@@ -0,0 +1,60 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+# The number of directory listings kept in memory by each server process
+MAX_CACHED_LISTINGS = 256
+SORT_KEYS = {
+    'name': lambda entry: entry['name'],
+    'size': lambda entry: entry['size'],
+    'mtime': lambda entry: entry['mtime'],
+}
+
+
+class DirectoryListings:
+    """Listings of directories, cached in memory until the directory is modified.
+
+    A listing is made in a single pass with os.scandir, which gets the type
+    of the entries without a stat call each. The listing is cached with the
+    modification time of the directory, so it is only made again when
+    entries were added, removed or renamed.
+    """
+
+    def __init__(self, max_cached=MAX_CACHED_LISTINGS):
+        self.max_cached = max_cached
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def list(self, path):
+        """Return the entries of a directory with their name, type, size and modification time."""
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == mtime_ns:
+                self._listings.move_to_end(path)
+                return cached[1]
+
+        entries = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append({'name': entry.name, 'is_dir': entry.is_dir(), 'size': stat.st_size,
+                                'mtime': stat.st_mtime})
+
+        with self._lock:
+            self._listings[path] = (mtime_ns, entries)
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.max_cached:
+                self._listings.popitem(last=False)
+        return entries
+
+    def page(self, path, sort='name', reverse=False, page=1, per_page=100):
+        """Return a sorted page of the entries of a directory, directories first, and the number of pages."""
+        entries = sorted(self.list(path), key=SORT_KEYS[sort], reverse=reverse)
+        entries.sort(key=lambda entry: not entry['is_dir'])
+        pages = max(1, -(-len(entries) // per_page))
+        return entries[(page - 1) * per_page:page * per_page], pages
@@ -0,0 +1,41 @@
+import os
+import mimetypes
+from urllib.parse import quote
+from flask import Response, send_from_directory
+from config import Config
+
+
+# Files that never change once written are cached by browsers for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Other files are revalidated after a few minutes
+DEFAULT_MAX_AGE = 300
+
+# The internal nginx locations serving the directories of the server, see the nginx site configuration
+INTERNAL_LOCATIONS = {
+    Config.TEST_RESULTS_BASE_PATH: '/internal/test_results/',
+    Config.THUMBNAIL_DIR: '/internal/thumbnails/',
+    Config.TILE_DIR: '/internal/tiles/',
+}
+
+
+def send_file_response(base_dir, path, immutable=False, mimetype=None):
+    """Return the response sending a file below one of the directories served by the server.
+
+    With `USE_X_ACCEL_REDIRECT`, the response only tells nginx which file to
+    send, so the transfer does not occupy a server worker. Otherwise Flask
+    sends the file itself. In both cases the response carries an ETag and
+    answers conditional requests, and immutable files are cached for a year.
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    max_age = IMMUTABLE_MAX_AGE if immutable else DEFAULT_MAX_AGE
+    if Config.USE_X_ACCEL_REDIRECT:
+        # nginx checks the conditional headers and sets the ETag from the modification time and size of the file
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = INTERNAL_LOCATIONS[base_dir] + quote(path.replace(os.sep, '/'))
+    else:
+        response = send_from_directory(base_dir, path, mimetype=mimetype, max_age=max_age, etag=True, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
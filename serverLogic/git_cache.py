@@ -0,0 +1,67 @@
+import os
+import subprocess
+import logging
+import fcntl
+from contextlib import contextmanager
+from config import Config
+from process_utils import run_cancellable
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+GIT_MIRROR_BASE = Config.GIT_MIRROR_BASE
+
+
+def mirror_path(repo_full_name, mirror_base=GIT_MIRROR_BASE):
+    """Return the path of the bare mirror of a GitHub repository."""
+    return os.path.join(mirror_base, f"{repo_full_name}.git")
+
+@contextmanager
+def mirror_lock(path):
+    """Hold an exclusive lock on a mirror, shared by all server processes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def update_mirror(repo_full_name, pull_number, github_token, mirror_base=GIT_MIRROR_BASE, log_file=None, cancel=None):
+    """Create or incrementally update the bare mirror of a repository.
+
+    The branches, the tags and the head of the given pull request are fetched,
+    so only the commits that are new since the last update are transferred.
+    The token is only used for the fetch and never stored in the mirror.
+    The fetch is stopped once the `cancel` event is set.
+    """
+    path = mirror_path(repo_full_name, mirror_base)
+    auth_url = f"https://{github_token}@github.com/{repo_full_name}.git"
+    with mirror_lock(path):
+        if not os.path.isdir(path):
+            subprocess.check_call(['git', 'init', '--bare', '--quiet', path], stdout=log_file, stderr=log_file)
+            print(f"Mirror {path} newly created.")
+        run_cancellable([
+            'git', '-C', path, 'fetch', '--prune', '--tags', auth_url,
+            '+refs/heads/*:refs/heads/*',
+            f'+refs/pull/{pull_number}/head:refs/pull/{pull_number}/head'
+        ], cancel, stdout=log_file, stderr=log_file)
+    print(f"Mirror {path} updated.")
+    return path
+
+def checkout_pull_request(mirror, pull_number, branch_name, repo_dir, log_file=None, cancel=None):
+    """Check out the head of a pull request from the mirror and return its commit SHA.
+
+    The clone shares the objects of the mirror instead of copying them, so the
+    mirror needs to be available at the same path wherever the clone is used.
+    """
+    run_cancellable(['git', 'clone', '--shared', '--no-checkout', '--quiet', mirror, repo_dir],
+                    cancel, stdout=log_file, stderr=log_file)
+    run_cancellable(['git', '-C', repo_dir, 'fetch', '--quiet', 'origin', f'refs/pull/{pull_number}/head'],
+                    cancel, stdout=log_file, stderr=log_file)
+    run_cancellable(['git', '-C', repo_dir, 'checkout', '--quiet', '-B', branch_name, 'FETCH_HEAD'],
+                    cancel, stdout=log_file, stderr=log_file)
+    head_sha = subprocess.check_output(['git', '-C', repo_dir, 'rev-parse', 'HEAD']).decode('utf-8').strip()
+    print(f"Pull request {pull_number} checked out into {repo_dir} at {head_sha}.")
+    return head_sha
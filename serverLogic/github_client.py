@@ -0,0 +1,137 @@
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+API_URL = 'https://api.github.com'
+
+
+class RateLimitExceeded(requests.HTTPError):
+    """The rate limit of the GitHub API is exhausted for longer than the client waits."""
+
+
+class GitHubClient:
+    """Client of the GitHub API shared by all requests made with a token.
+
+    The connections are pooled and kept alive, every request has a timeout,
+    and requests failing with a server error are retried with exponential
+    backoff (POST requests only if the connection failed, so comments are not
+    posted twice). The rate limit headers of the responses are tracked: once
+    the limit is exhausted, requests wait for its reset if it is close, and
+    fail with RateLimitExceeded otherwise.
+
+    Organization memberships are cached for `membership_ttl` seconds. After
+    that they are revalidated with the ETag of the last response, and GitHub
+    does not count unchanged answers against the rate limit. Missing
+    memberships are revalidated on every check, so a new member of the
+    organization is recognized right away.
+    """
+
+    def __init__(self, token, timeout=Config.GITHUB_TIMEOUT, membership_ttl=Config.GITHUB_MEMBERSHIP_TTL,
+                 max_rate_limit_wait=Config.GITHUB_MAX_RATE_LIMIT_WAIT, retries=3):
+        self.timeout = timeout
+        self.membership_ttl = membership_ttl
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github.v3+json",
+        })
+        retry = Retry(total=retries, backoff_factor=1, status_forcelist=(500, 502, 503, 504),
+                      respect_retry_after_header=True, raise_on_status=False)
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=16, max_retries=retry))
+        self._lock = threading.Lock()
+        self._memberships = {}
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+
+    def _wait_for_rate_limit(self):
+        with self._lock:
+            if self.rate_limit_remaining != 0 or self.rate_limit_reset is None:
+                return
+            wait = self.rate_limit_reset - time.time()
+        if wait <= 0:
+            return
+        if wait > self.max_rate_limit_wait:
+            raise RateLimitExceeded(f"The GitHub API rate limit is exhausted for another {int(wait)} seconds.")
+        logger.warning(f"The GitHub API rate limit is exhausted, waiting {int(wait)} seconds.")
+        time.sleep(wait)
+
+    def _track_rate_limit(self, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self.rate_limit_remaining = int(remaining)
+            self.rate_limit_reset = int(reset)
+
+    def request(self, method, path, **kwargs):
+        """Make a request to the GitHub API and return the response."""
+        self._wait_for_rate_limit()
+        response = self.session.request(method, f"{API_URL}{path}", timeout=self.timeout, **kwargs)
+        self._track_rate_limit(response)
+        # Secondary rate limits are signalled by a Retry-After header
+        retry_after = response.headers.get('Retry-After')
+        if response.status_code in (403, 429) and (retry_after or self.rate_limit_remaining == 0):
+            wait = int(retry_after) if retry_after else self.rate_limit_reset - time.time()
+            if wait > self.max_rate_limit_wait:
+                raise RateLimitExceeded(f"The GitHub API rate limit is exceeded for another {int(wait)} seconds.",
+                                        response=response)
+            logger.warning(f"The GitHub API rate limit is exceeded, retrying in {int(wait)} seconds.")
+            time.sleep(max(wait, 0))
+            response = self.session.request(method, f"{API_URL}{path}", timeout=self.timeout, **kwargs)
+            self._track_rate_limit(response)
+        return response
+
+    def post_comment(self, repo_full_name, pull_number, comment):
+        """Post a comment to a pull request and return it."""
+        response = self.request('POST', f"/repos/{repo_full_name}/issues/{pull_number}/comments",
+                                json={"body": comment})
+        response.raise_for_status()
+        return response.json()
+
+    def is_org_member(self, org, user):
+        """Return whether a user is a member of an organization, as seen with the token of the client.
+
+        Raises HTTPError if GitHub answers with an error, e.g. a server error.
+        """
+        key = (org, user)
+        with self._lock:
+            cached = self._memberships.get(key)
+        if cached is not None and cached['expires'] > time.time():
+            return cached['member']
+
+        headers = {'If-None-Match': cached['etag']} if cached is not None and cached['etag'] else {}
+        response = self.request('GET', f"/orgs/{org}/members/{user}", headers=headers)
+        if response.status_code == 304:
+            member, etag = cached['member'], response.headers.get('ETag', cached['etag'])
+        elif response.status_code == 404:
+            member, etag = False, response.headers.get('ETag')
+        else:
+            # An error is no answer, the caller fails instead of taking the user for a non-member
+            response.raise_for_status()
+            member, etag = True, response.headers.get('ETag')
+        expires = time.time() + self.membership_ttl if member else 0
+        with self._lock:
+            self._memberships[key] = {'member': member, 'etag': etag, 'expires': expires}
+        return member
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def github_client(token):
+    """Return the client shared by all requests of the server process made with a token."""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = GitHubClient(token)
+        return client
@@ -0,0 +1,8 @@
+from PIL import Image
+from config import Config
+
+
+# Full-disk composites exceed the default limit of Pillow. Pillow warns about
+# images above the limit and refuses those more than twice as large as
+# decompression bombs. Import Image from here, so the limit is always set.
+Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
@@ -0,0 +1,125 @@
+import os
+import re
+import json
+import time
+from job_queue import FINAL_STATUSES
+
+
+# Lines of the behave output starting a scenario, optionally prefixed with the shard running it
+SCENARIO_PATTERN = re.compile(r'^(?:\[shard (\d+)\] )?\s*Scenario(?: Outline)?: (.*?)(?:\s+#.*)?$')
+# Marker lines written into the log when a phase of a job starts, with the time it started
+PHASE_PATTERN = re.compile(r'^### phase (\S+)(?: (\d+(?:\.\d+)?))?$')
+
+
+def phase_marker(phase, start=None):
+    """Return the log line marking the start of a phase of a job.
+
+    Without a start time, the marker is to be followed by the time written
+    by the shell running the phase.
+    """
+    if start is None:
+        return f"### phase {phase}"
+    return f"### phase {phase} {start:.3f}"
+
+def read_new_lines(path, offset, max_bytes):
+    """Read the complete lines appended to a file since `offset`.
+
+    At most `max_bytes` are read, a line still being written is left for the
+    next read. Returns the lines with the offset after each of them. If the
+    file is shorter than the offset, it was recreated and is read from the start.
+    """
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < offset:
+                offset = 0
+            file.seek(offset)
+            data = file.read(max_bytes)
+    except FileNotFoundError:
+        return []
+    if b'\n' not in data and len(data) == max_bytes:
+        # A single line longer than the buffer is split rather than waited for
+        return [(data.decode('utf-8', errors='replace'), offset + len(data))]
+    lines = []
+    for line in data.split(b'\n')[:-1]:
+        offset += len(line) + 1
+        lines.append((line.rstrip(b'\r').decode('utf-8', errors='replace'), offset))
+    return lines
+
+def tail_offset(path, tail_bytes):
+    """Return the offset of the first complete line in the last `tail_bytes` of a file."""
+    try:
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size <= tail_bytes:
+                return 0
+            file.seek(size - tail_bytes)
+            skipped = file.readline()
+            return size - tail_bytes + len(skipped)
+    except FileNotFoundError:
+        return 0
+
+def format_event(event, data, event_id=None):
+    """Format a server-sent event."""
+    message = ''
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    message += f"event: {event}\n"
+    for line in json.dumps(data).splitlines():
+        message += f"data: {line}\n"
+    return message + "\n"
+
+def line_events(line):
+    """Return the events of a log line, the line itself and the progress it shows."""
+    events = [('log', {'line': line})]
+    phase = PHASE_PATTERN.match(line)
+    if phase:
+        events.append(('phase', {'phase': phase.group(1),
+                                 'start': float(phase.group(2)) if phase.group(2) else None}))
+    scenario = SCENARIO_PATTERN.match(line)
+    if scenario:
+        shard = int(scenario.group(1)) if scenario.group(1) is not None else None
+        events.append(('scenario', {'name': scenario.group(2).strip(), 'shard': shard}))
+    return events
+
+def job_status(job):
+    return {key: job[key] for key in ('id', 'status', 'created', 'started', 'finished', 'error', 'result')}
+
+def stream_job_events(job_queue, job_id, log_path, offset=None, redact=None, max_duration=20, poll_interval=1,
+                      max_bytes=64 * 1024, tail_bytes=64 * 1024):
+    """Generate the server-sent events of a job, following its log.
+
+    The log is read incrementally from `offset`, a new connection starts with
+    its last `tail_bytes`. The id of every event is the offset after its line,
+    so a browser reconnecting with the Last-Event-ID header resumes where it
+    stopped. The stream ends after `max_duration` seconds, so it does not block
+    a server worker for long, and when the job has finished and its log was
+    read completely.
+    """
+    if offset is None:
+        offset = tail_offset(log_path, tail_bytes)
+    deadline = time.monotonic() + max_duration
+    status = None
+    yield "retry: 2000\n\n"
+    while True:
+        lines = read_new_lines(log_path, offset, max_bytes)
+        for line, offset in lines:
+            if redact:
+                line = line.replace(redact, "[REDACTED]")
+            for event, data in line_events(line):
+                yield format_event(event, data, offset)
+
+        job = job_queue.get(job_id)
+        if job is None:
+            yield format_event('end', {'id': job_id, 'status': None})
+            return
+        if job['status'] != status:
+            status = job['status']
+            yield format_event('status', job_status(job), offset)
+        # The log of a finished job is drained before the stream ends
+        if status in FINAL_STATUSES and not lines:
+            yield format_event('end', job_status(job), offset)
+            return
+        if time.monotonic() >= deadline:
+            return
+        if not lines:
+            time.sleep(poll_interval)
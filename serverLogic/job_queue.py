@@ -0,0 +1,286 @@
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    repo_full_name TEXT NOT NULL,
+    pull_number INTEGER NOT NULL,
+    clone_url TEXT NOT NULL,
+    branch_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+# Columns added after the first version of the schema, added to existing databases on start-up
+MIGRATIONS = {
+    'jobs': {
+        'owner': 'TEXT',
+        'heartbeat': 'REAL',
+        'attempts': 'INTEGER NOT NULL DEFAULT 0',
+        'head_sha': 'TEXT',
+        'base_sha': 'TEXT',
+        'result': 'TEXT',
+        'not_before': 'REAL',
+        'cancel_status': 'TEXT',
+    },
+}
+
+# A job is 'queued' until a runner claims it, then 'running' until it ends as 'done' or 'failed'.
+# A job is 'cached' if the results of an earlier job were reused instead of running it,
+# 'superseded' if a job for a newer commit of its pull request was submitted before it finished,
+# and 'cancelled' if it was cancelled through the API or a comment on its pull request.
+FINAL_STATUSES = ('done', 'failed', 'cached', 'superseded', 'cancelled')
+# A job is given up after being started this many times by runners that died while running it
+MAX_ATTEMPTS = 3
+
+
+def connect(db_path):
+    """Open a connection to the job database.
+
+    The connection is in autocommit mode, transactions are started explicitly.
+    The database is shared by all server processes, so it is used in WAL mode,
+    which lets readers go on while a process writes.
+    """
+    connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+@contextmanager
+def transaction(db_path):
+    """Open a connection and run a write transaction on it.
+
+    The write lock is taken when the transaction starts, so a read followed by
+    a write in the same transaction is atomic across processes.
+    """
+    with closing(connect(db_path)) as connection:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+def migrate(connection, migrations=MIGRATIONS):
+    """Add the columns missing in tables created by an older version and return their names."""
+    added = []
+    for table, columns in migrations.items():
+        existing = {row['name'] for row in connection.execute(f'PRAGMA table_info({table})')}
+        for column, definition in columns.items():
+            if column not in existing:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                added.append(f'{table}.{column}')
+    return added
+
+
+def stop_jobs(connection, rows, status, reason):
+    """End the queued jobs among `rows` with a final status, and ask the running ones to stop with it."""
+    now = time.time()
+    for row in rows:
+        if row['status'] == 'queued':
+            connection.execute('UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?',
+                               (status, now, reason, row['id']))
+        else:
+            connection.execute('UPDATE jobs SET cancel_status = ?, error = ? WHERE id = ?', (status, reason, row['id']))
+
+
+class JobQueue:
+    """Persistent FIFO queue of test jobs stored in SQLite.
+
+    The queue is shared by all server processes. A runner claims a job by
+    writing its owner id into it and keeps the claim alive with heartbeats, so
+    the jobs of a runner that died can be taken over by the others.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with transaction(db_path) as connection:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            migrate(connection)
+
+    def submit_for_pull_request(self, repo_full_name, pull_number, clone_url, branch_name, head_sha, base_sha=None,
+                                debounce=0):
+        """Add a job for a commit of a pull request, unless one is queued or running already, and return its id.
+
+        Repeated triggers for the same commit end up in the same job. The jobs
+        for other commits of the pull request are superseded: queued ones are
+        dropped, running ones are asked to stop (see `cancel_requests`). The
+        new job can only be claimed `debounce` seconds after it was submitted,
+        so that a quick succession of pushes only tests the last commit.
+        """
+        now = time.time()
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, status, head_sha FROM jobs WHERE repo_full_name = ? AND pull_number = ? "
+                "AND status IN ('queued', 'running') AND cancel_status IS NULL",
+                (repo_full_name, pull_number)).fetchall()
+            for row in rows:
+                if row['head_sha'] == head_sha:
+                    return row['id']
+            cursor = connection.execute(
+                'INSERT INTO jobs (repo_full_name, pull_number, clone_url, branch_name, head_sha, base_sha, created, '
+                'not_before) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (repo_full_name, pull_number, clone_url, branch_name, head_sha, base_sha, now, now + debounce))
+            job_id = cursor.lastrowid
+            stop_jobs(connection, rows, 'superseded', f"Superseded by job {job_id} for commit {head_sha[:7]}.")
+            return job_id
+
+    def cancel(self, job_id, reason):
+        """Cancel a queued or running job and return whether it was cancelled.
+
+        A queued job is cancelled right away, a running job is asked to stop
+        (see `cancel_requests`) and ends as 'cancelled'. Finished jobs and jobs
+        already asked to stop are left untouched.
+        """
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, status FROM jobs WHERE id = ? AND status IN ('queued', 'running') AND cancel_status IS NULL",
+                (job_id,)).fetchall()
+            stop_jobs(connection, rows, 'cancelled', reason)
+            return bool(rows)
+
+    def cancel_pull_request(self, repo_full_name, pull_number, reason):
+        """Cancel the queued and running jobs of a pull request and return their ids."""
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, status FROM jobs WHERE repo_full_name = ? AND pull_number = ? "
+                "AND status IN ('queued', 'running') AND cancel_status IS NULL ORDER BY id",
+                (repo_full_name, pull_number)).fetchall()
+            stop_jobs(connection, rows, 'cancelled', reason)
+            return [row['id'] for row in rows]
+
+    def cancel_overdue(self, timeout):
+        """Ask the jobs running for more than `timeout` seconds to stop, ending them as 'failed', and return their ids."""
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, status FROM jobs WHERE status = 'running' AND cancel_status IS NULL AND started < ?",
+                (time.time() - timeout,)).fetchall()
+            stop_jobs(connection, rows, 'failed', f"The job was stopped after running for more than {timeout} seconds.")
+            return [row['id'] for row in rows]
+
+    def cancel_requests(self, owner):
+        """Return the ids of the running jobs of an owner that were asked to stop, with the status to end them with."""
+        with closing(connect(self.db_path)) as connection:
+            return {row['id']: row['cancel_status'] for row in connection.execute(
+                "SELECT id, cancel_status FROM jobs WHERE owner = ? AND status = 'running' AND cancel_status IS NOT NULL",
+                (owner,))}
+
+    def record_cached(self, repo_full_name, pull_number, clone_url, branch_name, head_sha, result):
+        """Record a job that was answered with cached results without being queued, and return its id.
+
+        Like a new job, it supersedes the jobs for other commits of the pull request.
+        """
+        now = time.time()
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, status FROM jobs WHERE repo_full_name = ? AND pull_number = ? "
+                "AND status IN ('queued', 'running') AND cancel_status IS NULL AND COALESCE(head_sha, '') != ?",
+                (repo_full_name, pull_number, head_sha)).fetchall()
+            cursor = connection.execute(
+                "INSERT INTO jobs (repo_full_name, pull_number, clone_url, branch_name, head_sha, status, "
+                "created, started, finished, result) VALUES (?, ?, ?, ?, ?, 'cached', ?, ?, ?, ?)",
+                (repo_full_name, pull_number, clone_url, branch_name, head_sha, now, now, now, result))
+            job_id = cursor.lastrowid
+            stop_jobs(connection, rows, 'superseded', f"Superseded by job {job_id} for commit {head_sha[:7]}.")
+            return job_id
+
+    def claim(self, owner, max_running):
+        """Mark the oldest queued job as running and return it.
+
+        Returns None if the queue is empty or if `max_running` jobs are
+        already running in any of the server processes.
+        """
+        with transaction(self.db_path) as connection:
+            running = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            if running >= max_running:
+                return None
+            now = time.time()
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND COALESCE(not_before, 0) <= ? ORDER BY id LIMIT 1",
+                (now,)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', started = ?, owner = ?, heartbeat = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (now, owner, now, row['id']))
+            return dict(row, status='running', started=now, owner=owner, heartbeat=now, attempts=row['attempts'] + 1)
+
+    def heartbeat(self, owner):
+        """Renew the claims of all jobs run by an owner."""
+        with transaction(self.db_path) as connection:
+            connection.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = 'running'",
+                               (time.time(), owner))
+
+    def finish(self, job_id, owner, status, error=None, result=None):
+        """Mark a job as finished, with the timestamp of its results if there are any.
+
+        Returns False if the job is not claimed by `owner` anymore, in which
+        case it is left untouched.
+        """
+        if status not in FINAL_STATUSES:
+            raise ValueError(f"Invalid final job status: {status}")
+        with transaction(self.db_path) as connection:
+            # A job asked to stop ends with the status it was stopped with, unless it completed anyway
+            cursor = connection.execute(
+                "UPDATE jobs SET status = CASE WHEN cancel_status IS NOT NULL AND ? != 'done' THEN cancel_status ELSE ? END, "
+                "finished = ?, error = CASE WHEN cancel_status IS NOT NULL AND ? != 'done' THEN error ELSE ? END, "
+                "result = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (status, status, time.time(), status, error, result, job_id, owner))
+            return cursor.rowcount == 1
+
+    def recover_stale(self, stale_after):
+        """Release the jobs of runners that have not sent a heartbeat for `stale_after` seconds.
+
+        The jobs are queued again, unless they were already attempted
+        MAX_ATTEMPTS times. Returns the ids of the released jobs.
+        """
+        with transaction(self.db_path) as connection:
+            rows = connection.execute(
+                "SELECT id, attempts, cancel_status FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                (time.time() - stale_after,)).fetchall()
+            for row in rows:
+                if row['cancel_status'] is not None:
+                    connection.execute("UPDATE jobs SET status = cancel_status, finished = ? WHERE id = ?",
+                                       (time.time(), row['id']))
+                elif row['attempts'] >= MAX_ATTEMPTS:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                        (time.time(), "The runner of the job stopped responding.", row['id']))
+                else:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL, heartbeat = NULL WHERE id = ?",
+                        (row['id'],))
+            return [row['id'] for row in rows]
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if it does not exist."""
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def count_by_status(self):
+        """Return the number of jobs in each status."""
+        with closing(connect(self.db_path)) as connection:
+            return {row['status']: row['count'] for row in connection.execute(
+                'SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+
+    def position(self, job_id):
+        """Return the number of queued jobs ahead of a job."""
+        with closing(connect(self.db_path)) as connection:
+            return connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?", (job_id,)).fetchone()[0]
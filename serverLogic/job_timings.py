@@ -0,0 +1,100 @@
+import os
+import glob
+import json
+import logging
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+from job_events import PHASE_PATTERN
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# The last phase marker of a job, it only marks the end of the phase before it
+END_PHASE = 'done'
+
+
+def phase_timings(log_path):
+    """Return the start and end of the phases of a job from the phase markers in its log.
+
+    A phase ends when the next one starts. A phase without a following marker,
+    e.g. because the job failed in it, has no end.
+    """
+    markers = []
+    try:
+        with open(log_path, 'r', errors='replace') as log_file:
+            for line in log_file:
+                match = PHASE_PATTERN.match(line.rstrip('\n'))
+                if match and match.group(2):
+                    markers.append((match.group(1), float(match.group(2))))
+    except FileNotFoundError:
+        return []
+    phases = []
+    for index, (phase, start) in enumerate(markers):
+        if phase == END_PHASE:
+            break
+        end = markers[index + 1][1] if index + 1 < len(markers) else None
+        phases.append({'phase': phase, 'start': start, 'end': end,
+                       'duration': round(end - start, 3) if end is not None else None})
+    return phases
+
+def scenario_timings(junit_dir):
+    """Return the status, start and end of the scenarios from the behave JUnit reports.
+
+    The reports of the shards are in one subdirectory per shard. Behave only
+    reports the duration of a scenario and the time a feature was finished,
+    in the time zone of the container, which is UTC. The scenarios of a
+    feature run one after the other, so their start is derived from these.
+    """
+    scenarios = []
+    for report in sorted(glob.glob(os.path.join(junit_dir, '**', '*.xml'), recursive=True)):
+        shard = os.path.relpath(os.path.dirname(report), junit_dir)
+        try:
+            suites = ElementTree.parse(report).getroot()
+        except ElementTree.ParseError as e:
+            logger.error(f"Invalid behave report {report}: {e}")
+            continue
+        for suite in suites.iter('testsuite'):
+            cases = suite.findall('testcase')
+            finished = suite.get('timestamp')
+            start = None
+            if finished:
+                start = datetime.fromisoformat(finished).replace(tzinfo=timezone.utc).timestamp()
+                start -= sum(float(case.get('time', 0)) for case in cases)
+            for case in cases:
+                duration = float(case.get('time', 0))
+                scenarios.append({
+                    'feature': case.get('classname'),
+                    'name': (case.get('name') or '').strip(),
+                    'status': case.get('status'),
+                    'shard': int(shard) if shard.isdigit() else None,
+                    'start': round(start, 3) if start is not None else None,
+                    'end': round(start + duration, 3) if start is not None else None,
+                    'duration': duration,
+                })
+                if start is not None:
+                    start += duration
+    return scenarios
+
+def write_timings(clone_dir, results_dirs=()):
+    """Write the timings of the phases and scenarios of a job as `timings.json`.
+
+    The timings are written into the job directory and into the given result
+    directories, which must not be published yet. Returns the timings.
+    """
+    timings = {
+        'phases': phase_timings(os.path.join(clone_dir, 'output.log')),
+        'scenarios': scenario_timings(os.path.join(clone_dir, 'junit')),
+    }
+    for directory in (clone_dir, *results_dirs):
+        with open(os.path.join(directory, 'timings.json'), 'w') as timings_file:
+            json.dump(timings, timings_file, indent=2)
+    return timings
+
+def read_timings(clone_dir):
+    """Return the timings written for a job, or None."""
+    try:
+        with open(os.path.join(clone_dir, 'timings.json'), 'r') as timings_file:
+            return json.load(timings_file)
+    except (FileNotFoundError, ValueError):
+        return None
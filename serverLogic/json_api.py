@@ -0,0 +1,28 @@
+import gzip
+import json
+from flask import Response, request
+
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def json_response(data, max_age=60):
+    """Return a JSON response that answers conditional requests and is compressed if the client accepts it.
+
+    The ETag is computed from the uncompressed body, so a client polling an
+    unchanged resource gets an empty 304 response.
+    """
+    body = json.dumps(data, sort_keys=True).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.vary.add('Accept-Encoding')
+    response.make_conditional(request)
+    if response.status_code == 200 and len(body) >= MIN_COMPRESS_SIZE and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        # The compressed body differs byte for byte, like nginx the ETag is weakened
+        response.set_etag(response.get_etag()[0], weak=True)
+    return response
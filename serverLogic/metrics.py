@@ -0,0 +1,184 @@
+import math
+import atexit
+import logging
+import threading
+import time
+from contextlib import closing
+from job_queue import connect, transaction
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_values (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+CREATE TABLE IF NOT EXISTS metric_buckets (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    bucket REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, labels, bucket)
+)
+"""
+
+# Upper bounds of the histogram buckets in seconds
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 7200)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# The metrics with their type, help text and histogram buckets
+METRICS = {
+    'image_comparison_jobs_total': ('counter', 'Jobs finished, by final status.', None),
+    'image_comparison_job_duration_seconds': ('histogram', 'Time from the start to the end of a job.', DURATION_BUCKETS),
+    'image_comparison_job_queue_wait_seconds': ('histogram', 'Time a job waited in the queue.', DURATION_BUCKETS),
+    'image_comparison_job_phase_duration_seconds': ('histogram', 'Duration of the phases of a job.', DURATION_BUCKETS),
+    'image_comparison_scenario_duration_seconds': ('histogram', 'Duration of the behave scenarios, by status.', DURATION_BUCKETS),
+    'image_comparison_webhook_duration_seconds': ('histogram', 'Time to answer a webhook, by response status.', LATENCY_BUCKETS),
+}
+
+
+def format_labels(labels):
+    """Format labels the way Prometheus expects them, sorted by name."""
+    if not labels:
+        return ''
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for name, value in labels.items()}
+    return '{' + ','.join(f'{name}="{escaped[name]}"' for name in sorted(escaped)) + '}'
+
+def _with_label(labels, name, value):
+    label = f'{name}="{value}"'
+    return '{' + label + '}' if not labels else labels[:-1] + ',' + label + '}'
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metrics:
+    """Counters and histograms shared by all server processes, stored in SQLite.
+
+    A scrape can be answered by any of the Gunicorn workers, so the metrics
+    are kept in the job database instead of in the memory of a process.
+    Recording a value only adds it up in memory, so a request never waits for
+    the database: the sums of every process are written every
+    `flush_interval` seconds and before a scrape answered by the process.
+    """
+
+    def __init__(self, db_path, flush_interval=Config.METRICS_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        # The values and bucket counts recorded since the last flush
+        self._values = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        with transaction(db_path) as connection:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+
+    def inc(self, name, labels=None, value=1):
+        """Increase a counter."""
+        with self._lock:
+            self._add(name, format_labels(labels), value)
+
+    def observe(self, name, value, labels=None):
+        """Count an observation in the buckets of a histogram."""
+        buckets = METRICS[name][2]
+        bucket = next((bound for bound in buckets if value <= bound), math.inf)
+        labels = format_labels(labels)
+        with self._lock:
+            self._buckets[(name, labels, bucket)] = self._buckets.get((name, labels, bucket), 0) + 1
+            self._add(f'{name}_sum', labels, value)
+            self._add(f'{name}_count', labels, 1)
+
+    def _add(self, name, labels, value):
+        self._values[(name, labels)] = self._values.get((name, labels), 0) + value
+
+    def flush(self):
+        """Write the values recorded since the last flush to the database."""
+        with self._lock:
+            values, self._values = self._values, {}
+            buckets, self._buckets = self._buckets, {}
+        if not values and not buckets:
+            return
+        try:
+            with transaction(self.db_path) as connection:
+                connection.executemany(
+                    'INSERT INTO metric_values (name, labels, value) VALUES (?, ?, ?) '
+                    'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                    [(name, labels, value) for (name, labels), value in values.items()])
+                connection.executemany(
+                    'INSERT INTO metric_buckets (name, labels, bucket, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name, labels, bucket) DO UPDATE SET count = count + excluded.count',
+                    [(name, labels, bucket, count) for (name, labels, bucket), count in buckets.items()])
+        except BaseException:
+            # The values are written with the next flush
+            with self._lock:
+                for key, value in values.items():
+                    self._values[key] = self._values.get(key, 0) + value
+                for key, count in buckets.items():
+                    self._buckets[key] = self._buckets.get(key, 0) + count
+            raise
+
+    def start(self):
+        """Start the thread writing the recorded values every `flush_interval` seconds, and once more at exit."""
+        thread = threading.Thread(target=self._work, name="metrics", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def _work(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error while writing the metrics: {e}")
+
+    def render(self, gauges=()):
+        """Render the metrics in the Prometheus text format.
+
+        `gauges` are additional (name, help, {labels: value}) tuples measured
+        at the time of the scrape.
+        """
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error while writing the metrics: {e}")
+        with closing(connect(self.db_path)) as connection:
+            values = {(row['name'], row['labels']): row['value']
+                      for row in connection.execute('SELECT * FROM metric_values')}
+            buckets = {}
+            for row in connection.execute('SELECT * FROM metric_buckets ORDER BY bucket'):
+                buckets.setdefault((row['name'], row['labels']), []).append((row['bucket'], row['count']))
+
+        lines = []
+        for name, (kind, help_text, bounds) in METRICS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            if kind == 'counter':
+                for (value_name, labels), value in sorted(values.items()):
+                    if value_name == name:
+                        lines.append(f'{name}{labels} {_format_value(value)}')
+                continue
+            for (value_name, labels), count in sorted(values.items()):
+                if value_name != f'{name}_count':
+                    continue
+                counts = dict(buckets.get((name, labels), []))
+                cumulative = 0
+                for bound in (*bounds, math.inf):
+                    cumulative += counts.get(bound, 0)
+                    lines.append(f'{name}_bucket{_with_label(labels, "le", _format_value(bound))} {cumulative}')
+                lines.append(f'{name}_sum{labels} {_format_value(values[(f"{name}_sum", labels)])}')
+                lines.append(f'{name}_count{labels} {_format_value(count)}')
+        for name, help_text, samples in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            for labels, value in sorted(samples.items()):
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,177 @@
+import os
+import json
+import socket
+import logging
+import threading
+import time
+from contextlib import closing
+from job_queue import connect, transaction, migrate
+from github_client import github_client
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comment_outbox (
+    key TEXT PRIMARY KEY,
+    repo_full_name TEXT NOT NULL,
+    pull_number INTEGER NOT NULL,
+    messages TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    sent_version INTEGER NOT NULL DEFAULT 0,
+    comment_id INTEGER,
+    updated REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    owner TEXT,
+    claimed REAL,
+    error TEXT,
+    failed INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# The columns added to the comment outbox since it was created
+MIGRATIONS = {
+    'comment_outbox': {
+        'failed': 'INTEGER NOT NULL DEFAULT 0',
+    },
+}
+
+# A comment is marked as failed after failing this many times in a row
+MAX_ATTEMPTS = 8
+# A failed comment is retried after this many seconds, until it is sent or expires
+FAILED_RETRY_INTERVAL = 6 * 3600
+# A comment claimed by a sender that died is sent again after this many seconds
+SENDING_TIMEOUT = 300
+# Comments are kept this many seconds after they were last updated, so later messages still edit them
+COMMENT_RETENTION = 7 * 24 * 3600
+
+
+def render_comment(messages):
+    """Return the body of a comment showing the messages posted to it, the oldest first."""
+    return '\n\n'.join(messages)
+
+
+class CommentOutbox:
+    """Comments to post to pull requests, stored in the job database and sent by a background thread.
+
+    Posting a message only stores it, so a runner never waits for GitHub.
+    All messages posted with the same key, e.g. all status updates of a job,
+    go into a single comment: the first message creates it, the following
+    ones edit it. Messages posted within `coalesce_delay` seconds of each
+    other are sent in one request. Failed requests are retried with
+    exponential backoff. A comment failing `MAX_ATTEMPTS` times in a row is
+    marked as failed and only retried every `FAILED_RETRY_INTERVAL` seconds,
+    until it is sent or dropped `COMMENT_RETENTION` seconds after its last
+    message.
+    """
+
+    def __init__(self, db_path, github_token, coalesce_delay=Config.COMMENT_COALESCE_DELAY, poll_interval=1):
+        self.db_path = db_path
+        self.github_token = github_token
+        self.coalesce_delay = coalesce_delay
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+        with transaction(db_path) as connection:
+            connection.execute(SCHEMA)
+            migrate(connection, MIGRATIONS)
+
+    def post(self, key, repo_full_name, pull_number, message):
+        """Add a message to the comment with a key."""
+        now = time.time()
+        with transaction(self.db_path) as connection:
+            row = connection.execute('SELECT messages FROM comment_outbox WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                connection.execute(
+                    'INSERT INTO comment_outbox (key, repo_full_name, pull_number, messages, updated) '
+                    'VALUES (?, ?, ?, ?, ?)', (key, repo_full_name, pull_number, json.dumps([message]), now))
+            else:
+                connection.execute(
+                    'UPDATE comment_outbox SET messages = ?, version = version + 1, updated = ?, attempts = 0, '
+                    'next_attempt = 0, failed = 0 WHERE key = ?', (json.dumps(json.loads(row['messages']) + [message]), now, key))
+
+    def get(self, key):
+        """Return the comment with a key as a dict, or None."""
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute('SELECT * FROM comment_outbox WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def claim(self, owner, now=None):
+        """Claim the next comment with unsent messages that are due, or return None."""
+        now = time.time() if now is None else now
+        with transaction(self.db_path) as connection:
+            row = connection.execute(
+                'SELECT * FROM comment_outbox WHERE version > sent_version AND next_attempt <= ? AND updated <= ? '
+                'AND (claimed IS NULL OR claimed < ?) ORDER BY updated LIMIT 1',
+                (now, now - self.coalesce_delay, now - SENDING_TIMEOUT)).fetchone()
+            if row is None:
+                expired = connection.execute('SELECT key, error FROM comment_outbox WHERE failed AND updated < ?',
+                                             (now - COMMENT_RETENTION,)).fetchall()
+                for comment in expired:
+                    logger.error(f"Dropping the comment {comment['key']}, it could not be sent: {comment['error']}")
+                connection.execute('DELETE FROM comment_outbox WHERE (version = sent_version OR failed) AND updated < ?',
+                                   (now - COMMENT_RETENTION,))
+                return None
+            connection.execute('UPDATE comment_outbox SET owner = ?, claimed = ? WHERE key = ?', (owner, now, row['key']))
+            return dict(row, owner=owner, claimed=now)
+
+    def send(self, comment):
+        """Create or edit the comment on GitHub, returning its id."""
+        client = github_client(self.github_token)
+        body = render_comment(json.loads(comment['messages']))
+        if comment['comment_id'] is not None:
+            response = client.request('PATCH', f"/repos/{comment['repo_full_name']}/issues/comments/{comment['comment_id']}",
+                                      json={"body": body})
+            if response.status_code != 404:
+                response.raise_for_status()
+                return comment['comment_id']
+            # The comment was deleted on GitHub, a new one is created
+        return client.post_comment(comment['repo_full_name'], comment['pull_number'], body)['id']
+
+    def deliver(self, comment):
+        """Send a claimed comment and record the outcome."""
+        try:
+            comment_id = self.send(comment)
+        except Exception as e:
+            attempts = comment['attempts'] + 1
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(f"The comment {comment['key']} failed {attempts} times, it is retried in "
+                             f"{FAILED_RETRY_INTERVAL} seconds: {e}")
+                delay = FAILED_RETRY_INTERVAL
+            else:
+                logger.error(f"Error while sending the comment {comment['key']}, attempt {attempts}: {e}")
+                delay = min(2 ** attempts * 5, 3600)
+            with transaction(self.db_path) as connection:
+                connection.execute(
+                    'UPDATE comment_outbox SET attempts = ?, next_attempt = ?, failed = ?, claimed = NULL, error = ? '
+                    'WHERE key = ?', (attempts, time.time() + delay, int(attempts >= MAX_ATTEMPTS), str(e),
+                                      comment['key']))
+            return
+        # Messages added while the comment was sent are sent with the next edit
+        with transaction(self.db_path) as connection:
+            connection.execute(
+                'UPDATE comment_outbox SET sent_version = ?, comment_id = ?, attempts = 0, failed = 0, claimed = NULL, '
+                'error = NULL WHERE key = ?', (comment['version'], comment_id, comment['key']))
+
+    def start(self):
+        """Start the thread sending the comments of the outbox."""
+        thread = threading.Thread(target=self._work, name="comment-outbox", daemon=True)
+        thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                comment = self.claim(self.owner)
+            except Exception as e:
+                logger.error(f"Error while claiming a comment: {e}")
+                comment = None
+            if comment is None:
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                self.deliver(comment)
+            except Exception as e:
+                logger.error(f"Error while recording the delivery of the comment {comment['key']}: {e}")
@@ -0,0 +1,40 @@
+import subprocess
+
+
+class JobCancelled(Exception):
+    """The job was asked to stop while it was running."""
+
+
+def check_cancelled(cancel):
+    """Raise JobCancelled if the `cancel` event of a job is set."""
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled()
+
+def run_cancellable(args, cancel=None, on_cancel=None, poll_interval=1, **kwargs):
+    """Run a command until it exits or the `cancel` event is set.
+
+    The command is checked on every `poll_interval` seconds. A cancelled
+    command is stopped with `on_cancel`, by default by terminating it, and
+    JobCancelled is raised. Raises CalledProcessError if the command exits
+    with an error. The other arguments are passed on to Popen.
+    """
+    process = subprocess.Popen(args, **kwargs)
+    while True:
+        try:
+            returncode = process.wait(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is None or not cancel.is_set():
+                continue
+            if on_cancel is not None:
+                on_cancel()
+            else:
+                process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            raise JobCancelled()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
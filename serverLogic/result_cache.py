@@ -0,0 +1,107 @@
+import os
+import hashlib
+import time
+from contextlib import closing
+from job_queue import connect, transaction
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    head_sha TEXT NOT NULL,
+    runner_fingerprint TEXT NOT NULL,
+    data_version TEXT NOT NULL,
+    selection TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    job_id INTEGER,
+    created REAL NOT NULL,
+    PRIMARY KEY (head_sha, runner_fingerprint, data_version, selection)
+)
+"""
+
+
+def scenario_selection_key(selection_mode, base_sha, rules_path, fallback):
+    """Return what decides which scenarios of a commit are run, 'all' if all of them are.
+
+    With the selection of the changed scenarios, this is a hash of the commit
+    the pull request is based on, the rules and the fallback.
+    """
+    if selection_mode != 'changed' or not base_sha:
+        return 'all'
+    sha = hashlib.sha256(f"{base_sha}\0{fallback}\0".encode('utf-8'))
+    try:
+        with open(rules_path, 'rb') as rules_file:
+            sha.update(rules_file.read())
+    except OSError:
+        pass
+    return f"changed-{sha.hexdigest()[:12]}"
+
+def data_version(data_dir, exclude=('test_results',)):
+    """Fingerprint the reference and satellite data the tests run on.
+
+    Only the names, sizes and modification times of the files are hashed, so
+    this is cheap even for large data. The results written by the tests are
+    excluded.
+    """
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(data_dir):
+        if root == data_dir:
+            dirs[:] = [name for name in dirs if name not in exclude]
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            sha.update(f"{os.path.relpath(path, data_dir)}\0{stat.st_size}\0{int(stat.st_mtime)}\n".encode('utf-8'))
+    return sha.hexdigest()[:12]
+
+
+class ResultCache:
+    """Results of earlier jobs, keyed on what determines the outcome of a test run.
+
+    The key is made of the tested commit SHA, the fingerprint of the runner
+    image, the version of the reference data and what selected the scenarios
+    that were run, so the results of a subset of the scenarios are not reused
+    for a run of all of them.
+    """
+
+    def __init__(self, db_path, results_dir):
+        self.db_path = db_path
+        self.results_dir = results_dir
+        with transaction(db_path) as connection:
+            columns = {row['name'] for row in connection.execute('PRAGMA table_info(result_cache)')}
+            if columns and 'selection' not in columns:
+                # Older versions did not record which scenarios were run, their results cannot be told apart
+                connection.execute('DROP TABLE result_cache')
+            connection.execute(SCHEMA)
+
+    def lookup(self, head_sha, runner_fingerprint, data_version, selection):
+        """Return the timestamp of the cached results, or None.
+
+        Cached results whose directory has been deleted in the meantime are
+        forgotten.
+        """
+        key = (head_sha, runner_fingerprint, data_version, selection)
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute(
+                'SELECT timestamp FROM result_cache WHERE head_sha = ? AND runner_fingerprint = ? AND data_version = ? '
+                'AND selection = ?', key).fetchone()
+        if row is None:
+            return None
+        if not os.path.isdir(os.path.join(self.results_dir, 'image_comparison', row['timestamp'])):
+            with transaction(self.db_path) as connection:
+                connection.execute(
+                    'DELETE FROM result_cache WHERE head_sha = ? AND runner_fingerprint = ? AND data_version = ? '
+                    'AND selection = ?', key)
+            return None
+        return row['timestamp']
+
+    def store(self, head_sha, runner_fingerprint, data_version, selection, timestamp, job_id=None):
+        """Remember the results of a job."""
+        with transaction(self.db_path) as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO result_cache '
+                '(head_sha, runner_fingerprint, data_version, selection, timestamp, job_id, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (head_sha, runner_fingerprint, data_version, selection, timestamp, job_id, time.time()))
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import sqlite3
+import fnmatch
+import logging
+from contextlib import closing
+from job_queue import connect, transaction, migrate
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    timestamp TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_order ON runs (mtime_ns, timestamp);
+CREATE TABLE IF NOT EXISTS run_images (
+    timestamp TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (timestamp, kind, name)
+);
+CREATE TABLE IF NOT EXISTS results_index_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pinned_runs (
+    timestamp TEXT PRIMARY KEY,
+    pinned REAL NOT NULL
+)
+"""
+
+# Columns added after the first version of the index
+MIGRATIONS = {
+    'runs': {
+        'outcome': "TEXT NOT NULL DEFAULT 'unknown'",
+        'passed': 'INTEGER NOT NULL DEFAULT 0',
+        'failed': 'INTEGER NOT NULL DEFAULT 0',
+        'summary': 'TEXT',
+        'repo_full_name': 'TEXT',
+        'pull_number': 'INTEGER',
+    },
+}
+
+# The outcomes a run can be filtered by
+OUTCOMES = ('passed', 'failed', 'unknown')
+
+# The images shown for a run, by the directory they are in
+IMAGE_PATTERNS = {
+    'difference': 'diff_*.png',
+    'generated': 'generated_*.png',
+}
+
+
+def run_summary(run_dir, job=None):
+    """Summarize the results of a run.
+
+    The statuses and durations of the scenarios and phases are read from the
+    timings written next to the results. The outcome of a run is 'failed' if
+    a scenario failed, 'passed' otherwise, and 'unknown' for runs without
+    timings.
+    """
+    try:
+        with open(os.path.join(run_dir, 'timings.json'), 'r') as timings_file:
+            timings = json.load(timings_file)
+    except (FileNotFoundError, ValueError):
+        timings = {}
+    try:
+        with open(os.path.join(run_dir, 'test_results.txt'), 'r', errors='replace') as results_file:
+            results_text = results_file.read()
+    except FileNotFoundError:
+        results_text = None
+    scenarios = timings.get('scenarios', [])
+    passed = sum(1 for scenario in scenarios if scenario['status'] == 'passed')
+    failed = sum(1 for scenario in scenarios if scenario['status'] in ('failed', 'error'))
+    outcome = 'unknown' if not scenarios else 'failed' if failed else 'passed'
+    if job is not None:
+        job = {key: job[key] for key in ('id', 'repo_full_name', 'pull_number', 'head_sha')}
+    return {
+        'timestamp': os.path.basename(run_dir),
+        'outcome': outcome,
+        'passed': passed,
+        'failed': failed,
+        'job': job,
+        'phases': timings.get('phases', []),
+        'scenarios': scenarios,
+        'results_text': results_text,
+    }
+
+def format_cursor(cursor):
+    """Format the cursor of a page for a URL."""
+    return f"{cursor[0]}_{cursor[1]}"
+
+def parse_cursor(value):
+    """Parse a cursor formatted by format_cursor, raising ValueError if it is invalid."""
+    mtime_ns, _, timestamp = value.partition('_')
+    if not timestamp:
+        raise ValueError(f"Invalid cursor: {value}")
+    return int(mtime_ns), timestamp
+
+
+class ResultsIndex:
+    """Index of the published test results, stored in the job database.
+
+    The pages of the website read the runs and their images from the index
+    instead of listing the results directory. The index is updated when a
+    job publishes results, and whenever the modification time of the results
+    directory shows that runs were added or removed in another way.
+    """
+
+    def __init__(self, db_path, results_dir):
+        self.db_path = db_path
+        self.runs_dir = os.path.join(results_dir, 'image_comparison')
+        with transaction(db_path) as connection:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            if migrate(connection, MIGRATIONS):
+                # Runs indexed by an older version are scanned again for the new columns
+                connection.execute('UPDATE runs SET mtime_ns = -1')
+                connection.execute('DELETE FROM results_index_state')
+
+    @staticmethod
+    def _find_job(connection, timestamp):
+        """Return the job that published a run, from the job database or from the current summary of the run."""
+        row = connection.execute('SELECT summary FROM runs WHERE timestamp = ?', (timestamp,)).fetchone()
+        if row is not None and row['summary'] and json.loads(row['summary'])['job'] is not None:
+            return json.loads(row['summary'])['job']
+        try:
+            row = connection.execute('SELECT * FROM jobs WHERE result = ? ORDER BY id DESC LIMIT 1', (timestamp,)).fetchone()
+        except sqlite3.OperationalError:
+            # The index is used without a job queue
+            return None
+        return dict(row) if row is not None else None
+
+    def _scan_run(self, connection, timestamp, stat, job=None):
+        run_dir = os.path.join(self.runs_dir, timestamp)
+        connection.execute('DELETE FROM run_images WHERE timestamp = ?', (timestamp,))
+        for kind, pattern in IMAGE_PATTERNS.items():
+            try:
+                entries = list(os.scandir(os.path.join(run_dir, kind)))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if fnmatch.fnmatch(entry.name, pattern) and entry.is_file():
+                    connection.execute(
+                        'INSERT INTO run_images (timestamp, kind, name, mtime) VALUES (?, ?, ?, ?)',
+                        (timestamp, kind, entry.name, entry.stat().st_mtime))
+        summary = run_summary(run_dir, job or self._find_job(connection, timestamp))
+        job = summary['job'] or {}
+        connection.execute(
+            'INSERT OR REPLACE INTO runs (timestamp, mtime, mtime_ns, outcome, passed, failed, summary, '
+            'repo_full_name, pull_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (timestamp, stat.st_mtime, stat.st_mtime_ns, summary['outcome'], summary['passed'], summary['failed'],
+             json.dumps(summary), job.get('repo_full_name'), job.get('pull_number')))
+
+    def add(self, timestamp, job=None):
+        """Index the results of a run published by a job, and summarize them."""
+        try:
+            stat = os.stat(os.path.join(self.runs_dir, timestamp))
+        except FileNotFoundError:
+            return
+        with transaction(self.db_path) as connection:
+            self._scan_run(connection, timestamp, stat, job)
+
+    def refresh(self):
+        """Bring the index up to date if the results directory changed since it was last synchronized.
+
+        This costs a single stat call while nothing changed.
+        """
+        try:
+            mtime_ns = os.stat(self.runs_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = 0
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute("SELECT value FROM results_index_state WHERE key = 'runs_dir_mtime_ns'").fetchone()
+        if row is not None and row['value'] == mtime_ns:
+            return
+        self.synchronize()
+
+    def synchronize(self):
+        """Index the runs added or changed since the last synchronization and forget the removed ones."""
+        with transaction(self.db_path) as connection:
+            try:
+                mtime_ns = os.stat(self.runs_dir).st_mtime_ns
+                entries = [entry for entry in os.scandir(self.runs_dir) if entry.is_dir()]
+            except FileNotFoundError:
+                mtime_ns, entries = 0, []
+            indexed = {row['timestamp']: row['mtime_ns'] for row in connection.execute('SELECT timestamp, mtime_ns FROM runs')}
+            for entry in entries:
+                stat = entry.stat()
+                if indexed.pop(entry.name, None) != stat.st_mtime_ns:
+                    self._scan_run(connection, entry.name, stat)
+            for timestamp in indexed:
+                connection.execute('DELETE FROM runs WHERE timestamp = ?', (timestamp,))
+                connection.execute('DELETE FROM run_images WHERE timestamp = ?', (timestamp,))
+            connection.execute("INSERT OR REPLACE INTO results_index_state (key, value) VALUES ('runs_dir_mtime_ns', ?)",
+                               (mtime_ns,))
+        logger.info(f"Results index synchronized with {self.runs_dir}.")
+
+    def page(self, limit, cursor=None, since=None, until=None, outcome=None):
+        """Return a page of runs, the most recent first, and the cursor of the next page.
+
+        The cursor is the position of the last run of the previous page, so
+        pages stay consistent while new runs are added. `since` and `until`
+        are inclusive bounds of the timestamps. The cursor of the last page
+        is None.
+        """
+        self.refresh()
+        conditions, parameters = [], []
+        if cursor is not None:
+            conditions.append('(mtime_ns < ? OR (mtime_ns = ? AND timestamp < ?))')
+            parameters += [cursor[0], cursor[0], cursor[1]]
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append('timestamp <= ?')
+            parameters.append(until)
+        if outcome is not None:
+            conditions.append('outcome = ?')
+            parameters.append(outcome)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with closing(connect(self.db_path)) as connection:
+            rows = connection.execute(
+                f'SELECT timestamp, mtime_ns, outcome, passed, failed FROM runs {where} '
+                f'ORDER BY mtime_ns DESC, timestamp DESC LIMIT ?', (*parameters, limit + 1)).fetchall()
+        runs = [dict(row) for row in rows[:limit]]
+        next_cursor = (runs[-1]['mtime_ns'], runs[-1]['timestamp']) if len(rows) > limit else None
+        return runs, next_cursor
+
+    def latest(self):
+        """Return the timestamp of the most recent run, or None."""
+        self.refresh()
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute('SELECT timestamp FROM runs ORDER BY mtime_ns DESC, timestamp DESC LIMIT 1').fetchone()
+        return row['timestamp'] if row is not None else None
+
+    def summary(self, timestamp):
+        """Return the summary of a run, or None if there is no such run."""
+        self.refresh()
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute('SELECT summary FROM runs WHERE timestamp = ?', (timestamp,)).fetchone()
+        return json.loads(row['summary']) if row is not None and row['summary'] else None
+
+    def pin(self, timestamp, pinned=True):
+        """Pin a run, so it is never removed by the retention, or unpin it."""
+        with transaction(self.db_path) as connection:
+            if pinned:
+                connection.execute('INSERT OR IGNORE INTO pinned_runs (timestamp, pinned) VALUES (?, ?)',
+                                   (timestamp, time.time()))
+            else:
+                connection.execute('DELETE FROM pinned_runs WHERE timestamp = ?', (timestamp,))
+
+    def job_ids(self):
+        """Return the ids of the jobs that published the indexed runs."""
+        self.refresh()
+        with closing(connect(self.db_path)) as connection:
+            return {row[0] for row in connection.execute(
+                "SELECT json_extract(summary, '$.job.id') FROM runs WHERE summary IS NOT NULL") if row[0] is not None}
+
+    def runs_by_age(self):
+        """Return the runs with their modification time, pull request and whether they are pinned, the oldest first."""
+        self.refresh()
+        with closing(connect(self.db_path)) as connection:
+            return [dict(row) for row in connection.execute(
+                'SELECT runs.timestamp, mtime, repo_full_name, pull_number, pinned_runs.timestamp IS NOT NULL AS pinned '
+                'FROM runs LEFT JOIN pinned_runs ON pinned_runs.timestamp = runs.timestamp '
+                'ORDER BY mtime_ns, runs.timestamp')]
+
+    def remove(self, timestamp, trash_dir):
+        """Remove a run from the results and the index in one step, returning the path it was moved to.
+
+        The run directory is renamed into `trash_dir`, on the same filesystem,
+        in the transaction removing it from the index. Pages being rendered
+        still read its files, but no new request finds the run, and the run is
+        never left half deleted. The caller deletes the moved directory.
+        """
+        os.makedirs(trash_dir, exist_ok=True)
+        target = os.path.join(trash_dir, f"{timestamp}.{os.getpid()}.{time.time_ns()}")
+        with transaction(self.db_path) as connection:
+            connection.execute('DELETE FROM runs WHERE timestamp = ?', (timestamp,))
+            connection.execute('DELETE FROM run_images WHERE timestamp = ?', (timestamp,))
+            connection.execute('DELETE FROM pinned_runs WHERE timestamp = ?', (timestamp,))
+            row = connection.execute("SELECT value FROM results_index_state WHERE key = 'runs_dir_mtime_ns'").fetchone()
+            synchronized = row is not None and row['value'] == os.stat(self.runs_dir).st_mtime_ns
+            try:
+                os.rename(os.path.join(self.runs_dir, timestamp), target)
+            except FileNotFoundError:
+                return None
+            if synchronized:
+                # The index stays synchronized, the removal does not cause a new scan of the results directory
+                connection.execute("UPDATE results_index_state SET value = ? WHERE key = 'runs_dir_mtime_ns'",
+                                   (os.stat(self.runs_dir).st_mtime_ns,))
+        return target
+
+    def images(self, timestamp, kind):
+        """Return the names of the images of a kind in a run, the most recent first."""
+        with closing(connect(self.db_path)) as connection:
+            return [row['name'] for row in connection.execute(
+                'SELECT name FROM run_images WHERE timestamp = ? AND kind = ? ORDER BY mtime DESC, name',
+                (timestamp, kind))]
@@ -0,0 +1,158 @@
+import os
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """Removes old test results within the age and disk space quotas.
+
+    Runs older than `max_age_days` are removed, and while the filesystem of
+    the results has less than `min_free_bytes` free, the oldest runs are
+    removed even before that age. The most recent run, the `keep_per_pr`
+    most recent runs of every pull request and pinned runs are kept.
+
+    The runs are found in the results index, so a pass costs a query instead
+    of walking the results. Every run is removed as a whole, from the
+    results directory and the index at once, together with its thumbnails
+    and tiles. The blobs of its images are released when no other run uses
+    them anymore. The directories of the jobs, with their logs and timings,
+    are removed once they are older than `max_age_days` and none of their
+    runs is left.
+    """
+
+    def __init__(self, results_index, blob_store=None, trash_dir=Config.RESULTS_TRASH_DIR,
+                 max_age_days=Config.RESULTS_MAX_AGE_DAYS, min_free_bytes=Config.RESULTS_MIN_FREE_BYTES,
+                 keep_per_pr=Config.RESULTS_KEEP_PER_PR, interval=Config.RETENTION_INTERVAL,
+                 cache_dirs=(Config.THUMBNAIL_DIR, Config.TILE_DIR), job_dir_base=Config.JOB_DIR_BASE):
+        self.results_index = results_index
+        self.blob_store = blob_store
+        self.trash_dir = trash_dir
+        self.max_age_days = max_age_days
+        self.min_free_bytes = min_free_bytes
+        self.keep_per_pr = keep_per_pr
+        self.interval = interval
+        self.cache_dirs = cache_dirs
+        self.job_dir_base = job_dir_base
+
+    def start(self):
+        """Start the thread enforcing the retention every `interval` seconds."""
+        thread = threading.Thread(target=self._work, name="retention", daemon=True)
+        thread.start()
+
+    def _work(self):
+        while True:
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Error while enforcing the retention of the test results: {e}")
+            time.sleep(self.interval)
+
+    def protected(self, runs):
+        """Return the timestamps of the runs that are never removed."""
+        protected = {run['timestamp'] for run in runs if run['pinned']}
+        if runs:
+            protected.add(runs[-1]['timestamp'])
+        by_pull_request = {}
+        for run in runs:
+            if run['pull_number'] is not None:
+                by_pull_request.setdefault((run['repo_full_name'], run['pull_number']), []).append(run['timestamp'])
+        for timestamps in by_pull_request.values():
+            protected.update(timestamps[-self.keep_per_pr:] if self.keep_per_pr > 0 else [])
+        return protected
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.results_index.runs_dir).free
+
+    def low_on_space(self):
+        return self.free_bytes() < self.min_free_bytes
+
+    def enforce(self, now=None):
+        """Remove the runs beyond the quotas, returning their timestamps.
+
+        Only one server process enforces the retention at a time, the others
+        skip their pass.
+        """
+        os.makedirs(self.trash_dir, exist_ok=True)
+        with open(os.path.join(self.trash_dir, '.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return []
+            try:
+                return self._enforce(time.time() if now is None else now)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _enforce(self, now):
+        # Runs moved to the trash by an interrupted pass
+        self.empty_trash()
+        runs = self.results_index.runs_by_age()
+        protected = self.protected(runs)
+        removed = []
+        # The images of the removed runs only free space once their blobs are collected
+        uncollected = 0
+        for run in runs:
+            if run['timestamp'] in protected:
+                continue
+            if now - run['mtime'] <= self.max_age_days * 86400:
+                # The blob store is only scanned once the removed runs are expected to free enough space
+                if uncollected and self.free_bytes() + uncollected >= self.min_free_bytes:
+                    self.collect_garbage()
+                    uncollected = 0
+                if not self.low_on_space():
+                    # The runs are sorted by age, all following ones are younger
+                    break
+            if self.blob_store is not None:
+                uncollected += self.blob_store.exclusive_bytes(os.path.join(self.results_index.runs_dir, run['timestamp']))
+            self.remove(run['timestamp'])
+            removed.append(run['timestamp'])
+        if removed:
+            self.collect_garbage()
+            logger.info(f"Removed {len(removed)} test results: {', '.join(removed)}.")
+        removed_jobs = self.remove_job_dirs(now)
+        if removed_jobs:
+            logger.info(f"Removed the directories of {len(removed_jobs)} jobs.")
+        if self.low_on_space():
+            logger.warning(f"Less than {self.min_free_bytes} bytes free after removing all unprotected old test results.")
+        return removed
+
+    def remove(self, timestamp):
+        """Remove a run and the files derived from it."""
+        trashed = self.results_index.remove(timestamp, self.trash_dir)
+        for cache_dir in self.cache_dirs:
+            shutil.rmtree(os.path.join(cache_dir, timestamp), ignore_errors=True)
+        if trashed is not None:
+            shutil.rmtree(trashed, ignore_errors=True)
+
+    def remove_job_dirs(self, now):
+        """Remove the directories of the old jobs none of whose runs is left, returning their ids."""
+        if self.job_dir_base is None or not os.path.isdir(self.job_dir_base):
+            return []
+        referenced = self.results_index.job_ids()
+        removed = []
+        for entry in os.scandir(self.job_dir_base):
+            if not entry.name.isdigit() or int(entry.name) in referenced or not entry.is_dir(follow_symlinks=False):
+                continue
+            if now - entry.stat().st_mtime <= self.max_age_days * 86400:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(int(entry.name))
+        return removed
+
+    def collect_garbage(self):
+        if self.blob_store is not None:
+            self.blob_store.collect_garbage()
+
+    def empty_trash(self):
+        for entry in os.scandir(self.trash_dir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
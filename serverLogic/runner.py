@@ -0,0 +1,271 @@
+import os
+import socket
+import functools
+import logging
+import threading
+import time
+from api_utils import post_github_comment
+from container_utils import clone_and_test_pull_request, remove_existing_container
+from process_utils import JobCancelled
+from result_cache import data_version, scenario_selection_key
+from job_timings import read_timings
+from results_index import IMAGE_PATTERNS
+from thumbnails import generate_run_thumbnails
+from tiles import generate_run_pyramids
+from cache_utils import prune_cache
+from runner_image import runner_image_fingerprint
+from config import Config
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+JOB_DIR_BASE = Config.JOB_DIR_BASE
+DATA_DIR = Config.DATA_DIR
+HOST_URL = Config.HOST_URL
+
+
+def job_container_name(job_id):
+    """Return the name of the Docker container running a job."""
+    return f"pytroll-image-test-{job_id}"
+
+def job_dir(job_id):
+    """Return the directory the pull request of a job is checked out and tested in."""
+    return os.path.join(JOB_DIR_BASE, str(job_id))
+
+@functools.lru_cache(maxsize=None)
+def current_data_version():
+    """Return the version of the reference data, fingerprinted once per server process unless it is configured."""
+    return Config.REFERENCE_DATA_VERSION or data_version(DATA_DIR)
+
+def result_cache_key(head_sha, base_sha=None):
+    """Return the key of the results of a commit in the current environment and scenario selection."""
+    selection = scenario_selection_key(Config.SCENARIO_SELECTION, base_sha, Config.SCENARIO_RULES, Config.SCENARIO_FALLBACK)
+    return head_sha, runner_image_fingerprint(), current_data_version(), selection
+
+def find_cached_results(result_cache, head_sha, base_sha=None):
+    """Return the timestamp of earlier results for a commit in the current environment, or None."""
+    if result_cache is None or not head_sha:
+        return None
+    return result_cache.lookup(*result_cache_key(head_sha, base_sha))
+
+def job_commenter(job, github_token, outbox=None):
+    """Return the function posting the status messages of a job.
+
+    With an outbox, all messages of the job go into a single comment sent in
+    the background, otherwise each message is posted right away.
+    """
+    if outbox is None:
+        return functools.partial(post_github_comment, job['repo_full_name'], job['pull_number'], github_token=github_token)
+    return functools.partial(outbox.post, f"job-{job['id']}", job['repo_full_name'], job['pull_number'])
+
+def post_cached_results_comment(post_comment, head_sha, timestamp):
+    message = (f"The commit {head_sha[:7]} was already tested with the same environment and reference data. "
+               f"See the test results for this pull request [here]({HOST_URL}/{timestamp})!")
+    logger.info(message)
+    post_comment(message)
+
+def create_previews(results_index, timestamp):
+    """Create the thumbnails and tile pyramids of the images of a run, so the results page and viewer do not wait for them."""
+    images = [(kind, name) for kind in IMAGE_PATTERNS for name in results_index.images(timestamp, kind)]
+    generate_run_thumbnails(Config.TEST_RESULTS_BASE_PATH, timestamp, images)
+    keys = [name[len('generated_'):-len('.png')] for name in results_index.images(timestamp, 'generated')]
+    generate_run_pyramids(Config.TEST_RESULTS_BASE_PATH, timestamp, keys)
+    try:
+        prune_cache(Config.THUMBNAIL_DIR, Config.THUMBNAIL_CACHE_MAX_BYTES, Config.THUMBNAIL_CACHE_MAX_AGE_DAYS)
+        prune_cache(Config.TILE_DIR, Config.TILE_CACHE_MAX_BYTES, Config.TILE_CACHE_MAX_AGE_DAYS)
+    except Exception as e:
+        logger.error(f"Error while pruning the thumbnails and tiles: {e}")
+
+def collect_unused_blobs(blob_store):
+    """Remove the blobs no run refers to anymore."""
+    try:
+        freed = blob_store.collect_garbage()
+        if freed:
+            print(f"Removed {freed} bytes of images no longer used by any run.")
+    except Exception as e:
+        logger.error(f"Error while removing the unused images: {e}")
+
+def record_job_metrics(metrics, job, status):
+    """Count a finished job, its duration and the durations of its phases and scenarios in the metrics."""
+    metrics.inc('image_comparison_jobs_total', {'status': status})
+    metrics.observe('image_comparison_job_queue_wait_seconds', job['started'] - job['created'])
+    metrics.observe('image_comparison_job_duration_seconds', time.time() - job['started'])
+    timings = read_timings(job_dir(job['id'])) if status != 'cached' else None
+    for phase in (timings or {}).get('phases', []):
+        if phase['duration'] is not None:
+            metrics.observe('image_comparison_job_phase_duration_seconds', phase['duration'], {'phase': phase['phase']})
+    for scenario in (timings or {}).get('scenarios', []):
+        metrics.observe('image_comparison_scenario_duration_seconds', scenario['duration'], {'status': scenario['status']})
+
+def run_job(job, github_token, result_cache=None, results_index=None, blob_store=None, retention=None,
+            outbox=None):
+    """Run the tests of a claimed job.
+
+    Returns the final status of the job, an error message and the timestamp
+    of its results.
+    """
+    repo_full_name = job['repo_full_name']
+    pull_number = job['pull_number']
+    post_comment = job_commenter(job, github_token, outbox)
+    try:
+        # An identical job may have finished while this one was queued
+        cached = find_cached_results(result_cache, job.get('head_sha'), job.get('base_sha'))
+        if cached is not None:
+            post_cached_results_comment(post_comment, job['head_sha'], cached)
+            return 'cached', None, cached
+
+        message = f"Starting to clone and test the repository {repo_full_name}"
+        logger.info(message)
+        post_comment(message)
+
+        head_sha, published = clone_and_test_pull_request(
+            repo_full_name, pull_number, job['clone_url'], job['branch_name'],
+            job_dir(job['id']), DATA_DIR, Config.USER_NAME, github_token,
+            container_name=job_container_name(job['id']), base_sha=job.get('base_sha'), post_comment=post_comment,
+            cancel=job.get('cancel'), blob_store=blob_store)
+        result = published[-1] if published else None
+        if blob_store is not None:
+            collect_unused_blobs(blob_store)
+        if results_index is not None:
+            for timestamp in published:
+                results_index.add(timestamp, dict(job, head_sha=head_sha))
+                create_previews(results_index, timestamp)
+        if result_cache is not None and result is not None:
+            result_cache.store(*result_cache_key(head_sha, job.get('base_sha')), result, job['id'])
+        if retention is not None:
+            # The new results may push the disk over its quota
+            try:
+                retention.enforce()
+            except Exception as e:
+                logger.error(f"Error while enforcing the retention of the test results: {e}")
+        return 'done', None, result
+
+    except JobCancelled:
+        message = "The tests were stopped before they finished."
+        logger.info(f"Job {job['id']}: {message}")
+        post_comment(message)
+        return 'failed', message, None
+
+    except Exception as e:
+        error_message = f"Error while cloning the repository: {str(e)}"
+        logger.error(error_message)
+        try:
+            post_comment(error_message)
+        except Exception as comment_error:
+            logger.error(f"Error while posting the error comment: {comment_error}")
+        return 'failed', error_message, None
+
+
+class RunnerPool:
+    """Runner threads working off the job queue.
+
+    Every server process starts its own pool, but the job queue never lets
+    more than `slots` jobs run at the same time across all processes.
+    """
+
+    def __init__(self, job_queue, run, slots=Config.RUNNER_SLOTS, poll_interval=10,
+                 heartbeat_interval=Config.JOB_HEARTBEAT_INTERVAL, stale_after=Config.JOB_STALE_AFTER, metrics=None,
+                 cancel_poll_interval=2, job_timeout=Config.JOB_TIMEOUT):
+        self.job_queue = job_queue
+        self.run = run
+        self.metrics = metrics
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        # The start time tells apart processes that happen to get the same pid after a restart
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+        self.cancel_poll_interval = cancel_poll_interval
+        self.job_timeout = job_timeout
+        self._wakeup = threading.Event()
+        self._threads = []
+        # The events telling the jobs running in this process to stop, by job id
+        self._cancel_events = {}
+        self._cancel_lock = threading.Lock()
+
+    def start(self):
+        """Start the runner threads and the thread keeping their claims alive."""
+        for slot in range(self.slots):
+            thread = threading.Thread(target=self._work, name=f"runner-{slot}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._keep_alive, name="runner-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        thread = threading.Thread(target=self._watch_cancellations, name="runner-cancellations", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"Started {self.slots} runner slots in process {self.owner}.")
+
+    def notify(self):
+        """Wake up idle runners, e.g. after a job was submitted."""
+        self._wakeup.set()
+
+    def _work(self):
+        while True:
+            try:
+                job = self.job_queue.claim(self.owner, self.slots)
+            except Exception as e:
+                logger.error(f"Error while claiming a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            logger.info(f"Runner {threading.current_thread().name} starts job {job['id']}.")
+            cancel = threading.Event()
+            with self._cancel_lock:
+                self._cancel_events[job['id']] = cancel
+            try:
+                status, error, result = self.run(dict(job, cancel=cancel))
+            except Exception as e:
+                status, error, result = 'failed', str(e), None
+                logger.error(f"Unexpected error in job {job['id']}: {e}")
+            finally:
+                with self._cancel_lock:
+                    del self._cancel_events[job['id']]
+            if self.job_queue.finish(job['id'], self.owner, status, error, result):
+                if cancel.is_set():
+                    # The job ends with the status it was stopped with
+                    status = self.job_queue.get(job['id'])['status']
+                logger.info(f"Job {job['id']} finished with status {status}.")
+                if self.metrics is not None:
+                    try:
+                        record_job_metrics(self.metrics, job, status)
+                    except Exception as e:
+                        logger.error(f"Error while recording the metrics of job {job['id']}: {e}")
+            else:
+                logger.error(f"Job {job['id']} was taken over by another runner, its status {status} is discarded.")
+
+    def _keep_alive(self):
+        while True:
+            try:
+                self.job_queue.heartbeat(self.owner)
+                # Take over the jobs of runners that died, e.g. in a server process that was killed
+                for job_id in self.job_queue.recover_stale(self.stale_after):
+                    logger.error(f"Runner of job {job_id} stopped responding, the job is released.")
+                    remove_existing_container(job_container_name(job_id))
+                    self.notify()
+            except Exception as e:
+                logger.error(f"Error while renewing the job claims: {e}")
+            time.sleep(self.heartbeat_interval)
+
+    def _watch_cancellations(self):
+        while True:
+            try:
+                # A runaway job does not hold its slot for longer than the timeout
+                if self.job_timeout:
+                    for job_id in self.job_queue.cancel_overdue(self.job_timeout):
+                        logger.error(f"Job {job_id} ran for more than {self.job_timeout} seconds, stopping it.")
+                for job_id, cancel_status in self.job_queue.cancel_requests(self.owner).items():
+                    with self._cancel_lock:
+                        cancel = self._cancel_events.get(job_id)
+                    # The runner of the job stops its container within seconds, see run_container
+                    if cancel is not None and not cancel.is_set():
+                        logger.info(f"Job {job_id} is {cancel_status}, stopping it.")
+                        cancel.set()
+            except Exception as e:
+                logger.error(f"Error while checking for jobs to stop: {e}")
+            time.sleep(self.cancel_poll_interval)
@@ -0,0 +1,125 @@
+"""Run the shards of the behave scenarios of a job as parallel behave processes.
+
+This script runs in the job container, with the Python of the runner image,
+so it only uses the standard library.
+
+The behave steps read their data from and write their results below a fixed
+data directory. Every shard therefore runs in a copy of the behave directory
+whose steps use a data directory of its own: it links the reference and
+satellite data of the job and has a results directory of its own. All shards
+are started at once. The output of every shard goes into the log with the
+shard as line prefix. The results directory, relative to the work directory,
+and the exit code of every shard are written as JSON to the status file, for
+the server to merge the results. The script fails if a shard crashed without
+writing results.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+# The directory of the results of the runs, below the data directory
+RESULTS_SUBDIR = os.path.join('test_results', 'image_comparison')
+
+
+def copy_output(process, shard, log_file, lock):
+    """Append the output of a shard to the log, with the shard as line prefix."""
+    for line in process.stdout:
+        with lock:
+            log_file.write(f"[shard {shard}] {line}")
+            log_file.flush()
+
+def prepare_shard(shard, behave_dir, data_dir, work_dir):
+    """Create the behave and data directories of a shard below the work directory and return them.
+
+    The data directory of the shard links everything in `data_dir` but the
+    test results. The steps in the copy of the behave directory refer to it
+    instead of `data_dir`.
+    """
+    shard_dir = os.path.join(work_dir, str(shard))
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    shard_data_dir = os.path.join(shard_dir, 'ext_data')
+    os.makedirs(os.path.join(shard_data_dir, RESULTS_SUBDIR))
+    for name in os.listdir(data_dir):
+        if name != 'test_results':
+            os.symlink(os.path.join(data_dir, name), os.path.join(shard_data_dir, name))
+    shard_behave_dir = os.path.join(shard_dir, 'behave')
+    shutil.copytree(behave_dir, shard_behave_dir, symlinks=True)
+    redirected = False
+    for root, dirs, files in os.walk(shard_behave_dir):
+        for name in files:
+            if not name.endswith('.py'):
+                continue
+            path = os.path.join(root, name)
+            with open(path) as file:
+                source = file.read()
+            if data_dir in source:
+                with open(path, 'w') as file:
+                    file.write(source.replace(data_dir, shard_data_dir))
+                redirected = True
+    if not redirected:
+        print(f"The behave steps do not refer to {data_dir}, shard {shard} cannot be given its own results directory.")
+    return shard_behave_dir, shard_data_dir
+
+def shard_results_dir(shard_data_dir, work_dir):
+    """Return the results directory a shard wrote, relative to the work directory, or None."""
+    results_dir = os.path.join(shard_data_dir, RESULTS_SUBDIR)
+    names = sorted(os.listdir(results_dir))
+    if not names:
+        return None
+    # The steps write a single directory per behave process
+    return os.path.relpath(os.path.join(results_dir, names[0]), work_dir)
+
+def run_shards(shards, behave_dir, data_dir, work_dir, log_path, junit_dir=None, behave='behave'):
+    """Run the shards, given as lists of behave locations, and return the status of every shard."""
+    lock = threading.Lock()
+    processes, threads, data_dirs = [], [], []
+    with open(log_path, 'a') as log_file:
+        for shard, locations in enumerate(shards):
+            shard_behave_dir, shard_data_dir = prepare_shard(shard, behave_dir, data_dir, work_dir)
+            command = [behave]
+            if junit_dir is not None:
+                command += ['--junit', '--junit-directory', os.path.join(junit_dir, str(shard))]
+            process = subprocess.Popen(command + locations, cwd=shard_behave_dir, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, text=True, errors='replace')
+            thread = threading.Thread(target=copy_output, args=(process, shard, log_file, lock))
+            thread.start()
+            processes.append(process)
+            threads.append(thread)
+            data_dirs.append(shard_data_dir)
+        statuses = []
+        for shard, (locations, process, thread, shard_data_dir) in enumerate(zip(shards, processes, threads, data_dirs)):
+            returncode = process.wait()
+            thread.join()
+            statuses.append({'shard': shard, 'locations': locations, 'returncode': returncode,
+                             'results_dir': shard_results_dir(shard_data_dir, work_dir)})
+    return statuses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shard', action='append', required=True,
+                        help="Comma separated behave locations of a shard, given once per shard")
+    parser.add_argument('--data-dir', required=True, help="The data directory the behave steps refer to")
+    parser.add_argument('--work-dir', required=True, help="The directory the shards are prepared in")
+    parser.add_argument('--behave-dir', default=os.getcwd())
+    parser.add_argument('--log', required=True)
+    parser.add_argument('--status', required=True)
+    parser.add_argument('--junit-dir')
+    args = parser.parse_args(argv)
+    statuses = run_shards([shard.split(',') for shard in args.shard], args.behave_dir, args.data_dir, args.work_dir,
+                          args.log, args.junit_dir)
+    with open(args.status, 'w') as status_file:
+        json.dump(statuses, status_file, indent=2)
+    # Failing scenarios are reported in the results, only a shard that crashed without any fails the job
+    crashed = [status['shard'] for status in statuses if status['results_dir'] is None]
+    if crashed:
+        print(f"The shards {crashed} stopped without results.", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
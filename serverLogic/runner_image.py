@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import subprocess
+import time
+import fcntl
+from contextlib import contextmanager
+from config import Config
+from process_utils import check_cancelled, run_cancellable
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+RUNNER_IMAGE_NAME = Config.RUNNER_IMAGE_NAME
+RUNNER_DOCKERFILE = Config.RUNNER_DOCKERFILE
+RUNNER_IMAGE_STATE_DIR = Config.RUNNER_IMAGE_STATE_DIR
+# A runner image is only removed once no job got its tag for this many seconds,
+# so a job never loses its image between getting the tag and starting its container
+STALE_IMAGE_GRACE = 3600
+
+
+def runner_build_args():
+    """Return the build arguments of the runner image."""
+    return {
+        'MINIFORGE_VERSION': Config.MINIFORGE_VERSION,
+        'RUNNER_PACKAGES': Config.RUNNER_PACKAGES,
+    }
+
+def runner_image_fingerprint(dockerfile=RUNNER_DOCKERFILE, build_args=None):
+    """Hash the Dockerfile and the build arguments into a short fingerprint."""
+    if build_args is None:
+        build_args = runner_build_args()
+    sha = hashlib.sha256()
+    with open(dockerfile, 'rb') as file:
+        sha.update(file.read())
+    for key, value in sorted(build_args.items()):
+        sha.update(f"\n{key}={value}".encode('utf-8'))
+    return sha.hexdigest()[:12]
+
+def runner_image_tag(dockerfile=RUNNER_DOCKERFILE, build_args=None):
+    """Return the tag of the runner image for the current dependency spec."""
+    return f"{RUNNER_IMAGE_NAME}:{runner_image_fingerprint(dockerfile, build_args)}"
+
+def image_exists(tag):
+    """Check if a Docker image with the given tag exists locally."""
+    result = subprocess.run(['docker', 'image', 'inspect', tag],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def build_runner_image(tag, dockerfile=RUNNER_DOCKERFILE, build_args=None, cancel=None):
+    """Build the runner image from the Dockerfile.
+
+    The Dockerfile does not copy any files, so it is sent on stdin without a
+    build context. The build is stopped once the `cancel` event is set.
+    """
+    if build_args is None:
+        build_args = runner_build_args()
+    cmd = ['docker', 'build', '-t', tag]
+    for key, value in build_args.items():
+        cmd += ['--build-arg', f"{key}={value}"]
+    cmd.append('-')
+    logger.info(f"Building runner image {tag}")
+    # BuildKit is needed for the package cache mount
+    env = dict(os.environ, DOCKER_BUILDKIT='1')
+    with open(dockerfile, 'rb') as file:
+        run_cancellable(cmd, cancel, stdin=file, env=env)
+    print(f"Runner image {tag} successfully built.")
+
+@contextmanager
+def build_lock(cancel=None, state_dir=RUNNER_IMAGE_STATE_DIR):
+    """Hold the lock on building and removing runner images, shared by all server processes.
+
+    Waiting for the lock ends with JobCancelled once the `cancel` event is set.
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, 'build.lock'), 'w') as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                check_cancelled(cancel)
+                time.sleep(1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def usage_path(tag, state_dir=RUNNER_IMAGE_STATE_DIR):
+    """Return the file whose modification time is the last time a job got the runner image with a tag."""
+    return os.path.join(state_dir, f"{tag.rsplit(':', 1)[-1]}.used")
+
+def mark_used(tag, state_dir=RUNNER_IMAGE_STATE_DIR):
+    with open(usage_path(tag, state_dir), 'w'):
+        pass
+
+def recently_used(tag, state_dir=RUNNER_IMAGE_STATE_DIR, grace=STALE_IMAGE_GRACE, now=None):
+    """Check whether a job got the runner image with a tag within the last `grace` seconds."""
+    now = time.time() if now is None else now
+    try:
+        return now - os.stat(usage_path(tag, state_dir)).st_mtime < grace
+    except FileNotFoundError:
+        return False
+
+def remove_stale_runner_images(keep_tag, state_dir=RUNNER_IMAGE_STATE_DIR):
+    """Remove runner images built for an outdated dependency spec that no job got recently.
+
+    Must be called with the build lock held.
+    """
+    try:
+        output = subprocess.check_output(['docker', 'image', 'ls', RUNNER_IMAGE_NAME, '--format', '{{.Repository}}:{{.Tag}}'])
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error while listing runner images: {e}")
+        return
+    for tag in output.decode('utf-8').split():
+        if tag == keep_tag or recently_used(tag, state_dir):
+            continue
+        # Images that are still used by a running job cannot be removed, they are cleaned up next time
+        result = subprocess.run(['docker', 'image', 'rm', tag], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            print(f"Stale runner image {tag} removed.")
+            try:
+                os.unlink(usage_path(tag, state_dir))
+            except FileNotFoundError:
+                pass
+
+def ensure_runner_image(cancel=None):
+    """Return the tag of an up-to-date runner image, building it if necessary.
+
+    Builds in other server processes are waited for, so every image is only
+    built once. Waiting for a build of another job and the build itself end
+    once the `cancel` event is set. The outdated runner images are removed
+    along, except the ones other jobs got recently.
+    """
+    tag = runner_image_tag()
+    with build_lock(cancel):
+        if not image_exists(tag):
+            build_runner_image(tag, cancel=cancel)
+        # Marked before the removal, the image of this job is never removed by another process
+        mark_used(tag)
+        remove_stale_runner_images(tag)
+    return tag
@@ -0,0 +1,120 @@
+import os
+import json
+import glob
+import fnmatch
+import logging
+import subprocess
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def changed_files(repo_dir, base_sha):
+    """Return the files changed by a pull request since it branched off `base_sha`."""
+    output = subprocess.check_output(['git', '-C', repo_dir, 'diff', '--name-only', f'{base_sha}...HEAD'])
+    return [line for line in output.decode('utf-8').splitlines() if line]
+
+def load_rules(path):
+    """Load the rules mapping changed files to the scenarios they affect."""
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+def select_patterns(files, rules, fallback='all'):
+    """Return the patterns selecting the scenarios affected by the changed files.
+
+    Every file is looked up in the rules:
+    - a file matching `run_all` requires all scenarios to run,
+    - a file matching the `paths` of a rule selects the scenarios matching its `select` patterns,
+    - a file matching `ignore` does not affect any scenario,
+    - any other file requires all scenarios to run if the fallback is 'all' and is ignored otherwise.
+    Returns None if all scenarios need to run.
+    """
+    selected = set()
+    for name in files:
+        if _matches(name, rules.get('run_all', [])):
+            return None
+        matching_rules = [rule for rule in rules.get('rules', []) if _matches(name, rule['paths'])]
+        for rule in matching_rules:
+            selected.update(rule['select'])
+        if not matching_rules and not _matches(name, rules.get('ignore', [])) and fallback == 'all':
+            logger.info(f"No rule for the changed file {name}, all scenarios are run.")
+            return None
+    return sorted(selected)
+
+def parse_example_rows(feature_file):
+    """Return the line numbers and cells of the rows of the example tables in a feature file."""
+    rows = []
+    in_examples = False
+    header_seen = False
+    with open(feature_file, 'r') as file:
+        for line_number, line in enumerate(file, start=1):
+            stripped = line.strip()
+            if ':' in stripped and stripped.split(':', 1)[0].strip() in ('Examples', 'Scenarios'):
+                in_examples = True
+                header_seen = False
+                continue
+            if not in_examples or not stripped or stripped.startswith('#'):
+                continue
+            if not stripped.startswith('|'):
+                in_examples = False
+                continue
+            if not header_seen:
+                header_seen = True
+                continue
+            rows.append((line_number, [cell.strip() for cell in stripped.strip('|').split('|')]))
+    return rows
+
+def select_scenarios(behave_dir, patterns):
+    """Return the behave locations of the example rows matching any of the patterns.
+
+    A row matches if one of its cells matches a pattern, ignoring case. Behave
+    runs a single row of a scenario outline when given its `file:line`.
+    """
+    patterns = [pattern.lower() for pattern in patterns]
+    locations = []
+    for feature_file in sorted(glob.glob(os.path.join(behave_dir, '**', '*.feature'), recursive=True)):
+        relative_path = os.path.relpath(feature_file, behave_dir)
+        for line_number, cells in parse_example_rows(feature_file):
+            if any(_matches(cell.lower(), patterns) for cell in cells):
+                locations.append(f"{relative_path}:{line_number}")
+    return locations
+
+def all_scenario_locations(behave_dir):
+    """Return the behave locations of all scenarios and of all example rows of the scenario outlines."""
+    locations = []
+    for feature_file in sorted(glob.glob(os.path.join(behave_dir, '**', '*.feature'), recursive=True)):
+        relative_path = os.path.relpath(feature_file, behave_dir)
+        with open(feature_file, 'r') as file:
+            line_numbers = [line_number for line_number, line in enumerate(file, start=1)
+                            if line.strip().startswith('Scenario:')]
+        line_numbers += [line_number for line_number, cells in parse_example_rows(feature_file)]
+        locations += [f"{relative_path}:{line_number}" for line_number in sorted(line_numbers)]
+    return locations
+
+def behave_locations(repo_dir, behave_dir, base_sha, rules_path, fallback='all'):
+    """Return the behave locations to run for a pull request.
+
+    Returns None if all scenarios need to run, and an empty list if the pull
+    request does not affect any scenario.
+    """
+    if not base_sha:
+        return None
+    try:
+        files = changed_files(repo_dir, base_sha)
+        rules = load_rules(rules_path)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logger.error(f"Error while selecting the scenarios, all scenarios are run: {e}")
+        return None
+    patterns = select_patterns(files, rules, fallback)
+    if patterns is None:
+        return None
+    locations = select_scenarios(behave_dir, patterns)
+    if not locations and fallback == 'all':
+        return None
+    logger.info(f"Selected {len(locations)} scenarios for the patterns {patterns}.")
+    return locations
@@ -1,19 +1,37 @@
 import logging
 import os
-from glob import glob
-from flask import Flask, request, jsonify, render_template, send_from_directory, abort
+from flask import Flask, request, jsonify, render_template, abort, Response, stream_with_context, g, url_for
 import json
-from api_utils import verify_signature, extract_pull_request_info, post_github_comment, validate_timestamp_path_component, validate_safe_path, shall_process_event
-from container_utils import clone_and_test_pull_request, check_container
-from werkzeug.exceptions import HTTPException
+from api_utils import verify_signature, extract_pull_request_info, validate_timestamp_path_component, validate_safe_path, shall_process_event, shall_cancel_event, verify_api_token
+from job_queue import JobQueue
+from result_cache import ResultCache
+from results_index import ResultsIndex, format_cursor, parse_cursor, IMAGE_PATTERNS, OUTCOMES
+from thumbnails import thumbnail_path
+from tiles import PyramidWorker, pyramid_path, source_image, IMAGE_NAMES
+from file_serving import send_file_response
+from directory_listing import DirectoryListings, SORT_KEYS
+from json_api import json_response
+from blob_store import BlobStore
+from retention import RetentionManager
+from webhooks import WebhookDeliveries, WebhookDispatcher
+from outbox import CommentOutbox
+from archives import ARCHIVE_FORMATS, run_archive_members, stream_archive
+from runner import RunnerPool, run_job, find_cached_results, post_cached_results_comment, job_commenter, job_dir
+from job_events import stream_job_events
+from metrics import Metrics, format_labels
+from werkzeug.exceptions import BadRequest, HTTPException
 from config import Config
-import threading
+import functools
 import sys
+import time
+import re
+from datetime import datetime
 
 # Import secrets
 from secret import GITHUB_TOKEN, WEBHOOK_SECRET
-
-container_lock = threading.Lock()
+import secret
+# The API endpoints changing jobs are refused without an API token
+API_TOKEN = getattr(secret, 'API_TOKEN', None)
 
 # configure the logger
 logging.basicConfig(level=logging.INFO)
@@ -28,84 +46,263 @@ TEST_RESULTS_BASE_PATH = Config.TEST_RESULTS_BASE_PATH
 CLONE_DIR_BASE = Config.CLONE_DIR_BASE
 
 
+def parse_run_filters(args, default_limit=50, max_limit=200):
+    """Parse the pagination and filter arguments of the run history.
+
+    `since` and `until` are dates (YYYY-MM-DD) and include the whole day.
+    """
+    try:
+        limit = min(max(int(args.get('limit', default_limit)), 1), max_limit)
+    except ValueError:
+        raise BadRequest(f"Invalid limit: {args.get('limit')}")
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            cursor = parse_cursor(cursor)
+            validate_timestamp_path_component(cursor[1])
+        except ValueError:
+            raise BadRequest(f"Invalid cursor: {cursor}")
+    dates = {}
+    for name, time_of_day in (('since', '00-00-00'), ('until', '23-59-59')):
+        value = args.get(name)
+        if value:
+            if not re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+                raise BadRequest(f"Invalid date format: {value}")
+            value = f"{value}-{time_of_day}"
+        dates[name] = value or None
+    outcome = args.get('outcome') or None
+    if outcome is not None and outcome not in OUTCOMES:
+        raise BadRequest(f"Invalid outcome: {outcome}")
+    return {'limit': limit, 'cursor': cursor or None, 'since': dates['since'], 'until': dates['until'], 'outcome': outcome}
+
+
 def create_app():
     app = Flask(__name__)
+
+    # Jobs are queued in a persistent queue and worked off by a fixed number of runner slots
+    job_queue = JobQueue(Config.JOB_DB_PATH)
+    deliveries = WebhookDeliveries(Config.JOB_DB_PATH)
+    result_cache = ResultCache(Config.JOB_DB_PATH, TEST_RESULTS_BASE_PATH) if Config.USE_RESULT_CACHE else None
+    results_index = ResultsIndex(Config.JOB_DB_PATH, TEST_RESULTS_BASE_PATH)
+    metrics = Metrics(Config.JOB_DB_PATH)
+    metrics.start()
+    directory_listings = DirectoryListings()
+    blob_store = BlobStore()
+    # The comments to the pull requests are sent in the background
+    outbox = CommentOutbox(Config.JOB_DB_PATH, GITHUB_TOKEN)
+    outbox.start()
+    retention = RetentionManager(results_index, blob_store)
+    runner_pool = RunnerPool(job_queue, functools.partial(run_job, github_token=GITHUB_TOKEN, result_cache=result_cache,
+                                                          results_index=results_index, blob_store=blob_store,
+                                                          retention=retention, outbox=outbox),
+                             Config.RUNNER_SLOTS, metrics=metrics)
+    runner_pool.start()
+    retention.start()
+    pyramid_worker = PyramidWorker(TEST_RESULTS_BASE_PATH)
+    pyramid_worker.start()
+
+    @app.template_filter('datetime')
+    def format_datetime(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.monotonic()
+
+    @app.after_request
+    def record_webhook_latency(response):
+        if request.endpoint == 'github_webhook':
+            try:
+                metrics.observe('image_comparison_webhook_duration_seconds', time.monotonic() - g.request_start,
+                                {'status': response.status_code})
+            except Exception as e:
+                logger.error(f"Error while recording the webhook latency: {e}")
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        counts = job_queue.count_by_status()
+        jobs = {format_labels({'status': status}): counts.get(status, 0) for status in ('queued', 'running')}
+        gauges = [('image_comparison_jobs', 'Jobs currently queued or running.', jobs)]
+        return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+    def process_delivery(delivery):
+        """Process a webhook delivery stored by `github_webhook`, returning the id of the job it queued if any."""
+        if delivery['event'] == 'ping':
+            logger.debug("Received GitHub ping event")
+            return None
+        data = json.loads(delivery['payload'])
+
+        if app.debug:
+            file_name = 'webhook_data.json'
+            with open(file_name, 'w') as json_file:
+                json.dump({
+                    'delivery': delivery['guid'],
+                    'event': delivery['event'],
+                    'body': data
+                }, json_file, indent=4)
+            logger.info(f"The webhook data was successfully written to '{file_name}'.")
+
+        # A review with the cancel command cancels the queued and running jobs of the pull request
+        if shall_cancel_event(data, GITHUB_TOKEN):
+            repo_full_name, clone_url, branch_name, pull_number = extract_pull_request_info(data)
+            user = data['sender']['login']
+            job_ids = job_queue.cancel_pull_request(repo_full_name, pull_number, f"Cancelled by {user}.")
+            for job_id in job_ids:
+                job = {'id': job_id, 'repo_full_name': repo_full_name, 'pull_number': pull_number}
+                job_commenter(job, GITHUB_TOKEN, outbox)(f"The job was cancelled by @{user}.")
+            logger.info(f"Cancelled the jobs {job_ids} of pull request {pull_number} of {repo_full_name}")
+            return job_ids[-1] if job_ids else None
+
+        # Process the pull request event
+        if not shall_process_event(data, GITHUB_TOKEN):
+            return None
+        repo_full_name, clone_url, branch_name, pull_number = extract_pull_request_info(data)
+        head_sha = data['pull_request']['head']['sha']
+        base_sha = data['pull_request']['base']['sha']
+
+        # Skip the run if this commit was already tested in the same environment
+        cached = find_cached_results(result_cache, head_sha, base_sha)
+        if cached is not None:
+            job_id = job_queue.record_cached(repo_full_name, pull_number, clone_url, branch_name, head_sha, cached)
+            metrics.inc('image_comparison_jobs_total', {'status': 'cached'})
+            job = {'id': job_id, 'repo_full_name': repo_full_name, 'pull_number': pull_number}
+            post_cached_results_comment(job_commenter(job, GITHUB_TOKEN, outbox), head_sha, cached)
+            return job_id
+
+        # Repeated triggers for a commit share a job, jobs for older commits of the pull request are superseded
+        job_id = job_queue.submit_for_pull_request(repo_full_name, pull_number, clone_url, branch_name, head_sha, base_sha,
+                                                   debounce=Config.JOB_DEBOUNCE)
+        runner_pool.notify()
+        logger.info(f"Job {job_id} queued for commit {head_sha[:7]} of pull request {pull_number} of {repo_full_name}")
+        return job_id
+
+    dispatcher = WebhookDispatcher(deliveries, process_delivery)
+    dispatcher.start()
+
     @app.route('/webhook', methods=['POST'])
     def github_webhook():
         try:
+            # The signature is checked on the body exactly as GitHub sent it, before anything is parsed
+            body = request.get_data()
+            try:
+                verify_signature(body, WEBHOOK_SECRET, request.headers.get('X-Hub-Signature-256'))
+            except HTTPException as e:
+                logger.error("Signature verification failed.")
+                return jsonify({'error': str(e)}), e.get_response().status_code
+
             if not request.is_json:
                 logger.error("Request does not contain JSON.")
                 return jsonify({'error': 'Request does not contain JSON'}), 400
 
-            data = request.get_json()
-            headers = dict(request.headers)
+            # The delivery is processed by the dispatcher, GitHub gets its answer without waiting for the GitHub API
+            delivery_id, new = deliveries.record(request.headers.get('X-GitHub-Delivery'),
+                                                 request.headers.get('X-GitHub-Event'), body)
+            status_url = f"{Config.HOST_URL}/api/v1/deliveries/{delivery_id}"
+            if not new:
+                logger.info(f"Ignoring the redelivery of webhook delivery {delivery_id}.")
+                return jsonify({'message': 'Duplicate delivery', 'delivery_id': delivery_id, 'status_url': status_url}), 200
+            dispatcher.notify()
+            return jsonify({'message': 'Delivery accepted', 'delivery_id': delivery_id, 'status_url': status_url}), 202
 
-            # Extract the signature from headers
-            signature_header = headers.get('X-Hub-Signature-256')
+        except HTTPException as e:
+            logger.error(f"HTTP Exception: {str(e)}")
+            return jsonify({'error': str(e)}), e.get_response().status_code
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return jsonify({'error': 'Internal server error'}), 500
 
-            # Verify the signature
-            try:
-                verify_signature(data, WEBHOOK_SECRET, signature_header)
-            except HTTPException as e:
-                logger.error("Signature verification failed.")
-                return jsonify({'error': str(e)}), e.get_response().status_code
 
-            # Handling GitHub ping event
-            if 'hook' in data and 'zen' in data:
-                logger.debug("Received GitHub ping event")
-                return jsonify({'message': 'Ping received successfully'}), 200
+    @app.route('/api/v1/deliveries/<int:delivery_id>', methods=['GET'])
+    def api_delivery(delivery_id):
+        delivery = deliveries.get(delivery_id)
+        if delivery is None:
+            abort(404)
+        if delivery['job_id'] is not None:
+            delivery['log_url'] = f"{Config.HOST_URL}/jobs/{delivery['job_id']}"
+        return json_response(delivery, max_age=0)
 
-            # Process the pull request event
-            if shall_process_event(data, GITHUB_TOKEN):
-                repo_full_name, clone_url, branch_name, pull_number = extract_pull_request_info(data)
 
-                def process_pull_request():
-                    with container_lock:
-                        try:
-                            clone_dir = f"{CLONE_DIR_BASE}/pull_request_{branch_name}"
-                            data_dir = f"{CLONE_DIR_BASE}/pytroll-image-comparison-tests/data"
+    def indexed_image_paths(timestamp, kind):
+        images = [{'path': f'/test_results/image_comparison/{timestamp}/{kind}/{name}',
+                   'thumbnail': url_for('serve_thumbnail', timestamp=timestamp, kind=kind, name=name), 'name': name}
+                  for name in results_index.images(timestamp, kind)]
+        if kind == 'generated':
+            # The generated images link to the viewer comparing them with their reference and difference images
+            for image in images:
+                key = image['name'][len('generated_'):-len('.png')]
+                image['viewer'] = url_for('display_image_viewer', timestamp=timestamp, key=key)
+        return images
 
-                            # Check if the container is already running
-                            if check_container('clone-repo-image'):
-                                message = "A job is already running for this repository. Please wait for the current job to finish."
-                                logger.info(message)
-                                post_github_comment(repo_full_name, pull_number, message, GITHUB_TOKEN)
-                                return
 
-                            message = f"Starting to clone and test the repository {repo_full_name}"
-                            logger.info(message)
-                            post_github_comment(repo_full_name, pull_number, message, GITHUB_TOKEN)
+    @app.route('/thumbnails/<timestamp>/<kind>/<name>', methods=['GET'])
+    def serve_thumbnail(timestamp, kind, name):
+        validate_timestamp_path_component(timestamp)
+        if kind not in IMAGE_PATTERNS or name not in results_index.images(timestamp, kind):
+            abort(404)
 
-                            # Proceed with the cloning and testing
-                            clone_and_test_pull_request(repo_full_name, pull_number, clone_url, branch_name, clone_dir, data_dir, USER_NAME, GITHUB_TOKEN)
+        # Thumbnails are created by the runner after a job, runs without them show the full image meanwhile
+        path = thumbnail_path(timestamp, kind, name)
+        if not os.path.exists(path):
+            return send_file_response(TEST_RESULTS_BASE_PATH, os.path.join('image_comparison', timestamp, kind, name))
+        # A thumbnail never changes, the results of a run are not modified after they are published
+        return send_file_response(Config.THUMBNAIL_DIR, os.path.relpath(path, Config.THUMBNAIL_DIR), immutable=True)
 
-                            if app.debug:
-                                file_name = 'webhook_data.json'
-                                with open(file_name, 'w') as json_file:
-                                    json.dump({
-                                        'headers': headers,
-                                        'body': data
-                                    }, json_file, indent=4)
 
-                                logger.info(f"The webhook data was successfully written to '{file_name}'.")
+    def validate_tile_request(timestamp, kind, key):
+        validate_timestamp_path_component(timestamp)
+        if kind not in IMAGE_NAMES or not re.match(r'^[A-Za-z0-9][\w.-]*$', key):
+            abort(404)
 
-                        except Exception as e:
-                            error_message = f"Error while cloning the repository: {str(e)}"
-                            logger.error(error_message)
-                            post_github_comment(repo_full_name, pull_number, error_message, GITHUB_TOKEN)
 
-                # Start processing the pull request in a new thread
-                threading.Thread(target=process_pull_request).start()
-                return jsonify({'message': 'Processing started'}), 200
+    @app.route('/<timestamp>/download.<archive_format>', methods=['GET'])
+    def download_run(timestamp, archive_format):
+        validate_timestamp_path_component(timestamp)
+        summary = results_index.summary(timestamp)
+        if archive_format not in ARCHIVE_FORMATS or summary is None:
+            abort(404)
 
-            return jsonify({'message': 'Daten erfolgreich empfangen'}), 200
+        log_path = os.path.join(job_dir(summary['job']['id']), 'output.log') if summary['job'] else None
+        members = run_archive_members(os.path.join(TEST_RESULTS_BASE_PATH, 'image_comparison', timestamp), timestamp,
+                                      log_path, redact=GITHUB_TOKEN)
+        # The archive is made while it is sent, without a temporary file
+        return Response(stream_with_context(stream_archive(members, archive_format)),
+                        mimetype=ARCHIVE_FORMATS[archive_format],
+                        headers={'Content-Disposition': f'attachment; filename="{timestamp}.{archive_format}"',
+                                 'X-Accel-Buffering': 'no'})
 
-        except HTTPException as e:
-            logger.error(f"HTTP Exception: {str(e)}")
-            return jsonify({'error': str(e)}), e.get_response().status_code
-        except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            return jsonify({'error': 'Internal server error'}), 500
+
+    @app.route('/<timestamp>/viewer/<key>', methods=['GET'])
+    def display_image_viewer(timestamp, key):
+        validate_tile_request(timestamp, 'generated', key)
+        if IMAGE_NAMES['generated'].format(key=key) not in results_index.images(timestamp, 'generated'):
+            abort(404)
+        return render_template('image_viewer.html', timestamp=timestamp, key=key, kinds=['reference', 'generated', 'difference'])
+
+
+    @app.route('/tiles/<timestamp>/<kind>/<key>.dzi', methods=['GET'])
+    def serve_tile_descriptor(timestamp, kind, key):
+        validate_tile_request(timestamp, kind, key)
+        path = pyramid_path(timestamp, kind, key)
+        if not os.path.exists(path):
+            if not os.path.isfile(source_image(TEST_RESULTS_BASE_PATH, timestamp, kind, key)):
+                abort(404)
+            # The runner cuts the tiles after a job, those of older runs or pruned since are cut in the background
+            pyramid_worker.request(timestamp, kind, key)
+            return Response('The tiles are being prepared.', status=202, mimetype='text/plain',
+                            headers={'Retry-After': '2', 'Cache-Control': 'no-store'})
+        return send_file_response(Config.TILE_DIR, os.path.relpath(path, Config.TILE_DIR), immutable=True,
+                                  mimetype='application/xml')
+
+
+    @app.route('/tiles/<timestamp>/<kind>/<key>_files/<int:level>/<tile>', methods=['GET'])
+    def serve_tile(timestamp, kind, key, level, tile):
+        validate_tile_request(timestamp, kind, key)
+        if not re.match(r'^\d+_\d+\.png$', tile):
+            abort(404)
+        tiles_dir = os.path.join(pyramid_path(timestamp, kind, key)[:-len('.dzi')] + '_files', str(level))
+        return send_file_response(Config.TILE_DIR, os.path.relpath(os.path.join(tiles_dir, tile), Config.TILE_DIR),
+                                  immutable=True)
 
 
     @app.route('/<timestamp>', methods=['GET'])
@@ -113,72 +310,193 @@ def create_app():
         # Validating of the timestamp
         validate_timestamp_path_component(timestamp)
 
-        test_dir = os.path.join(TEST_RESULTS_BASE_PATH, 'image_comparison', timestamp)
-
-        if not os.path.exists(test_dir):
+        summary = results_index.summary(timestamp)
+        if summary is None:
             return "No test results found.", 404
 
-        results_file = os.path.join(test_dir, 'test_results.txt')
-        try:
-            with open(results_file, 'r') as file:
-                results = file.read()
-        except FileNotFoundError:
-            results = "No test results found."
+        # The test results text is read into the summary of the run when it is indexed
+        results = summary['results_text'] if summary['results_text'] is not None else "No test results found."
 
-        # Find all difference images in the directory
-        diff_image_paths = sorted(glob(os.path.join(test_dir, 'difference', 'diff_*.png')), key=os.path.getmtime, reverse=True)
-        diff_image_paths = [{'path': '/test_results/image_comparison/' + os.path.basename(test_dir.rstrip('/')) + '/difference/' + os.path.basename(image_path), 'name': os.path.basename(image_path)} for image_path in diff_image_paths]
+        # The difference and generated images are looked up in the results index
+        diff_image_paths = indexed_image_paths(timestamp, 'difference')
+        generated_image_paths = indexed_image_paths(timestamp, 'generated')
 
-        # Find all generated images in the directory
-        generated_image_paths = sorted(glob(os.path.join(test_dir, 'generated', 'generated_*.png')), key=os.path.getmtime, reverse=True)
-        generated_image_paths = [{'path': '/test_results/image_comparison/' + os.path.basename(test_dir.rstrip('/')) + '/generated/' + os.path.basename(image_path), 'name': os.path.basename(image_path)} for image_path in generated_image_paths]
+        return render_template('test_results.html', results=results, generated_image_paths=generated_image_paths, diff_image_paths=diff_image_paths, test_dir=timestamp)
 
-        return render_template('test_results.html', results=results, generated_image_paths=generated_image_paths, diff_image_paths=diff_image_paths, test_dir=os.path.basename(test_dir.rstrip('/')))
+
+    def run_history_page():
+        filters = parse_run_filters(request.args, Config.RESULTS_PAGE_SIZE)
+        runs, next_cursor = results_index.page(**filters)
+        return runs, format_cursor(next_cursor) if next_cursor is not None else None
 
 
     @app.route('/more_results', methods=['GET'])
     def more_results():
-        # Find all test results directories
-        test_results_dirs = sorted(glob(os.path.join(TEST_RESULTS_BASE_PATH, 'image_comparison', '*/')), key=os.path.getmtime, reverse=True)
-        test_results_list = [{'timestamp': os.path.basename(test_dir.rstrip('/'))} for test_dir in test_results_dirs]
+        # One page of the test results directories, the most recent first
+        runs, next_cursor = run_history_page()
+        test_results_list = [{'timestamp': run['timestamp'], 'outcome': run['outcome'], 'passed': run['passed'],
+                              'failed': run['failed']} for run in runs]
+        filters = {name: request.args[name] for name in ('since', 'until', 'outcome', 'limit') if request.args.get(name)}
+
+        return render_template('more_results.html', test_results_list=test_results_list, next_cursor=next_cursor,
+                               filters=filters)
+
+
+    @app.route('/more_results.json', methods=['GET'])
+    @app.route('/api/v1/runs', methods=['GET'])
+    def more_results_json():
+        runs, next_cursor = run_history_page()
+        for run in runs:
+            del run['mtime_ns']
+            run['url'] = f"{Config.HOST_URL}/{run['timestamp']}"
+            run['api_url'] = f"{Config.HOST_URL}/api/v1/runs/{run['timestamp']}"
+        return json_response({'runs': runs, 'next_cursor': next_cursor})
+
+
+    def run_summary_or_404(timestamp):
+        validate_timestamp_path_component(timestamp)
+        summary = results_index.summary(timestamp)
+        if summary is None:
+            abort(404)
+        return summary
+
+
+    def run_images(timestamp):
+        # The paths of the images are made absolute, like the urls of the runs
+        return {kind: [{key: f"{Config.HOST_URL}{value}" if key != 'name' else value for key, value in image.items()}
+                       for image in indexed_image_paths(timestamp, kind)]
+                for kind in IMAGE_PATTERNS}
+
+
+    @app.route('/api/v1/runs/<timestamp>', methods=['GET'])
+    def api_run(timestamp):
+        # The results of a run do not change once published
+        summary = run_summary_or_404(timestamp)
+        return json_response(dict(summary, url=f"{Config.HOST_URL}/{timestamp}", images=run_images(timestamp)),
+                             max_age=3600)
+
+
+    @app.route('/api/v1/runs/<timestamp>/scenarios', methods=['GET'])
+    def api_run_scenarios(timestamp):
+        summary = run_summary_or_404(timestamp)
+        return json_response({'timestamp': timestamp, 'outcome': summary['outcome'], 'scenarios': summary['scenarios']},
+                             max_age=3600)
+
+
+    @app.route('/api/v1/runs/<timestamp>/images', methods=['GET'])
+    def api_run_images(timestamp):
+        run_summary_or_404(timestamp)
+        return json_response({'timestamp': timestamp, 'images': run_images(timestamp)}, max_age=3600)
+
+
+    @app.route('/api/v1/runs/<timestamp>/pin', methods=['PUT', 'DELETE'])
+    def api_pin_run(timestamp):
+        try:
+            verify_api_token(request.headers.get('Authorization'), API_TOKEN)
+        except HTTPException as e:
+            logger.error(f"Refused to change the pin of run {timestamp}: {e.description}")
+            return jsonify({'error': str(e)}), e.get_response().status_code
 
-        return render_template('more_results.html', test_results_list=test_results_list)
+        run_summary_or_404(timestamp)
+        # A pinned run is never removed by the retention
+        pinned = request.method == 'PUT'
+        results_index.pin(timestamp, pinned)
+        logger.info(f"Run {timestamp} {'pinned' if pinned else 'unpinned'} through the API.")
+        return json_response({'timestamp': timestamp, 'pinned': pinned}, max_age=0)
+
+
+    def job_json(job):
+        job = {key: job[key] for key in ('id', 'repo_full_name', 'pull_number', 'head_sha', 'status', 'cancel_status',
+                                         'created', 'started', 'finished', 'error', 'result')}
+        if job['status'] == 'queued':
+            job['position'] = job_queue.position(job['id'])
+        return job
+
+
+    @app.route('/api/v1/jobs/<int:job_id>', methods=['GET'])
+    def api_job(job_id):
+        job = job_queue.get(job_id)
+        if job is None:
+            abort(404)
+        return json_response(job_json(job), max_age=0)
+
+
+    @app.route('/api/v1/jobs/<int:job_id>/cancel', methods=['POST'])
+    def api_cancel_job(job_id):
+        try:
+            verify_api_token(request.headers.get('Authorization'), API_TOKEN)
+        except HTTPException as e:
+            logger.error(f"Refused to cancel job {job_id}: {e.description}")
+            return jsonify({'error': str(e)}), e.get_response().status_code
+
+        cancelled = job_queue.cancel(job_id, "Cancelled through the API.")
+        job = job_queue.get(job_id)
+        if job is None:
+            abort(404)
+        if job['status'] == 'running' and job['cancel_status'] == 'cancelled':
+            # The runner of the job stops it within seconds
+            status_code = 202
+        elif job['status'] == 'cancelled':
+            status_code = 200
+        else:
+            # The job finished, or is being stopped for another reason
+            status = job['cancel_status'] if job['status'] == 'running' else job['status']
+            return jsonify({'error': f"Job {job_id} is {status} already."}), 409
+        if cancelled:
+            job_commenter(job, GITHUB_TOKEN, outbox)("The job was cancelled through the API.")
+        response = json_response(job_json(job), max_age=0)
+        response.status_code = status_code
+        return response
 
 
     @app.route('/', methods=['GET'])
     def display_latest_results():
         # Find the latest test results directory
-        test_results_dirs = sorted(glob(os.path.join(TEST_RESULTS_BASE_PATH, 'image_comparison', '*/')), key=os.path.getmtime, reverse=True)
+        latest_timestamp = results_index.latest()
 
-        if not test_results_dirs:
+        if latest_timestamp is None:
             return "No test results found.", 404
 
-        latest_test_dir = test_results_dirs[0]
+        summary = results_index.summary(latest_timestamp)
+        results = summary['results_text'] if summary['results_text'] is not None else "Keine Testergebnisse gefunden."
 
-        results_file = os.path.join(latest_test_dir, 'test_results.txt')
-        try:
-            with open(results_file, 'r') as file:
-                results = file.read()
-        except FileNotFoundError:
-            results = "Keine Testergebnisse gefunden."
+        # The difference images are looked up in the results index
+        image_paths = indexed_image_paths(latest_timestamp, 'difference')
+
+        return render_template('latest_results.html', results=results, image_paths=image_paths,
+                                      test_dir=latest_timestamp)
 
-        # Find all difference images in the directory
-        image_paths = sorted(glob(os.path.join(latest_test_dir, 'difference', 'diff_*.png')), key=os.path.getmtime,
-                             reverse=True)
-        image_paths = [{'path': '/test_results/image_comparison/' + os.path.basename(
-            latest_test_dir.rstrip('/')) + '/difference/' + os.path.basename(image_path),
-                        'name': os.path.basename(image_path)} for image_path in image_paths]
 
+    @app.route('/jobs/<int:job_id>', methods=['GET'])
+    def display_job_log(job_id):
+        job = job_queue.get(job_id)
+        if job is None:
+            return "Job not found.", 404
+        return render_template('job_log.html', job=job)
 
-        return render_template('latest_results.html', results=results, image_paths=image_paths,
-                                      test_dir=os.path.basename(latest_test_dir.rstrip('/')))
+
+    @app.route('/jobs/<int:job_id>/events', methods=['GET'])
+    def stream_job_log(job_id):
+        if job_queue.get(job_id) is None:
+            return "Job not found.", 404
+
+        # A reconnecting browser sends the offset of the last line it received
+        offset = request.headers.get('Last-Event-ID', request.args.get('offset'))
+        offset = int(offset) if offset is not None and offset.isdigit() else None
+
+        events = stream_job_events(job_queue, job_id, os.path.join(job_dir(job_id), 'output.log'), offset,
+                                   redact=GITHUB_TOKEN, max_duration=Config.LOG_STREAM_MAX_DURATION)
+        # Keep nginx from buffering the stream
+        return Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
     @app.route('/test_results/', defaults={'path': ''})
     @app.route('/test_results/<path:path>')
     def serve_test_results(path):
-        # Validating of the path
-        validate_safe_path(path)
+        # Validating of the path, the empty path lists the results directory itself
+        if path:
+            validate_safe_path(path)
 
         base_dir = TEST_RESULTS_BASE_PATH
         full_path = os.path.normpath(os.path.join(base_dir, path))
@@ -188,14 +506,23 @@ def create_app():
             abort(403)
 
         if os.path.isdir(full_path):
-            # If it's a directory, list its contents
-            items = os.listdir(full_path)
-            items = [item + '/' if os.path.isdir(os.path.join(full_path, item)) else item for item in items]
-            return render_template('test_results_images.html', path=path, items=items)
+            # If it's a directory, list a page of its contents
+            sort = request.args.get('sort', 'name')
+            if sort not in SORT_KEYS:
+                abort(400)
+            reverse = request.args.get('order') == 'desc'
+            page = request.args.get('page', '1')
+            page = int(page) if page.isdigit() and int(page) > 0 else 1
+            entries, pages = directory_listings.page(full_path, sort, reverse, page, Config.DIRECTORY_PAGE_SIZE)
+            path = path.rstrip('/') + '/' if path else ''
+            return render_template('test_results_images.html', path=path, entries=entries, sort=sort,
+                                   order='desc' if reverse else 'asc', page=page, pages=pages)
 
         elif os.path.isfile(full_path):
-            # If it's a file, serve it
-            return send_from_directory(base_dir, path)
+            # If it's a file, serve it. The results of a run do not change after they are published
+            parts = path.split('/')
+            immutable = len(parts) > 2 and parts[0] == 'image_comparison' and re.match(r'^\d{4}(-\d{2}){5}$', parts[1]) is not None
+            return send_file_response(base_dir, path, immutable=immutable)
         else:
             abort(404)
 
@@ -219,6 +546,8 @@ if __name__ == '__main__':
             def load_config(self):
                 self.cfg.set('bind', '0.0.0.0:8080')
                 self.cfg.set('workers', 4)
+                # Threads keep the log streams from blocking the webhook
+                self.cfg.set('threads', 8)
 
             def load(self):
                 return self.application
@@ -17,7 +17,7 @@ if [ "$IS_DEBUG" == "True" ]; then
 else
     echo "Starting Flask server with Gunicorn in production mode..."
     bash -c "source $BASE_PATH/venv/bin/activate && \
-                     gunicorn -w 4 -b 0.0.0.0:8080 \
+                     gunicorn -w 4 --threads 8 -b 0.0.0.0:8080 \
                      'server:create_app()' \
                      --access-logfile /var/log/gunicorn/access.log \
                      --error-logfile /var/log/gunicorn/error.log"
@@ -0,0 +1,63 @@
+import os
+import logging
+import tempfile
+from PIL import features
+from config import Config
+from image_utils import Image
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+THUMBNAIL_DIR = Config.THUMBNAIL_DIR
+THUMBNAIL_SIZE = Config.THUMBNAIL_SIZE
+
+
+def thumbnail_format():
+    """Return the format of the thumbnails, WebP if Pillow supports it and PNG otherwise."""
+    if Config.THUMBNAIL_FORMAT == 'webp' and features.check('webp'):
+        return 'webp'
+    return 'png'
+
+def thumbnail_path(timestamp, kind, name, thumbnail_dir=THUMBNAIL_DIR, size=THUMBNAIL_SIZE):
+    """Return the path of the thumbnail of an image of a run."""
+    stem = os.path.splitext(name)[0]
+    return os.path.join(thumbnail_dir, timestamp, kind, f"{stem}.{size}.{thumbnail_format()}")
+
+def make_thumbnail(source, target, size=THUMBNAIL_SIZE):
+    """Write a thumbnail of an image, scaled down to fit into `size` x `size` pixels.
+
+    The thumbnail is written to a temporary file first, so concurrent
+    requests never serve a partially written thumbnail.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as image:
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                if thumbnail_format() == 'webp':
+                    image.save(file, 'WEBP', quality=80, method=4)
+                else:
+                    image.save(file, 'PNG', optimize=True)
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+def ensure_thumbnail(results_dir, timestamp, kind, name, thumbnail_dir=THUMBNAIL_DIR, size=THUMBNAIL_SIZE):
+    """Return the path of the thumbnail of an image of a run, creating it if it does not exist yet."""
+    target = thumbnail_path(timestamp, kind, name, thumbnail_dir, size)
+    if not os.path.exists(target):
+        make_thumbnail(os.path.join(results_dir, 'image_comparison', timestamp, kind, name), target, size)
+    return target
+
+def generate_run_thumbnails(results_dir, timestamp, images, thumbnail_dir=THUMBNAIL_DIR, size=THUMBNAIL_SIZE):
+    """Create the thumbnails of the images of a run, given as (kind, name) pairs."""
+    for kind, name in images:
+        try:
+            ensure_thumbnail(results_dir, timestamp, kind, name, thumbnail_dir, size)
+        except Exception as e:
+            logger.error(f"Error while creating the thumbnail of {timestamp}/{kind}/{name}: {e}")
@@ -0,0 +1,186 @@
+import os
+import math
+import shutil
+import fcntl
+import logging
+import tempfile
+import threading
+import queue
+from contextlib import contextmanager
+from config import Config
+from image_utils import Image
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+TILE_DIR = Config.TILE_DIR
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+# Lossless tiles, so differences can be inspected pixel by pixel
+TILE_FORMAT = 'png'
+
+# The file names of the images of a comparison, by kind, for the key of the comparison
+IMAGE_NAMES = {
+    'generated': 'generated_{key}.png',
+    'difference': 'diff_{key}.png',
+    'reference': Config.REFERENCE_IMAGE_NAME,
+}
+
+DZI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile_size}" Overlap="{overlap}" Format="{format}">
+    <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def source_image(results_dir, timestamp, kind, key, reference_dir=Config.REFERENCE_DIR):
+    """Return the path of an image of a comparison.
+
+    The images are part of the results of the run, including the reference
+    images it was compared against. Runs published before the reference
+    images were kept with the results fall back to the current ones in the
+    reference directory.
+    """
+    name = IMAGE_NAMES[kind].format(key=key)
+    run_dir = os.path.join(results_dir, 'image_comparison', timestamp)
+    if kind == 'reference' and not os.path.isdir(os.path.join(run_dir, 'reference')):
+        return os.path.join(reference_dir, name)
+    return os.path.join(run_dir, kind, name)
+
+def pyramid_path(timestamp, kind, key, tile_dir=TILE_DIR):
+    """Return the path of the Deep Zoom descriptor of an image, its tiles are in the `<key>_files` directory next to it."""
+    return os.path.join(tile_dir, timestamp, kind, f"{key}.dzi")
+
+def pyramid_levels(width, height):
+    """Return the number of levels of the pyramid of an image, down to a single pixel."""
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+def tile_boxes(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Yield the column, row and box of each tile of a level, the way Deep Zoom viewers expect them."""
+    for column in range(int(math.ceil(width / tile_size))):
+        for row in range(int(math.ceil(height / tile_size))):
+            left = column * tile_size - (overlap if column > 0 else 0)
+            top = row * tile_size - (overlap if row > 0 else 0)
+            right = min((column + 1) * tile_size + overlap, width)
+            bottom = min((row + 1) * tile_size + overlap, height)
+            yield column, row, (left, top, right, bottom)
+
+def write_pyramid(source, target, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Cut an image into a Deep Zoom tile pyramid.
+
+    The highest level is the image at full resolution, every level below
+    halves the resolution. The tiles are written into a temporary directory
+    first and the descriptor is written last, so a pyramid with a descriptor
+    is always complete.
+    """
+    directory = os.path.dirname(target)
+    files_dir = target[:-len('.dzi')] + '_files'
+    os.makedirs(directory, exist_ok=True)
+    temporary_dir = tempfile.mkdtemp(dir=directory, suffix='.tmp')
+    try:
+        with Image.open(source) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+            width, height = image.size
+            level_image = image
+            for level in reversed(range(pyramid_levels(width, height))):
+                level_dir = os.path.join(temporary_dir, str(level))
+                os.makedirs(level_dir)
+                for column, row, box in tile_boxes(*level_image.size, tile_size, overlap):
+                    level_image.crop(box).save(os.path.join(level_dir, f"{column}_{row}.{TILE_FORMAT}"))
+                level_width, level_height = level_image.size
+                level_image = level_image.resize((max(1, (level_width + 1) // 2), max(1, (level_height + 1) // 2)),
+                                                 Image.Resampling.LANCZOS)
+        shutil.rmtree(files_dir, ignore_errors=True)
+        os.rename(temporary_dir, files_dir)
+    except BaseException:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+        raise
+    with open(target + '.tmp', 'w') as descriptor:
+        descriptor.write(DZI_TEMPLATE.format(tile_size=tile_size, overlap=overlap, format=TILE_FORMAT,
+                                             width=width, height=height))
+    os.replace(target + '.tmp', target)
+
+@contextmanager
+def pyramid_lock(target):
+    """Hold an exclusive lock on a pyramid, shared by all server processes."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(f"{target}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ensure_pyramid(results_dir, timestamp, kind, key, tile_dir=TILE_DIR, reference_dir=Config.REFERENCE_DIR):
+    """Return the path of the Deep Zoom descriptor of an image, cutting its tiles first if needed.
+
+    Raises FileNotFoundError if the image does not exist.
+    """
+    target = pyramid_path(timestamp, kind, key, tile_dir)
+    if os.path.exists(target):
+        return target
+    source = source_image(results_dir, timestamp, kind, key, reference_dir)
+    if not os.path.isfile(source):
+        raise FileNotFoundError(source)
+    # Requests for the same image in other processes wait for the first one to cut the tiles
+    with pyramid_lock(target):
+        if not os.path.exists(target):
+            logger.info(f"Cutting the tile pyramid of {source}.")
+            write_pyramid(source, target)
+    return target
+
+def generate_run_pyramids(results_dir, timestamp, keys, tile_dir=TILE_DIR, reference_dir=Config.REFERENCE_DIR):
+    """Cut the pyramids of all images of the comparisons of a run, given by their keys."""
+    for key in keys:
+        for kind in IMAGE_NAMES:
+            try:
+                ensure_pyramid(results_dir, timestamp, kind, key, tile_dir, reference_dir)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Error while cutting the tile pyramid of {timestamp}/{kind}/{key}: {e}")
+
+
+class PyramidWorker:
+    """Cuts the pyramids requested by the viewer in a background thread, one at a time.
+
+    The runner cuts the pyramids of a run after publishing it, the worker
+    only cuts those of older runs and those pruned since, so a request never
+    waits for the tiles of an image.
+    """
+
+    def __init__(self, results_dir, tile_dir=TILE_DIR, reference_dir=Config.REFERENCE_DIR):
+        self.results_dir = results_dir
+        self.tile_dir = tile_dir
+        self.reference_dir = reference_dir
+        self._queue = queue.Queue()
+        # The pyramids requested and not cut yet, so a pyramid is only queued once
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def request(self, timestamp, kind, key):
+        """Queue a pyramid to be cut, unless it is queued already."""
+        with self._lock:
+            if (timestamp, kind, key) in self._pending:
+                return
+            self._pending.add((timestamp, kind, key))
+        self._queue.put((timestamp, kind, key))
+
+    def start(self):
+        """Start the thread cutting the requested pyramids."""
+        thread = threading.Thread(target=self._work, name="tile-pyramids", daemon=True)
+        thread.start()
+
+    def _work(self):
+        while True:
+            timestamp, kind, key = self._queue.get()
+            try:
+                ensure_pyramid(self.results_dir, timestamp, kind, key, self.tile_dir, self.reference_dir)
+            except Exception as e:
+                logger.error(f"Error while cutting the tile pyramid of {timestamp}/{kind}/{key}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard((timestamp, kind, key))
@@ -0,0 +1,164 @@
+import os
+import socket
+import logging
+import threading
+import time
+from contextlib import closing
+from job_queue import connect, transaction
+
+
+# configure the logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guid TEXT,
+    event TEXT,
+    payload BLOB,
+    status TEXT NOT NULL DEFAULT 'pending',
+    received REAL NOT NULL,
+    claimed REAL,
+    owner TEXT,
+    processed REAL,
+    error TEXT,
+    job_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS webhook_deliveries_status ON webhook_deliveries (status, id);
+CREATE UNIQUE INDEX IF NOT EXISTS webhook_deliveries_guid ON webhook_deliveries (guid) WHERE guid IS NOT NULL
+"""
+
+# A delivery is 'pending' until a dispatcher claims it, then 'processing' until it is 'done' or 'failed'
+FINAL_STATUSES = ('done', 'failed')
+# A delivery whose dispatcher has not finished it after this many seconds is processed again
+PROCESSING_TIMEOUT = 600
+# Processed deliveries are kept this many seconds for inspection
+DELIVERY_RETENTION = 7 * 24 * 3600
+
+
+class WebhookDeliveries:
+    """The webhook deliveries received from GitHub, stored in the job database until they are processed.
+
+    The webhook endpoint only verifies the signature of a delivery and stores
+    its raw body, the dispatcher parses and processes it afterwards.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with transaction(db_path) as connection:
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+
+    def record(self, guid, event, payload):
+        """Store a delivery, with the GUID GitHub gave it, and return its id and whether it is processed.
+
+        GitHub gives a redelivery the GUID of the original delivery. A
+        redelivery of a delivery that failed is processed again, under the id
+        of the first one. A redelivery of a delivery that is pending,
+        processing or done is dropped.
+        """
+        with transaction(self.db_path) as connection:
+            if guid is not None:
+                row = connection.execute('SELECT id, status FROM webhook_deliveries WHERE guid = ?', (guid,)).fetchone()
+                if row is not None and row['status'] == 'failed':
+                    connection.execute(
+                        "UPDATE webhook_deliveries SET event = ?, payload = ?, status = 'pending', received = ?, "
+                        "claimed = NULL, owner = NULL, processed = NULL, error = NULL, job_id = NULL WHERE id = ?",
+                        (event, payload, time.time(), row['id']))
+                    return row['id'], True
+                if row is not None:
+                    return row['id'], False
+            cursor = connection.execute(
+                'INSERT INTO webhook_deliveries (guid, event, payload, received) VALUES (?, ?, ?, ?)',
+                (guid, event, payload, time.time()))
+            return cursor.lastrowid, True
+
+    def claim(self, owner):
+        """Mark the oldest pending delivery as processing and return it, or None if there is none.
+
+        Deliveries left processing by a dispatcher that died are pending again
+        after PROCESSING_TIMEOUT seconds.
+        """
+        now = time.time()
+        with transaction(self.db_path) as connection:
+            connection.execute(
+                "UPDATE webhook_deliveries SET status = 'pending', owner = NULL "
+                "WHERE status = 'processing' AND claimed < ?", (now - PROCESSING_TIMEOUT,))
+            row = connection.execute(
+                "SELECT * FROM webhook_deliveries WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE webhook_deliveries SET status = 'processing', claimed = ?, owner = ? WHERE id = ?",
+                               (now, owner, row['id']))
+            return dict(row, status='processing', claimed=now, owner=owner)
+
+    def finish(self, delivery_id, status, error=None, job_id=None):
+        """Mark a delivery as processed, with the job it queued if any, and forget old processed deliveries."""
+        if status not in FINAL_STATUSES:
+            raise ValueError(f"Invalid final delivery status: {status}")
+        now = time.time()
+        with transaction(self.db_path) as connection:
+            # The payload is not needed anymore, only the outcome is kept
+            connection.execute(
+                'UPDATE webhook_deliveries SET status = ?, processed = ?, error = ?, job_id = ?, payload = NULL '
+                'WHERE id = ?', (status, now, error, job_id, delivery_id))
+            connection.execute(
+                "DELETE FROM webhook_deliveries WHERE status IN ('done', 'failed') AND processed < ?",
+                (now - DELIVERY_RETENTION,))
+
+    def get(self, delivery_id):
+        """Return a delivery without its payload as a dict, or None if it does not exist."""
+        with closing(connect(self.db_path)) as connection:
+            row = connection.execute(
+                'SELECT id, guid, event, status, received, processed, error, job_id '
+                'FROM webhook_deliveries WHERE id = ?', (delivery_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+
+class WebhookDispatcher:
+    """Thread processing the stored webhook deliveries off the request path.
+
+    Every server process starts its own dispatcher, each delivery is claimed
+    by exactly one of them. `process` is called with a delivery and returns
+    the id of the job it queued, or None.
+    """
+
+    def __init__(self, deliveries, process, poll_interval=5):
+        self.deliveries = deliveries
+        self.process = process
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+        self._wakeup = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._work, name="webhook-dispatcher", daemon=True)
+        thread.start()
+
+    def notify(self):
+        """Wake up the dispatcher, e.g. after a delivery was stored."""
+        self._wakeup.set()
+
+    def _work(self):
+        while True:
+            try:
+                delivery = self.deliveries.claim(self.owner)
+            except Exception as e:
+                logger.error(f"Error while claiming a webhook delivery: {e}")
+                delivery = None
+            if delivery is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                status, error, job_id = 'done', None, self.process(delivery)
+            except Exception as e:
+                status, error, job_id = 'failed', str(e), None
+                logger.error(f"Error while processing webhook delivery {delivery['guid']}: {e}")
+            try:
+                self.deliveries.finish(delivery['id'], status, error, job_id)
+            except Exception as e:
+                logger.error(f"Error while finishing webhook delivery {delivery['guid']}: {e}")
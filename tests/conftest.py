@@ -0,0 +1,26 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Make the flat imports of the server modules work in the tests.
+
+The server modules import each other as top-level modules, since the server is
+started from within the serverLogic directory.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serverLogic'))
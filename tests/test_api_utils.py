@@ -580,15 +580,16 @@ def fake_data():
   'user_view_type': 'public',
   'site_admin': False}}
 
-@patch("requests.post")
+@patch("requests.Session.request")
 def test_post_comment(rp):
     """Test posting comments."""
     from serverLogic.api_utils import post_github_comment
+    rp.return_value.headers = {}
     post_github_comment("dummy_repo", 0, "dummy comment", "dummy_token")
     rp.assert_called_with(
+        "POST",
         "https://api.github.com/repos/dummy_repo/issues/0/comments",
-        headers={"Authorization": "token dummy_token",
-                 "Accept": "application/vnd.github.v3+json"},
+        timeout=10,
         json = {"body": "dummy comment"})
 
 def test_extract_pr_info(fake_data):
@@ -599,11 +600,17 @@ def test_extract_pr_info(fake_data):
             "feature-multifile-handler",
             2697)
 
-@patch("requests.get")
+@patch("requests.Session.request")
 def test_validate_user(rp, fake_data):
     from serverLogic.api_utils import validate_user
-    validate_user(fake_data, "dummy_token")
+    rp.return_value.status_code = 204
+    rp.return_value.headers = {"ETag": '"abc"'}
+    assert validate_user(fake_data, "dummy_token")
     rp.assert_called_with(
+        "GET",
         "https://api.github.com/orgs/pytroll/members/gerritholl",
-        headers={"Authorization": "token dummy_token",
-                 "Accept": "application/vnd.github.v3+json"})
+        timeout=10,
+        headers={})
+    # The membership is cached, a burst of reviews only asks once
+    assert validate_user(fake_data, "dummy_token")
+    assert rp.call_count == 1
@@ -0,0 +1,43 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import tarfile
+import zipfile
+
+from archives import run_archive_members, stream_archive
+
+
+def test_stream_run_archives(tmp_path):
+    """Test that the zip and tar archives of a run contain its files and the redacted job log."""
+    run = tmp_path / "2024-11-05-10-00-00"
+    (run / "generated").mkdir(parents=True)
+    (run / "generated" / "generated_airmass.png").write_bytes(b"png" * 1000)
+    (run / "test_results.txt").write_text("1 feature passed\n")
+    (tmp_path / "output.log").write_text("git clone https://secret@github.com/pytroll/satpy\n")
+    members = run_archive_members(str(run), "2024-11-05-10-00-00", str(tmp_path / "output.log"), redact="secret")
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(stream_archive(members, "zip")))) as archive:
+        assert archive.getinfo("2024-11-05-10-00-00/generated/generated_airmass.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("2024-11-05-10-00-00/test_results.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read("2024-11-05-10-00-00/generated/generated_airmass.png") == b"png" * 1000
+        assert archive.read("2024-11-05-10-00-00/output.log") == b"git clone https://[REDACTED]@github.com/pytroll/satpy\n"
+
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream_archive(members, "tar")))) as archive:
+        assert archive.getnames() == ["2024-11-05-10-00-00/test_results.txt",
+                                      "2024-11-05-10-00-00/generated/generated_airmass.png",
+                                      "2024-11-05-10-00-00/output.log"]
+        assert archive.extractfile("2024-11-05-10-00-00/test_results.txt").read() == b"1 feature passed\n"
@@ -0,0 +1,42 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from blob_store import BlobStore
+
+
+def test_identical_images_share_a_blob(tmp_path):
+    """Test that identical images of two runs are stored once and that unused blobs are collected."""
+    store = BlobStore(str(tmp_path / "blobs"))
+    runs = tmp_path / "image_comparison"
+    for timestamp, content in (("2024-11-05-10-00-00", b"airmass"), ("2024-11-06-10-00-00", b"airmass")):
+        (runs / timestamp / "generated").mkdir(parents=True)
+        (runs / timestamp / "generated" / "generated_airmass.png").write_bytes(content)
+    (runs / "2024-11-06-10-00-00" / "generated" / "generated_ash.png").write_bytes(b"ash")
+
+    assert store.ingest_run(str(runs / "2024-11-05-10-00-00")) == 0
+    assert store.ingest_run(str(runs / "2024-11-06-10-00-00")) == len(b"airmass")
+
+    first = runs / "2024-11-05-10-00-00" / "generated" / "generated_airmass.png"
+    second = runs / "2024-11-06-10-00-00" / "generated" / "generated_airmass.png"
+    assert os.path.samefile(first, second)
+    assert second.read_bytes() == b"airmass"
+    assert first.stat().st_nlink == 3
+
+    os.remove(runs / "2024-11-06-10-00-00" / "generated" / "generated_ash.png")
+    assert store.collect_garbage() == len(b"ash")
+    assert len(list((tmp_path / "blobs").glob("*/*"))) == 1
@@ -0,0 +1,62 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+from cache_utils import prune_cache
+
+
+def _make_entry(path, size, age, now):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (now - age, now - age))
+
+
+def test_prune_cache_by_age_and_size(tmp_path):
+    """Test that old entries go first and the least recently used ones until the cache fits."""
+    now = time.time()
+    _make_entry(tmp_path / "ancient.conda", 10, 40 * 86400, now)
+    _make_entry(tmp_path / "old.conda", 100, 5 * 86400, now)
+    _make_entry(tmp_path / "newer.conda", 100, 2 * 86400, now)
+    _make_entry(tmp_path / "fresh.conda", 100, 60, now)
+
+    freed = prune_cache(tmp_path, max_bytes=150, max_age_days=30, now=now)
+
+    assert freed == 210
+    assert sorted(os.listdir(tmp_path)) == ["fresh.conda"]
+
+
+def test_prune_cache_units(tmp_path):
+    """Test that extracted packages are removed as a whole and pip cache files one by one."""
+    now = time.time()
+    pkgs = tmp_path / "conda-pkgs"
+    _make_entry(pkgs / "satpy-0.1-py_0" / "info" / "index.json", 10, 40 * 86400, now)
+    _make_entry(pkgs / "satpy-0.1-py_0" / "site-packages" / "satpy.py", 10, 60, now)
+    _make_entry(pkgs / "pyspectral-0.1-py_0" / "info" / "index.json", 10, 40 * 86400, now)
+    pip = tmp_path / "pip"
+    _make_entry(pip / "http" / "a" / "old", 10, 40 * 86400, now)
+    _make_entry(pip / "http" / "b" / "new", 10, 60, now)
+
+    for package in ("satpy-0.1-py_0", "pyspectral-0.1-py_0"):
+        os.utime(pkgs / package, (now - 40 * 86400, now - 40 * 86400))
+
+    prune_cache(pkgs, max_bytes=1000, max_age_days=30, now=now)
+    prune_cache(pip, max_bytes=1000, max_age_days=30, per_file=True, now=now)
+
+    assert os.listdir(pkgs) == ["satpy-0.1-py_0"]
+    assert os.path.exists(pkgs / "satpy-0.1-py_0" / "info" / "index.json")
+    assert os.listdir(pip / "http") == ["b"]
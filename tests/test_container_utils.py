@@ -0,0 +1,190 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from pytest import raises
+
+import container_utils
+from blob_store import BlobStore
+from container_utils import (JobCancelled, SHARD_SCRIPT, behave_command, failed_shards, merge_result_dirs,
+                             publish_results, run_container, split_into_shards)
+
+
+def test_publish_results(tmp_path):
+    """Test that the results of a job are moved to the served results without clobbering others."""
+    job_results = tmp_path / "job" / "test_results"
+    (job_results / "image_comparison" / "2024-11-05-10-00-00" / "generated").mkdir(parents=True)
+    (job_results / "image_comparison" / "2024-11-05-10-00-00" / "test_results.txt").write_text("job")
+    served = tmp_path / "test_results"
+    (served / "image_comparison" / "2024-11-05-10-00-00").mkdir(parents=True)
+
+    assert publish_results(str(job_results), str(served)) == ["2024-11-05-10-00-01"]
+    assert (served / "image_comparison" / "2024-11-05-10-00-01" / "test_results.txt").read_text() == "job"
+    assert os.listdir(served / "image_comparison" / "2024-11-05-10-00-00") == []
+    assert os.listdir(job_results / "image_comparison") == []
+
+
+def test_publish_results_stores_images_as_blobs_first(tmp_path):
+    """Test that the images are hardlinked to their blobs before they are published, so served files never change."""
+    store = BlobStore(str(tmp_path / "blobs"))
+    reference = tmp_path / "reference"
+    reference.mkdir()
+    for job, timestamp, reference_data in (("job1", "2024-11-05-10-00-00", b"old"), ("job2", "2024-11-06-10-00-00", b"new")):
+        (reference / "reference_image_airmass.png").write_bytes(reference_data)
+        generated = tmp_path / job / "image_comparison" / timestamp / "generated"
+        generated.mkdir(parents=True)
+        (generated / "generated_airmass.png").write_bytes(b"airmass")
+        publish_results(str(tmp_path / job), str(tmp_path / "served"), blob_store=store, reference_dir=str(reference))
+
+    first, second = (tmp_path / "served" / "image_comparison" / timestamp / "generated" / "generated_airmass.png"
+                     for timestamp in ("2024-11-05-10-00-00", "2024-11-06-10-00-00"))
+    assert os.path.samefile(first, second)
+    assert first.stat().st_nlink == 3
+    # Every run keeps the reference image it was compared against
+    assert (tmp_path / "served" / "image_comparison" / "2024-11-05-10-00-00" / "reference" /
+            "reference_image_airmass.png").read_bytes() == b"old"
+
+
+def test_split_into_shards():
+    locations = ["a.feature:3", "a.feature:4", "a.feature:5", "b.feature:9"]
+    assert split_into_shards(locations, 3) == [["a.feature:3", "b.feature:9"], ["a.feature:4"], ["a.feature:5"]]
+    assert split_into_shards(locations[:1], 4) == [["a.feature:3"]]
+
+
+FAKE_BEHAVE = """#!{python}
+import os, runpy, sys
+from datetime import datetime
+if "crash.feature" in sys.argv:
+    sys.exit(2)
+# Like the behave steps, write the results below the data path of the steps, named after the second
+ext_data_path = runpy.run_path(os.path.join("steps", "image_comparison.py"))["ext_data_path"]
+os.makedirs(os.path.join(ext_data_path, "test_results", "image_comparison", datetime.now().strftime("%Y-%m-%d-%H-%M-%S")))
+print("Scenario: " + " ".join(sys.argv[1:]))
+sys.exit(1 if "fail.feature" in sys.argv else 0)
+"""
+
+
+def test_shards_write_into_their_own_results_dirs(tmp_path, monkeypatch):
+    """Test that every shard gets its own results directory and that a crashed shard fails the run."""
+    spec = importlib.util.spec_from_file_location("run_shards", SHARD_SCRIPT)
+    run_shards = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(run_shards)
+    data_dir = tmp_path / "ext_data"
+    (data_dir / "reference_images").mkdir(parents=True)
+    (data_dir / "test_results").mkdir()
+    behave_dir = tmp_path / "behave"
+    (behave_dir / "steps").mkdir(parents=True)
+    (behave_dir / "steps" / "image_comparison.py").write_text(f"ext_data_path = {str(data_dir)!r}\n")
+    behave = tmp_path / "fake-behave"
+    behave.write_text(FAKE_BEHAVE.format(python=sys.executable))
+    behave.chmod(0o755)
+    work_dir = tmp_path / "shards"
+
+    statuses = run_shards.run_shards([["a.feature:3"], ["fail.feature"], ["crash.feature"]], str(behave_dir),
+                                     str(data_dir), str(work_dir), str(tmp_path / "output.log"), behave=str(behave))
+
+    assert [status["returncode"] for status in statuses] == [0, 1, 2]
+    assert [status["results_dir"] is None for status in statuses] == [False, False, True]
+    assert statuses[0]["results_dir"] != statuses[1]["results_dir"]
+    assert os.listdir(data_dir / "test_results") == []
+    assert os.path.islink(work_dir / "0" / "ext_data" / "reference_images")
+    assert "[shard 1] Scenario: fail.feature\n" in (tmp_path / "output.log").read_text()
+    assert failed_shards(statuses) == [2]
+    monkeypatch.setattr(run_shards, "run_shards", lambda *args: statuses)
+    assert run_shards.main(["--shard", "a.feature:3", "--data-dir", str(data_dir), "--work-dir", str(work_dir),
+                            "--log", str(tmp_path / "output.log"), "--status", str(tmp_path / "shards.json")]) == 1
+    assert json.loads((tmp_path / "shards.json").read_text()) == statuses
+
+
+def test_behave_command():
+    assert behave_command(["a.feature:3"]) == "behave a.feature:3"
+    assert behave_command(["a.feature:3", "a.feature:4", "b.feature:9"], 2, "/app/output.log", None,
+                          "/app/ext_data", "/app/shards", "/app/shards.json") == (
+        "python /opt/run_shards.py --data-dir /app/ext_data --work-dir /app/shards --log /app/output.log "
+        "--status /app/shards.json --shard a.feature:3,b.feature:9 --shard a.feature:4")
+
+
+def test_merge_result_dirs(tmp_path):
+    """Test that the results of the shards end up in a single directory of the job results."""
+    shard_dirs = []
+    for shard, name in enumerate(("airmass", "ash")):
+        results_dir = tmp_path / "shards" / str(shard) / "2024-11-05-10-00-00"
+        (results_dir / "generated").mkdir(parents=True)
+        (results_dir / "generated" / f"generated_{name}.png").write_bytes(b"png")
+        (results_dir / "test_results.txt").write_text(f"{name} passed\n")
+        shard_dirs.append(str(results_dir))
+
+    merge_result_dirs(str(tmp_path / "test_results"), shard_dirs)
+
+    merged = tmp_path / "test_results" / "image_comparison" / "2024-11-05-10-00-00"
+    assert os.listdir(tmp_path / "test_results" / "image_comparison") == ["2024-11-05-10-00-00"]
+    assert sorted(os.listdir(merged / "generated")) == ["generated_airmass.png", "generated_ash.png"]
+    assert (merged / "test_results.txt").read_text() == "airmass passed\nash passed\n"
+
+
+def test_run_container_is_interrupted_when_cancelled(monkeypatch):
+    """Test that waiting for a container ends within seconds of the job being cancelled."""
+    started = []
+
+    class RecordingPopen(subprocess.Popen):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            started.append(self)
+
+    stopped = []
+    def stop_container(name):
+        stopped.append(name)
+        started[0].terminate()
+
+    monkeypatch.setattr(container_utils.subprocess, 'Popen', RecordingPopen)
+    monkeypatch.setattr(container_utils, 'stop_container', stop_container)
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    start = time.monotonic()
+    with raises(JobCancelled):
+        run_container(['sleep', '30'], 'pytroll-image-test-1', cancel, poll_interval=0.1)
+    assert time.monotonic() - start < 5
+    assert stopped == ['pytroll-image-test-1']
+
+    with raises(subprocess.CalledProcessError):
+        run_container(['false'], 'pytroll-image-test-2', threading.Event(), poll_interval=0.1)
+
+
+def test_no_container_logs_before_the_container_exists(tmp_path, monkeypatch):
+    """Test that a failure before the job container was created only reports that failure."""
+    docker_calls = []
+    def fail_image_build(cancel):
+        raise subprocess.CalledProcessError(1, ['docker', 'build'])
+
+    monkeypatch.setattr(container_utils, 'remove_existing_container', lambda name: None)
+    monkeypatch.setattr(container_utils, 'ensure_runner_image', fail_image_build)
+    monkeypatch.setattr(container_utils, 'prune_package_caches', lambda: None)
+    monkeypatch.setattr(container_utils.subprocess, 'check_output', lambda args, **kwargs: docker_calls.append(args))
+    monkeypatch.setattr(container_utils.subprocess, 'check_call', lambda args, **kwargs: docker_calls.append(args))
+    comments = []
+    with raises(Exception, match="docker"):
+        container_utils.clone_and_test_pull_request("pytroll/satpy", 1, "", "pr-1", str(tmp_path / "job"),
+                                                    str(tmp_path / "ext_data"), "user", "token",
+                                                    post_comment=comments.append)
+    assert docker_calls == []
+    assert comments == ["An error occurred during the process."]
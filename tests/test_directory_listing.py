@@ -0,0 +1,41 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from directory_listing import DirectoryListings
+
+
+def test_directory_listing_is_cached_until_modified(tmp_path):
+    """Test that listings are sorted, paged and only made again after the directory changed."""
+    (tmp_path / "generated").mkdir()
+    (tmp_path / "b.png").write_bytes(b"12345")
+    (tmp_path / "a.png").write_bytes(b"1")
+    os.utime(tmp_path, (1000, 1000))
+    listings = DirectoryListings()
+
+    entries, pages = listings.page(str(tmp_path), per_page=2)
+    assert [(entry["name"], entry["is_dir"]) for entry in entries] == [("generated", True), ("a.png", False)]
+    assert pages == 2
+    entries, pages = listings.page(str(tmp_path), sort="size", reverse=True, page=2, per_page=2)
+    assert [entry["name"] for entry in entries] == ["a.png"]
+
+    # The cached listing is used as long as the modification time of the directory is the same
+    (tmp_path / "c.png").write_bytes(b"")
+    os.utime(tmp_path, (1000, 1000))
+    assert len(listings.list(str(tmp_path))) == 3
+    os.utime(tmp_path, (2000, 2000))
+    assert len(listings.list(str(tmp_path))) == 4
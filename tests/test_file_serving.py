@@ -0,0 +1,44 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from flask import Flask
+
+import file_serving
+from config import Config
+
+
+def test_send_file_response(tmp_path, monkeypatch):
+    """Test that immutable files are cached for long and that nginx is asked to send them in X-Accel-Redirect mode."""
+    (tmp_path / "image_comparison").mkdir()
+    (tmp_path / "image_comparison" / "diff airmass.png").write_bytes(b"png")
+    monkeypatch.setitem(file_serving.INTERNAL_LOCATIONS, str(tmp_path), "/internal/test_results/")
+    app = Flask(__name__)
+
+    with app.test_request_context():
+        monkeypatch.setattr(Config, "USE_X_ACCEL_REDIRECT", False)
+        response = file_serving.send_file_response(str(tmp_path), "image_comparison/diff airmass.png", immutable=True)
+        response.direct_passthrough = False
+        assert response.get_data() == b"png"
+        assert response.get_etag()[0]
+        assert response.cache_control.max_age == 365 * 24 * 3600
+        assert response.cache_control.immutable
+
+        monkeypatch.setattr(Config, "USE_X_ACCEL_REDIRECT", True)
+        response = file_serving.send_file_response(str(tmp_path), "image_comparison/diff airmass.png")
+        assert response.headers["X-Accel-Redirect"] == "/internal/test_results/image_comparison/diff%20airmass.png"
+        assert response.mimetype == "image/png"
+        assert response.get_data() == b""
+        assert not response.cache_control.immutable
@@ -0,0 +1,49 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import subprocess
+
+from git_cache import checkout_pull_request, mirror_path
+
+
+def _git(*args):
+    subprocess.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_mirror_path(tmp_path):
+    assert mirror_path("pytroll/satpy", tmp_path) == str(tmp_path / "pytroll" / "satpy.git")
+
+
+def test_checkout_pull_request(tmp_path):
+    """Test that the head of a pull request is checked out from the mirror without copying objects."""
+    work = tmp_path / "work"
+    _git("init", "--quiet", str(work))
+    (work / "satpy.py").write_text("version = 1\n")
+    _git("-C", str(work), "add", "satpy.py")
+    _git("-C", str(work), "commit", "--quiet", "-m", "initial")
+    (work / "satpy.py").write_text("version = 2\n")
+    _git("-C", str(work), "commit", "--quiet", "-am", "pull request")
+    mirror = tmp_path / "pytroll" / "satpy.git"
+    _git("clone", "--bare", "--quiet", str(work), str(mirror))
+    _git("-C", str(mirror), "update-ref", "refs/pull/42/head", "HEAD")
+    _git("-C", str(mirror), "reset", "--soft", "HEAD~1")
+
+    repo_dir = tmp_path / "repository"
+    checkout_pull_request(str(mirror), 42, "main", str(repo_dir))
+
+    assert (repo_dir / "satpy.py").read_text() == "version = 2\n"
+    assert (repo_dir / ".git" / "objects" / "info" / "alternates").exists()
@@ -0,0 +1,60 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from github_client import GitHubClient, RateLimitExceeded
+
+
+def response(status_code, headers):
+    return MagicMock(status_code=status_code, headers=headers, ok=status_code < 400)
+
+
+def test_membership_revalidated_with_etag():
+    """Test that an expired membership is revalidated with its ETag and kept on 304."""
+    client = GitHubClient("token", membership_ttl=0)
+    with patch.object(client.session, "request", side_effect=[response(204, {"ETag": '"abc"'}),
+                                                                response(304, {})]) as request:
+        assert client.is_org_member("pytroll", "gerritholl")
+        assert client.is_org_member("pytroll", "gerritholl")
+    assert request.call_args.kwargs["headers"] == {"If-None-Match": '"abc"'}
+
+
+def test_exhausted_rate_limit():
+    """Test that requests fail without calling GitHub while the rate limit is exhausted for long."""
+    client = GitHubClient("token", max_rate_limit_wait=60)
+    headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 3600)}
+    with patch.object(client.session, "request", return_value=response(204, headers)) as request:
+        client.is_org_member("pytroll", "gerritholl")
+        with pytest.raises(RateLimitExceeded):
+            client.post_comment("pytroll/satpy", 1, "comment")
+    assert request.call_count == 1
+
+
+def test_membership_errors_and_non_members():
+    """Test that a server error raises instead of denying the membership, and that non-members are asked again."""
+    client = GitHubClient("token")
+    error = response(502, {})
+    error.raise_for_status.side_effect = requests.HTTPError("502 Server Error")
+    with patch.object(client.session, "request", side_effect=[error, response(404, {}), response(204, {})]):
+        with pytest.raises(requests.HTTPError):
+            client.is_org_member("pytroll", "newmember")
+        assert not client.is_org_member("pytroll", "newmember")
+        assert client.is_org_member("pytroll", "newmember")
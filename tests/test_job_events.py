@@ -0,0 +1,53 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from job_events import read_new_lines, tail_offset, stream_job_events
+from job_queue import JobQueue
+
+
+def test_read_new_lines_leaves_partial_line(tmp_path):
+    """Test that only complete lines are read and that the offset continues after them."""
+    log = tmp_path / "output.log"
+    log.write_text("first\nsec")
+    assert read_new_lines(str(log), 0, 1024) == [("first", 6)]
+
+    with open(log, "a") as file:
+        file.write("ond\nthird\n")
+    assert read_new_lines(str(log), 6, 1024) == [("second", 13), ("third", 19)]
+    assert read_new_lines(str(log), 19, 1024) == []
+
+    # A recreated log is read from the start
+    log.write_text("new\n")
+    assert read_new_lines(str(log), 19, 1024) == [("new", 4)]
+    assert tail_offset(str(log), 2) == 4
+
+
+def test_stream_job_events(tmp_path):
+    """Test that the stream sends the log, the progress and ends after a finished job."""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit_for_pull_request("pytroll/satpy", 1, "https://github.com/pytroll/satpy.git", "main", "aaaaaaa")
+    queue.claim("runner", 1)
+    queue.finish(job_id, "runner", "done", result="2024-11-05-10-00-00")
+    log = tmp_path / "output.log"
+    log.write_text("### phase behave 1730800800.000\n[shard 1]   Scenario Outline: Generate and compare images -- @1.2 \nsecret token\n")
+
+    events = "".join(stream_job_events(queue, job_id, str(log), redact="token", poll_interval=0))
+
+    assert 'event: phase\ndata: {"phase": "behave", "start": 1730800800.0}' in events
+    assert '"name": "Generate and compare images -- @1.2", "shard": 1' in events
+    assert "secret [REDACTED]" in events
+    assert events.rstrip().endswith('"result": "2024-11-05-10-00-00"}')
+    assert "event: end" in events
@@ -0,0 +1,146 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from pytest import fixture, raises
+
+from job_queue import JobQueue, MAX_ATTEMPTS
+
+
+@fixture
+def job_queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite"))
+
+
+def test_jobs_are_claimed_in_order(job_queue):
+    """Test that the queue is worked off first in, first out."""
+    first = job_queue.submit_for_pull_request("pytroll/satpy", 1, "https://github.com/a/satpy.git", "feature-a", "aaaaaaa")
+    second = job_queue.submit_for_pull_request("pytroll/satpy", 2, "https://github.com/b/satpy.git", "feature-b", "bbbbbbb")
+    assert job_queue.position(second) == 1
+
+    job = job_queue.claim("runner-a", 2)
+    assert job["id"] == first
+    assert job["status"] == "running"
+    assert job_queue.position(second) == 0
+    assert job_queue.claim("runner-b", 2)["id"] == second
+    assert job_queue.claim("runner-a", 2) is None
+
+
+def test_claim_respects_the_slots_of_all_processes(tmp_path):
+    """Test that two queues on the same database never run more jobs than slots."""
+    queue_a = JobQueue(str(tmp_path / "jobs.sqlite"))
+    queue_b = JobQueue(str(tmp_path / "jobs.sqlite"))
+    for pull_number in range(3):
+        queue_a.submit_for_pull_request("pytroll/satpy", pull_number, "url", "feature", "aaaaaaa")
+    assert queue_a.claim("process-a", 2)["pull_number"] == 0
+    assert queue_b.claim("process-b", 2)["pull_number"] == 1
+    assert queue_b.claim("process-b", 2) is None
+
+
+def test_finish_job(job_queue):
+    job_id = job_queue.submit_for_pull_request("pytroll/satpy", 1, "https://github.com/a/satpy.git", "feature-a", "aaaaaaa")
+    job_queue.claim("runner-a", 1)
+    assert not job_queue.finish(job_id, "runner-b", "done")
+    assert job_queue.finish(job_id, "runner-a", "failed", "boom")
+    job = job_queue.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
+    assert job["finished"] >= job["started"]
+    with raises(ValueError):
+        job_queue.finish(job_id, "runner-a", "running")
+
+
+def test_recover_stale_jobs(job_queue):
+    """Test that the jobs of a runner that stopped sending heartbeats are released."""
+    job_id = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "aaaaaaa")
+    job_queue.claim("dead-runner", 1)
+    assert job_queue.recover_stale(60) == []
+    time.sleep(0.01)
+    assert job_queue.recover_stale(0) == [job_id]
+    assert job_queue.get(job_id)["status"] == "queued"
+    assert not job_queue.finish(job_id, "dead-runner", "done")
+
+    for attempt in range(MAX_ATTEMPTS - 1):
+        job_queue.claim("dead-runner", 1)
+        time.sleep(0.01)
+        job_queue.recover_stale(0)
+    assert job_queue.get(job_id)["status"] == "failed"
+
+
+def test_queue_is_persistent(tmp_path):
+    """Test that queued jobs survive a restart of the server."""
+    job_id = JobQueue(str(tmp_path / "jobs.sqlite")).submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a",
+                                                                              "aaaaaaa")
+    assert JobQueue(str(tmp_path / "jobs.sqlite")).claim("runner-a", 1)["id"] == job_id
+
+
+def test_newer_commit_supersedes_jobs_of_pull_request(job_queue):
+    """Test that triggers for a commit share a job and that a newer commit supersedes the older jobs."""
+    running = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "aaaaaaa")
+    job_queue.claim("runner-a", 2)
+    queued = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "bbbbbbb", debounce=60)
+    assert job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "bbbbbbb") == queued
+    # The job is not claimed before the debounce delay passed
+    assert job_queue.claim("runner-a", 2) is None
+
+    assert job_queue.cancel_requests("runner-a") == {running: "superseded"}
+    job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "ccccccc")
+    assert job_queue.get(queued)["status"] == "superseded"
+    assert job_queue.finish(running, "runner-a", "failed", "stopped")
+    assert job_queue.get(running)["status"] == "superseded"
+    assert job_queue.get(running)["error"] == f"Superseded by job {queued} for commit bbbbbbb."
+
+
+def test_cancel_jobs(job_queue):
+    """Test that cancelled queued jobs end right away and running ones are asked to stop."""
+    running = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "aaaaaaa")
+    job_queue.claim("runner-a", 2)
+    queued = job_queue.submit_for_pull_request("pytroll/satpy", 2, "url", "feature-b", "bbbbbbb", debounce=60)
+    other = job_queue.submit_for_pull_request("pytroll/satpy", 3, "url", "feature-c", "ccccccc")
+
+    assert job_queue.cancel_pull_request("pytroll/satpy", 1, "Cancelled by mraspaud.") == [running]
+    assert job_queue.cancel_pull_request("pytroll/satpy", 2, "Cancelled by mraspaud.") == [queued]
+    assert job_queue.get(queued)["status"] == "cancelled"
+    assert job_queue.cancel_requests("runner-a") == {running: "cancelled"}
+    # A job is only cancelled once
+    assert not job_queue.cancel(running, "Cancelled through the API.")
+    assert job_queue.finish(running, "runner-a", "failed", "stopped")
+    assert job_queue.get(running)["status"] == "cancelled"
+    assert job_queue.get(running)["error"] == "Cancelled by mraspaud."
+    assert job_queue.cancel(other, "Cancelled through the API.")
+    assert job_queue.get(other)["status"] == "cancelled"
+
+
+def test_cancel_overdue_jobs(job_queue):
+    """Test that jobs running for longer than the timeout are asked to stop and end as failed."""
+    job_id = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "aaaaaaa")
+    job_queue.claim("runner-a", 2)
+    assert job_queue.cancel_overdue(3600) == []
+    time.sleep(0.01)
+    assert job_queue.cancel_overdue(0.001) == [job_id]
+    assert job_queue.cancel_requests("runner-a") == {job_id: "failed"}
+    assert job_queue.finish(job_id, "runner-a", "failed", "stopped")
+    assert job_queue.get(job_id)["error"] == "The job was stopped after running for more than 0.001 seconds."
+
+
+def test_cached_results_supersede_jobs_of_pull_request(job_queue):
+    """Test that answering a newer commit with cached results stops the jobs for older commits."""
+    running = job_queue.submit_for_pull_request("pytroll/satpy", 1, "url", "feature-a", "aaaaaaa")
+    job_queue.claim("runner-a", 2)
+    cached = job_queue.record_cached("pytroll/satpy", 1, "url", "feature-a", "bbbbbbb", "2024-11-05-10-00-00")
+    assert job_queue.get(cached)["status"] == "cached"
+    assert job_queue.cancel_requests("runner-a") == {running: "superseded"}
@@ -0,0 +1,46 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from job_timings import write_timings
+
+
+def test_write_timings(tmp_path):
+    """Test that the phases are timed from the log markers and the scenarios from the behave reports."""
+    job = tmp_path / "job"
+    results = tmp_path / "results"
+    (job / "junit" / "1").mkdir(parents=True)
+    results.mkdir()
+    (job / "output.log").write_text(
+        "### phase checkout 1730800800.000\ncloning\n### phase behave 1730800810.500\n"
+        "### phase publish 1730800900.000\n### phase done 1730800901.000\n")
+    (job / "junit" / "1" / "TESTS-image_comparison.xml").write_text(
+        '<testsuite name="image_comparison.Image comparison" timestamp="2024-11-05T10:01:40">'
+        '<testcase classname="image_comparison.Image comparison" name="Compare -- @1.1" status="passed" time="60.0"/>'
+        '<testcase classname="image_comparison.Image comparison" name="Compare -- @1.2" status="failed" time="20.0"/>'
+        '</testsuite>')
+
+    timings = write_timings(str(job), [str(results)])
+
+    assert timings["phases"] == [
+        {"phase": "checkout", "start": 1730800800.0, "end": 1730800810.5, "duration": 10.5},
+        {"phase": "behave", "start": 1730800810.5, "end": 1730800900.0, "duration": 89.5},
+        {"phase": "publish", "start": 1730800900.0, "end": 1730800901.0, "duration": 1.0},
+    ]
+    assert [(s["name"], s["status"], s["shard"], s["start"], s["end"]) for s in timings["scenarios"]] == [
+        ("Compare -- @1.1", "passed", 1, 1730800820.0, 1730800880.0),
+        ("Compare -- @1.2", "failed", 1, 1730800880.0, 1730800900.0),
+    ]
+    assert (results / "timings.json").read_text() == (job / "timings.json").read_text()
@@ -0,0 +1,44 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import json
+
+from flask import Flask
+
+from json_api import json_response
+
+
+def test_json_response():
+    """Test that JSON responses are compressed for clients accepting gzip and answer conditional requests."""
+    app = Flask(__name__)
+    data = {"runs": [{"timestamp": f"2024-01-01_00-00-{second:02d}", "outcome": "passed"} for second in range(60)]}
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = json_response(data)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(response.get_data())) == data
+        etag = response.headers["ETag"]
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip", "If-None-Match": etag}):
+        response = json_response(data)
+        assert response.status_code == 304
+        assert "Content-Encoding" not in response.headers
+
+    with app.test_request_context():
+        response = json_response({"runs": []})
+        assert "Content-Encoding" not in response.headers
+        assert json.loads(response.get_data()) == {"runs": []}
@@ -0,0 +1,41 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from metrics import Metrics, format_labels
+
+
+def test_render_metrics(tmp_path):
+    """Test that the metrics of all processes are rendered in the Prometheus text format."""
+    db_path = str(tmp_path / "jobs.sqlite")
+    other_process = Metrics(db_path)
+    other_process.inc("image_comparison_jobs_total", {"status": "done"})
+    # The values are only added up in memory until they are flushed
+    assert 'image_comparison_jobs_total{status="done"}' not in Metrics(db_path).render()
+    other_process.flush()
+    metrics = Metrics(db_path)
+    metrics.inc("image_comparison_jobs_total", {"status": "done"})
+    metrics.observe("image_comparison_job_phase_duration_seconds", 3, {"phase": "install"})
+    metrics.observe("image_comparison_job_phase_duration_seconds", 100000, {"phase": "install"})
+
+    text = metrics.render([("image_comparison_jobs", "Jobs.", {format_labels({"status": "queued"}): 2})])
+
+    assert 'image_comparison_jobs_total{status="done"} 2\n' in text
+    assert 'image_comparison_job_phase_duration_seconds_bucket{phase="install",le="1"} 0\n' in text
+    assert 'image_comparison_job_phase_duration_seconds_bucket{phase="install",le="5"} 1\n' in text
+    assert 'image_comparison_job_phase_duration_seconds_bucket{phase="install",le="+Inf"} 2\n' in text
+    assert 'image_comparison_job_phase_duration_seconds_sum{phase="install"} 100003\n' in text
+    assert 'image_comparison_job_phase_duration_seconds_count{phase="install"} 2\n' in text
+    assert '# TYPE image_comparison_jobs gauge\nimage_comparison_jobs{status="queued"} 2\n' in text
@@ -0,0 +1,66 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from unittest.mock import patch
+
+from outbox import CommentOutbox, FAILED_RETRY_INTERVAL, MAX_ATTEMPTS
+
+
+def test_status_messages_are_merged_into_one_comment(tmp_path):
+    """Test that the messages of a job create one comment that later messages edit."""
+    outbox = CommentOutbox(str(tmp_path / "jobs.sqlite"), "token", coalesce_delay=5)
+    outbox.post("job-1", "pytroll/satpy", 2697, "Starting to clone and test the repository pytroll/satpy")
+    outbox.post("job-1", "pytroll/satpy", 2697, "The testing process was executed successfully.")
+    # The messages are only sent once no new one came for a while
+    assert outbox.claim("sender") is None
+
+    with patch("outbox.github_client") as github_client:
+        client = github_client.return_value
+        client.post_comment.return_value = {"id": 42}
+        outbox.deliver(outbox.claim("sender", now=time.time() + 5))
+        client.post_comment.assert_called_once_with(
+            "pytroll/satpy", 2697,
+            "Starting to clone and test the repository pytroll/satpy\n\nThe testing process was executed successfully.")
+
+        outbox.post("job-1", "pytroll/satpy", 2697, "Results cached.")
+        outbox.deliver(outbox.claim("sender", now=time.time() + 5))
+        assert client.request.call_args.args == ("PATCH", "/repos/pytroll/satpy/issues/comments/42")
+        assert client.request.call_args.kwargs["json"]["body"].endswith("\n\nResults cached.")
+
+    assert outbox.claim("sender", now=time.time() + 5) is None
+    assert outbox.get("job-1")["comment_id"] == 42
+
+
+def test_failed_comment_is_kept_and_retried(tmp_path):
+    """Test that a comment failing too often is marked as failed instead of sent, and retried later."""
+    outbox = CommentOutbox(str(tmp_path / "jobs.sqlite"), "token", coalesce_delay=0)
+    outbox.post("job-1", "pytroll/satpy", 2697, "The testing process was executed successfully.")
+
+    with patch("outbox.github_client") as github_client:
+        client = github_client.return_value
+        client.post_comment.side_effect = RuntimeError("GitHub is down")
+        for _ in range(MAX_ATTEMPTS):
+            outbox.deliver(outbox.claim("sender", now=time.time() + 3600))
+        comment = outbox.get("job-1")
+        assert comment["failed"] and comment["sent_version"] == 0
+        assert outbox.claim("sender", now=time.time() + 3600) is None
+
+        client.post_comment.side_effect = None
+        client.post_comment.return_value = {"id": 42}
+        outbox.deliver(outbox.claim("sender", now=time.time() + FAILED_RETRY_INTERVAL))
+    comment = outbox.get("job-1")
+    assert not comment["failed"] and comment["sent_version"] == 1 and comment["comment_id"] == 42
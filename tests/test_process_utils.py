@@ -0,0 +1,40 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import subprocess
+import threading
+import time
+
+from pytest import raises
+
+from process_utils import JobCancelled, run_cancellable
+
+
+def test_run_cancellable_terminates_the_command_when_cancelled():
+    """Test that a command, e.g. a long fetch or image build, ends within seconds of the job being cancelled."""
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    start = time.monotonic()
+    with raises(JobCancelled):
+        run_cancellable(['sleep', '30'], cancel, poll_interval=0.1)
+    assert time.monotonic() - start < 5
+
+
+def test_run_cancellable_raises_on_errors():
+    run_cancellable(['true'], threading.Event(), poll_interval=0.1)
+    with raises(subprocess.CalledProcessError):
+        run_cancellable(['false'], poll_interval=0.1)
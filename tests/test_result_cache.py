@@ -0,0 +1,60 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+
+from result_cache import ResultCache, data_version, scenario_selection_key
+
+
+def test_lookup_cached_results(tmp_path):
+    """Test that results are found by their key as long as their directory exists."""
+    results = tmp_path / "test_results"
+    (results / "image_comparison" / "2024-11-05-10-00-00").mkdir(parents=True)
+    cache = ResultCache(str(tmp_path / "jobs.sqlite"), str(results))
+    cache.store("abc123", "runner1", "data1", "changed-1", "2024-11-05-10-00-00", job_id=1)
+
+    assert cache.lookup("abc123", "runner1", "data1", "changed-1") == "2024-11-05-10-00-00"
+    assert cache.lookup("abc123", "runner2", "data1", "changed-1") is None
+    assert cache.lookup("abc123", "runner1", "data2", "changed-1") is None
+    # The results of a subset of the scenarios are not reused for a run of all of them
+    assert cache.lookup("abc123", "runner1", "data1", "all") is None
+
+    shutil.rmtree(results / "image_comparison" / "2024-11-05-10-00-00")
+    assert cache.lookup("abc123", "runner1", "data1", "changed-1") is None
+
+
+def test_scenario_selection_key(tmp_path):
+    rules = tmp_path / "scenario_rules.json"
+    rules.write_text('{"rules": []}')
+    assert scenario_selection_key("all", "base1", str(rules), "all") == "all"
+    assert scenario_selection_key("changed", None, str(rules), "all") == "all"
+    key = scenario_selection_key("changed", "base1", str(rules), "all")
+    assert key.startswith("changed-")
+    assert scenario_selection_key("changed", "base2", str(rules), "all") != key
+    assert scenario_selection_key("changed", "base1", str(rules), "none") != key
+    rules.write_text('{"rules": [{"files": ["*"]}]}')
+    assert scenario_selection_key("changed", "base1", str(rules), "all") != key
+
+
+def test_data_version_ignores_test_results(tmp_path):
+    (tmp_path / "satellite_data").mkdir()
+    (tmp_path / "satellite_data" / "goes16.nc").write_bytes(b"data")
+    version = data_version(str(tmp_path))
+    (tmp_path / "test_results").mkdir()
+    (tmp_path / "test_results" / "test_results.txt").write_text("results")
+    assert data_version(str(tmp_path)) == version
+    (tmp_path / "satellite_data" / "goes17.nc").write_bytes(b"data")
+    assert data_version(str(tmp_path)) != version
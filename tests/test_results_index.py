@@ -0,0 +1,66 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+
+from results_index import ResultsIndex
+
+
+def make_run(results, timestamp, mtime, images=()):
+    run = results / "image_comparison" / timestamp
+    for kind in ("difference", "generated"):
+        (run / kind).mkdir(parents=True)
+    for path in images:
+        (run / path).write_bytes(b"png")
+    os.utime(run, (mtime, mtime))
+
+
+def test_results_index_follows_results_directory(tmp_path):
+    """Test that runs added and removed outside of the server are picked up."""
+    results = tmp_path / "test_results"
+    make_run(results, "2024-11-05-10-00-00", 1000, ["difference/diff_airmass.png", "generated/generated_airmass.png",
+                                                     "generated/notes.txt"])
+    make_run(results, "2024-11-06-10-00-00", 2000)
+    index = ResultsIndex(str(tmp_path / "jobs.sqlite"), str(results))
+
+    runs, cursor = index.page(1)
+    assert [run["timestamp"] for run in runs] == ["2024-11-06-10-00-00"]
+    runs, cursor = index.page(1, cursor)
+    assert [run["timestamp"] for run in runs] == ["2024-11-05-10-00-00"]
+    assert cursor is None
+    assert index.images("2024-11-05-10-00-00", "generated") == ["generated_airmass.png"]
+
+    shutil.rmtree(results / "image_comparison" / "2024-11-06-10-00-00")
+    make_run(results, "2024-11-07-10-00-00", 3000, ["difference/diff_ash.png"])
+    os.utime(results / "image_comparison", (4000, 4000))
+    assert index.latest() == "2024-11-07-10-00-00"
+    assert index.summary("2024-11-06-10-00-00") is None
+    assert index.images("2024-11-07-10-00-00", "difference") == ["diff_ash.png"]
+
+
+def test_filter_runs_by_outcome_and_date(tmp_path):
+    results = tmp_path / "test_results"
+    make_run(results, "2024-11-05-10-00-00", 1000)
+    make_run(results, "2024-11-06-10-00-00", 2000)
+    (results / "image_comparison" / "2024-11-06-10-00-00" / "timings.json").write_text(
+        '{"phases": [], "scenarios": [{"status": "passed"}, {"status": "failed"}]}')
+    index = ResultsIndex(str(tmp_path / "jobs.sqlite"), str(results))
+
+    runs, cursor = index.page(10, outcome="failed")
+    assert [(run["timestamp"], run["passed"], run["failed"]) for run in runs] == [("2024-11-06-10-00-00", 1, 1)]
+    runs, cursor = index.page(10, since="2024-11-05-00-00-00", until="2024-11-05-23-59-59")
+    assert [(run["timestamp"], run["outcome"]) for run in runs] == [("2024-11-05-10-00-00", "unknown")]
@@ -0,0 +1,77 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from blob_store import BlobStore
+from results_index import ResultsIndex
+from retention import RetentionManager
+
+
+def make_run(results, timestamp, mtime):
+    run = results / "image_comparison" / timestamp
+    (run / "generated").mkdir(parents=True)
+    (run / "generated" / "generated_airmass.png").write_bytes(b"png")
+    os.utime(run, (mtime, mtime))
+
+
+def test_retention_keeps_pinned_and_latest_runs(tmp_path):
+    """Test that expired runs are removed with their thumbnails, except the pinned and the latest ones."""
+    results = tmp_path / "test_results"
+    for day, timestamp in enumerate(["2024-11-01-10-00-00", "2024-11-02-10-00-00", "2024-11-03-10-00-00",
+                                     "2024-11-04-10-00-00"]):
+        make_run(results, timestamp, day * 86400)
+    (tmp_path / "thumbnails" / "2024-11-01-10-00-00").mkdir(parents=True)
+    index = ResultsIndex(str(tmp_path / "jobs.sqlite"), str(results))
+    index.pin("2024-11-02-10-00-00")
+    index.add("2024-11-04-10-00-00", {"id": 4, "repo_full_name": "pytroll/satpy", "pull_number": 1, "head_sha": "a"})
+    # The job directories of an expired job, of the job of a kept run and of a recent job
+    for job_id, mtime in ((3, 0), (4, 0), (5, 4 * 86400)):
+        (tmp_path / "jobs" / str(job_id)).mkdir(parents=True)
+        os.utime(tmp_path / "jobs" / str(job_id), (mtime, mtime))
+    retention = RetentionManager(index, trash_dir=str(tmp_path / "trash"), max_age_days=1, min_free_bytes=0,
+                                 cache_dirs=(str(tmp_path / "thumbnails"),), job_dir_base=str(tmp_path / "jobs"))
+
+    assert retention.enforce(now=4 * 86400) == ["2024-11-01-10-00-00", "2024-11-03-10-00-00"]
+
+    assert sorted(os.listdir(results / "image_comparison")) == ["2024-11-02-10-00-00", "2024-11-04-10-00-00"]
+    assert not (tmp_path / "thumbnails" / "2024-11-01-10-00-00").exists()
+    assert [run["timestamp"] for run in index.page(10)[0]] == ["2024-11-04-10-00-00", "2024-11-02-10-00-00"]
+    assert os.listdir(tmp_path / "trash") == [".lock"]
+    assert sorted(os.listdir(tmp_path / "jobs")) == ["4", "5"]
+
+
+def test_retention_collects_blobs_once_enough_space_is_expected(tmp_path, monkeypatch):
+    """Test that a low space pass scans the blob store only when the removed runs are expected to free enough."""
+    results = tmp_path / "test_results"
+    store = BlobStore(str(tmp_path / "blobs"))
+    timestamps = ["2024-11-01-10-00-00", "2024-11-02-10-00-00", "2024-11-03-10-00-00", "2024-11-04-10-00-00"]
+    for day, timestamp in enumerate(timestamps):
+        make_run(results, timestamp, day * 86400)
+        (results / "image_comparison" / timestamp / "generated" / "generated_airmass.png").write_bytes(bytes([day]) * 100)
+        store.ingest_run(str(results / "image_comparison" / timestamp))
+    index = ResultsIndex(str(tmp_path / "jobs.sqlite"), str(results))
+    retention = RetentionManager(index, store, trash_dir=str(tmp_path / "trash"), max_age_days=30, min_free_bytes=350,
+                                 cache_dirs=(), job_dir_base=None)
+    # A disk of 550 bytes holding the blobs
+    monkeypatch.setattr(retention, "free_bytes", lambda: 550 - sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tmp_path / "blobs") for name in names))
+    collect_garbage = store.collect_garbage
+    calls = []
+    monkeypatch.setattr(store, "collect_garbage", lambda: calls.append(1) or collect_garbage())
+
+    assert retention.enforce(now=4 * 86400) == timestamps[:2]
+    assert len(calls) == 2
@@ -0,0 +1,59 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import pytest
+
+from process_utils import JobCancelled
+from runner_image import (STALE_IMAGE_GRACE, build_lock, mark_used, recently_used, runner_image_fingerprint,
+                          runner_image_tag)
+
+
+def test_fingerprint_changes_with_spec(tmp_path):
+    """Test that the fingerprint follows the Dockerfile and the build arguments."""
+    dockerfile = tmp_path / "Dockerfile"
+    dockerfile.write_text("FROM python:3.10-slim\n")
+    args = {"RUNNER_PACKAGES": "satpy behave"}
+    fingerprint = runner_image_fingerprint(dockerfile, args)
+    assert fingerprint == runner_image_fingerprint(dockerfile, dict(args))
+    assert fingerprint != runner_image_fingerprint(dockerfile, {"RUNNER_PACKAGES": "satpy behave pytest"})
+    dockerfile.write_text("FROM python:3.12-slim\n")
+    assert fingerprint != runner_image_fingerprint(dockerfile, args)
+
+
+def test_runner_image_tag(tmp_path):
+    """Test that the tag is made of the image name and the fingerprint."""
+    dockerfile = tmp_path / "Dockerfile"
+    dockerfile.write_text("FROM python:3.10-slim\n")
+    name, tag = runner_image_tag(dockerfile, {}).split(":")
+    assert name == "pytroll-image-comparison-runner"
+    assert tag == runner_image_fingerprint(dockerfile, {})
+
+
+def test_build_lock(tmp_path):
+    """Test that the build lock is exclusive across open files, and that waiting for it ends when a job is cancelled."""
+    cancel = threading.Event()
+    cancel.set()
+    with build_lock(state_dir=str(tmp_path)):
+        with pytest.raises(JobCancelled):
+            with build_lock(cancel, state_dir=str(tmp_path)):
+                pass
+    with build_lock(cancel, state_dir=str(tmp_path)):
+        mark_used("pytroll-image-comparison-runner:abc", str(tmp_path))
+    assert recently_used("pytroll-image-comparison-runner:abc", str(tmp_path))
+    assert not recently_used("pytroll-image-comparison-runner:abc", str(tmp_path), now=time.time() + STALE_IMAGE_GRACE)
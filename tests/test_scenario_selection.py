@@ -0,0 +1,65 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from scenario_selection import select_patterns, select_scenarios
+
+RULES = {
+    "run_all": ["satpy/tests/behave/*"],
+    "ignore": ["doc/*", "satpy/tests/*"],
+    "rules": [
+        {"paths": ["satpy/readers/abi_*", "satpy/etc/composites/abi.yaml"], "select": ["abi_*", "GOES*"]},
+        {"paths": ["satpy/readers/seviri_*"], "select": ["seviri_*"]},
+    ],
+}
+
+FEATURE = """Feature: Image comparison
+
+  Scenario Outline: Compare generated image with reference image
+    Given I have a <composite> reference image file from <satellite>
+    When I generate a new <composite> image file from <satellite> with <reader>
+    Then the generated image should be the same as the reference image
+
+    Examples:
+      | satellite | composite | reader          |
+      | GOES16    | airmass   | abi_l1b         |
+      # | GOES18    | ash       | abi_l1b         |
+      | Meteosat  | natural   | seviri_l1b_hrit |
+      | Himawari  | true_color | ahi_hsd        |
+"""
+
+
+def test_select_patterns():
+    """Test that changed files are mapped to the patterns of their rules."""
+    assert select_patterns(["satpy/readers/abi_l1b.py", "doc/source/index.rst"], RULES) == ["GOES*", "abi_*"]
+    assert select_patterns(["satpy/readers/abi_l1b.py", "satpy/tests/behave/features/steps.py"], RULES) is None
+
+
+def test_select_patterns_fallback():
+    """Test that files without a rule run all scenarios unless the fallback says otherwise."""
+    files = ["satpy/readers/seviri_l1b_hrit.py", "satpy/scene.py"]
+    assert select_patterns(files, RULES, fallback="all") is None
+    assert select_patterns(files, RULES, fallback="none") == ["seviri_*"]
+    assert select_patterns(["doc/source/index.rst"], RULES, fallback="none") == []
+
+
+def test_select_scenarios(tmp_path):
+    """Test that the example rows matching the patterns are selected by their line."""
+    (tmp_path / "features").mkdir()
+    (tmp_path / "features" / "image_comparison.feature").write_text(FEATURE)
+    assert select_scenarios(str(tmp_path), ["abi_*", "GOES*"]) == ["features/image_comparison.feature:10"]
+    assert select_scenarios(str(tmp_path), ["SEVIRI_*", "ahi_*"]) == ["features/image_comparison.feature:12",
+                                                                       "features/image_comparison.feature:13"]
+    assert select_scenarios(str(tmp_path), ["fci_*"]) == []
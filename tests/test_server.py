@@ -0,0 +1,109 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import hmac
+import importlib
+import json
+import sys
+import types
+
+from pytest import fixture
+
+from config import Config
+from job_queue import JobQueue
+
+WEBHOOK_SECRET = "webhook-secret"
+API_TOKEN = "api-token"
+
+
+@fixture
+def server(tmp_path, monkeypatch):
+    """Return the server module with a stub `secret` module, its database in `tmp_path` and no background threads."""
+    monkeypatch.setitem(sys.modules, "secret", types.SimpleNamespace(
+        GITHUB_TOKEN="ghp_test", WEBHOOK_SECRET=WEBHOOK_SECRET, API_TOKEN=API_TOKEN))
+    server = importlib.import_module("server")
+    monkeypatch.setattr(server, "WEBHOOK_SECRET", WEBHOOK_SECRET)
+    monkeypatch.setattr(server, "API_TOKEN", API_TOKEN)
+    monkeypatch.setattr(server, "TEST_RESULTS_BASE_PATH", str(tmp_path / "test_results"))
+    monkeypatch.setattr(Config, "JOB_DB_PATH", str(tmp_path / "jobs.sqlite"))
+    (tmp_path / "test_results" / "image_comparison").mkdir(parents=True)
+    for worker in (server.Metrics, server.CommentOutbox, server.RunnerPool, server.RetentionManager,
+                   server.PyramidWorker, server.WebhookDispatcher):
+        monkeypatch.setattr(worker, "start", lambda self: None)
+    return server
+
+
+def test_webhook(server):
+    """Test that deliveries are only accepted with the signature of their raw body, and only once."""
+    client = server.create_app().test_client()
+    body = json.dumps({"action": "submitted"}, indent=4).encode()
+    signature = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    headers = {"X-GitHub-Event": "pull_request_review", "X-GitHub-Delivery": "72d3162e", "Content-Type": "application/json"}
+
+    assert client.post("/webhook", data=body, headers=headers).status_code == 400
+    # The same JSON serialized differently has another signature
+    assert client.post("/webhook", data=json.dumps({"action": "submitted"}).encode(),
+                       headers=dict(headers, **{"X-Hub-Signature-256": signature})).status_code == 403
+
+    response = client.post("/webhook", data=body, headers=dict(headers, **{"X-Hub-Signature-256": signature}))
+    assert response.status_code == 202
+    delivery_id = response.get_json()["delivery_id"]
+    assert client.get(f"/api/v1/deliveries/{delivery_id}").get_json()["status"] == "pending"
+
+    response = client.post("/webhook", data=body, headers=dict(headers, **{"X-Hub-Signature-256": signature}))
+    assert response.status_code == 200
+    assert response.get_json()["delivery_id"] == delivery_id
+
+
+def test_cancel_job(server):
+    """Test that jobs are only cancelled with the API token and that the answer tells how."""
+    client = server.create_app().test_client()
+    job_queue = JobQueue(Config.JOB_DB_PATH)
+    finished, running, queued = (job_queue.submit_for_pull_request("pytroll/satpy", pull_number,
+                                                                   "https://github.com/a/satpy.git", "feature", sha)
+                                 for pull_number, sha in ((1, "aaaaaaa"), (2, "bbbbbbb"), (3, "ccccccc")))
+    assert job_queue.claim("runner-1", 2)["id"] == finished
+    job_queue.finish(finished, "runner-1", "done")
+    assert job_queue.claim("runner-1", 2)["id"] == running
+    authorization = {"Authorization": f"Bearer {API_TOKEN}"}
+
+    assert client.post(f"/api/v1/jobs/{running}/cancel").status_code == 403
+    assert client.post(f"/api/v1/jobs/{running}/cancel", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert job_queue.get(running)["cancel_status"] is None
+
+    assert client.post(f"/api/v1/jobs/{running}/cancel", headers=authorization).status_code == 202
+    assert client.post(f"/api/v1/jobs/{queued}/cancel", headers=authorization).status_code == 200
+    assert job_queue.get(queued)["status"] == "cancelled"
+    assert client.post(f"/api/v1/jobs/{finished}/cancel", headers=authorization).status_code == 409
+    assert client.post("/api/v1/jobs/99/cancel", headers=authorization).status_code == 404
+
+
+def test_run_filters(server):
+    """Test that the run history refuses invalid filters."""
+    client = server.create_app().test_client()
+    assert client.get("/api/v1/runs?outcome=passed&since=2024-11-05").status_code == 200
+    for query in ("outcome=broken", "since=yesterday", "cursor=nonsense", "limit=many"):
+        assert client.get(f"/api/v1/runs?{query}").status_code == 400
+
+
+def test_browse_test_results(server):
+    """Test that the results directory can be browsed from its root."""
+    client = server.create_app().test_client()
+    response = client.get("/test_results/")
+    assert response.status_code == 200
+    assert b"image_comparison" in response.data
+    assert client.get("/test_results/image_comparison/$HOME").status_code == 400
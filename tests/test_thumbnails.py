@@ -0,0 +1,36 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+from PIL import Image
+
+from thumbnails import ensure_thumbnail
+
+
+def test_ensure_thumbnail(tmp_path):
+    """Test that a scaled down thumbnail is created once and reused afterwards."""
+    run = tmp_path / "test_results" / "image_comparison" / "2024-11-05-10-00-00" / "generated"
+    run.mkdir(parents=True)
+    Image.new("P", (2000, 1000)).save(run / "generated_airmass.png")
+
+    path = ensure_thumbnail(str(tmp_path / "test_results"), "2024-11-05-10-00-00", "generated", "generated_airmass.png",
+                            str(tmp_path / "thumbnails"), size=100)
+
+    with Image.open(path) as thumbnail:
+        assert thumbnail.size == (100, 50)
+    mtime = (tmp_path / "thumbnails").stat().st_mtime_ns
+    assert ensure_thumbnail(str(tmp_path / "test_results"), "2024-11-05-10-00-00", "generated", "generated_airmass.png",
+                            str(tmp_path / "thumbnails"), size=100) == path
+    assert (tmp_path / "thumbnails").stat().st_mtime_ns == mtime
@@ -0,0 +1,52 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from PIL import Image
+
+from tiles import ensure_pyramid, generate_run_pyramids, pyramid_levels
+
+
+def test_ensure_pyramid(tmp_path):
+    """Test that an image is cut into a complete Deep Zoom pyramid."""
+    generated = tmp_path / "test_results" / "image_comparison" / "2024-11-05-10-00-00" / "generated"
+    generated.mkdir(parents=True)
+    Image.new("RGB", (600, 300), "blue").save(generated / "generated_goes16_airmass.png")
+
+    path = ensure_pyramid(str(tmp_path / "test_results"), "2024-11-05-10-00-00", "generated", "goes16_airmass",
+                          str(tmp_path / "tiles"), str(tmp_path / "reference"))
+
+    assert 'Width="600" Height="300"' in open(path).read()
+    files = tmp_path / "tiles" / "2024-11-05-10-00-00" / "generated" / "goes16_airmass_files"
+    assert pyramid_levels(600, 300) == 11
+    assert sorted(os.listdir(files / "10")) == ["0_0.png", "0_1.png", "1_0.png", "1_1.png", "2_0.png", "2_1.png"]
+    assert os.listdir(files / "0") == ["0_0.png"]
+    with Image.open(files / "10" / "1_0.png") as tile:
+        # Inner tiles overlap their neighbours by a pixel on each side
+        assert tile.size == (256, 255)
+
+
+def test_generate_run_pyramids(tmp_path):
+    """Test that the pyramids of a run are cut for the images it has, skipping the missing ones."""
+    run = tmp_path / "test_results" / "image_comparison" / "2024-11-05-10-00-00"
+    for kind, name in (("generated", "generated_airmass.png"), ("reference", "reference_image_airmass.png")):
+        (run / kind).mkdir(parents=True)
+        Image.new("RGB", (10, 10)).save(run / kind / name)
+
+    generate_run_pyramids(str(tmp_path / "test_results"), "2024-11-05-10-00-00", ["airmass"], str(tmp_path / "tiles"))
+
+    assert sorted(os.listdir(tmp_path / "tiles" / "2024-11-05-10-00-00")) == ["generated", "reference"]
@@ -0,0 +1,63 @@
+# Copyright (c) 2024 pytroll-image-comparison-tests developers
+#
+# This file is part of pytroll-image-comparison-tests.
+#
+# pytroll-image-comparison-tests is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pytroll-image-comparison-tests is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pytroll-image-comparison-tests.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import hmac
+
+import pytest
+from werkzeug.exceptions import Forbidden
+
+from api_utils import verify_signature
+from webhooks import WebhookDeliveries
+
+
+def test_deliveries_are_processed_once(tmp_path):
+    """Test that a stored delivery is claimed by a single dispatcher and loses its payload once processed."""
+    deliveries = WebhookDeliveries(str(tmp_path / "jobs.sqlite"))
+    delivery_id, new = deliveries.record("72d3162e", "pull_request_review", b'{"action": "submitted"}')
+    assert new
+    # A redelivery is recognized by its GUID
+    assert deliveries.record("72d3162e", "pull_request_review", b'{"action": "submitted"}') == (delivery_id, False)
+
+    delivery = deliveries.claim("dispatcher-1")
+    assert (delivery["id"], delivery["payload"]) == (delivery_id, b'{"action": "submitted"}')
+    assert deliveries.claim("dispatcher-2") is None
+
+    deliveries.finish(delivery_id, "done", job_id=3)
+    assert deliveries.get(delivery_id)["status"] == "done"
+    assert deliveries.get(delivery_id)["job_id"] == 3
+    assert deliveries.record("72d3162e", "pull_request_review", b'{"action": "submitted"}') == (delivery_id, False)
+
+
+def test_failed_delivery_is_processed_again_when_redelivered(tmp_path):
+    deliveries = WebhookDeliveries(str(tmp_path / "jobs.sqlite"))
+    delivery_id, new = deliveries.record("72d3162e", "pull_request_review", b'{"action": "submitted"}')
+    deliveries.claim("dispatcher-1")
+    deliveries.finish(delivery_id, "failed", error="GitHub did not answer")
+
+    assert deliveries.record("72d3162e", "pull_request_review", b'{"action": "submitted"}') == (delivery_id, True)
+    assert deliveries.get(delivery_id)["status"] == "pending"
+    assert deliveries.get(delivery_id)["error"] is None
+    assert deliveries.claim("dispatcher-2")["payload"] == b'{"action": "submitted"}'
+
+
+def test_verify_signature_of_raw_body():
+    """Test that the signature is checked on the body as sent, whatever its formatting."""
+    body = b'{\n  "action": "submitted"\n}'
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    verify_signature(body, "secret", signature)
+    with pytest.raises(Forbidden):
+        verify_signature(b'{"action":"submitted"}', "secret", signature)